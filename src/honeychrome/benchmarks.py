@@ -0,0 +1,319 @@
+'''
+Benchmarks:
+-Times the stages a sample goes through from FCS file to plots, statistics and export, on synthetic spectral samples so
+ they run anywhere (no instrument, experiment or real data needed)
+-Synthetic samples: scatter, time and the fluorescence detectors of a spectral cytometer, with a panel of fluorophores
+ and autofluorescence mixed in per event; configurable numbers of events, detectors, fluorophores and AF spectra
+-Stages: write_fcs, sample_from_fcs, apply_transfer_matrix, apply_af_unmixing, calculate_lookup_tables,
+ apply_gates_in_place, calc_hists, calc_stats, nxn_grid (counting every tile of the NxN process grid) and batch_export
+ (unmixing and writing a folder of samples, as the unmixed exporter does)
+-Every stage runs on all the events of the sample (the max_display_events cap is not applied)
+
+run_benchmarks times each of benchmark_sizes in turn and returns a dict of results, with the versions and machine they
+were taken on, for regression tracking (python -m honeychrome.benchmarks [n_events ...] prints the results as json).
+'''
+
+import gc
+import os
+import platform
+import shutil
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+from copy import deepcopy
+from pathlib import Path
+
+import numpy as np
+
+import honeychrome.settings as settings
+from honeychrome.settings import (benchmark_sizes, benchmark_n_detectors, benchmark_n_fluorophores, benchmark_n_af,
+                                  benchmark_n_export_samples, settings_default, magnitude_ceiling, synthetic_event_rate)
+from honeychrome.controller_components.functions import (sample_from_fcs, apply_transfer_matrix, apply_gates_in_place,
+                                                         calc_hists, calc_stats, write_fcs, define_raw_fcs_keywords,
+                                                         define_fcs_keywords, export_unmixed_sample, StreamingFCSWriter,
+                                                         assign_default_transforms, generate_transformations)
+from honeychrome.controller_components.autospectral_functions import (precompute_af_matrices, precompute_joint_cov_extras,
+                                                                      apply_af_unmixing, AF_KERNEL_AVAILABLE)
+from honeychrome.controller_components.nxn_engine import NxNHistogramEngine
+
+import logging
+logger = logging.getLogger(__name__)
+
+stages = ['write_fcs', 'sample_from_fcs', 'apply_transfer_matrix', 'apply_af_unmixing', 'calculate_lookup_tables',
+          'apply_gates_in_place', 'calc_hists', 'calc_stats', 'nxn_grid', 'batch_export']
+
+
+def spectral_pnn(n_detectors):
+    '''channel names of the synthetic spectral cytometer: time, scatter, then the fluorescence detectors'''
+    return ['Time', 'FSC-A', 'FSC-H', 'SSC-A'] + [f'D{n:02d}-A' for n in range(1, n_detectors + 1)]
+
+
+def synthetic_raw_settings(pnn):
+    '''experiment raw settings for samples with channels spectral_pnn'''
+    raw_settings = deepcopy(settings_default['raw'])
+    fluorescence_channel_ids = [n for n, channel in enumerate(pnn) if channel.startswith('D')]
+    raw_settings.update({
+        'event_channels_pnn': pnn,
+        'time_channel_id': pnn.index('Time'),
+        'event_id_channel_id': None,
+        'scatter_channels': ['FSC', 'SSC'],
+        'scatter_channel_ids': [pnn.index(c) for c in ['FSC-A', 'FSC-H', 'SSC-A']],
+        'n_scatter_channels': 3,
+        'fluorescence_channels': [pnn[n].removesuffix('-A') for n in fluorescence_channel_ids],
+        'fluorescence_channel_ids': fluorescence_channel_ids,
+        'n_fluorophore_channels': len(fluorescence_channel_ids),
+    })
+    return raw_settings
+
+
+def synthetic_spectra(n_detectors=benchmark_n_detectors, n_fluorophores=benchmark_n_fluorophores, n_af=benchmark_n_af, seed=0):
+    '''
+    (n_fluorophores, n_detectors) fluorophore and (n_af, n_detectors) autofluorescence spectra, each peak-normalised
+    fluorophores peak across the detectors with a secondary (cross-laser) peak, so neighbours overlap as on a real panel;
+    autofluorescence is broad and towards the blue end
+    '''
+    rng = np.random.default_rng(seed)
+    detectors = np.arange(n_detectors)
+    peaks = np.linspace(0, n_detectors - 1, n_fluorophores) + rng.uniform(-0.5, 0.5, n_fluorophores)
+    widths = rng.uniform(0.8, 1.5, n_fluorophores) * n_detectors / n_fluorophores
+    secondary_peaks = (peaks + n_detectors / 3) % n_detectors
+    spectra = (np.exp(-0.5 * ((detectors - peaks[:, None]) / widths[:, None]) ** 2)
+               + 0.2 * np.exp(-0.5 * ((detectors - secondary_peaks[:, None]) / widths[:, None]) ** 2))
+    af_peaks = rng.uniform(0, n_detectors / 3, n_af)
+    af_spectra = np.exp(-0.5 * ((detectors - af_peaks[:, None]) / (n_detectors / 5)) ** 2) + 0.05
+    return spectra / spectra.max(axis=1, keepdims=True), af_spectra / af_spectra.max(axis=1, keepdims=True)
+
+
+def synthetic_spectral_events(n_events, spectra, af_spectra, first_event=0, seed=0):
+    '''
+    raw events (n_events, n_channels) in the order of spectral_pnn: events arrive at synthetic_event_rate, 5% are
+    doublets, and each carries every fluorophore (30% of events positive for each) plus one autofluorescence spectrum
+    '''
+    rng = np.random.default_rng(seed)
+    n_fluorophores, n_detectors = spectra.shape
+    events = np.empty((n_events, 4 + n_detectors), dtype=np.float32)
+    events[:, 0] = (first_event + np.arange(n_events)) / synthetic_event_rate
+    fsc = rng.normal(60_000, 10_000, n_events)
+    doublets = rng.random(n_events) < 0.05
+    events[:, 1] = np.where(doublets, 2 * fsc, fsc)
+    events[:, 2] = fsc * rng.normal(0.8, 0.03, n_events)
+    events[:, 3] = rng.lognormal(np.log(30_000), 0.4, n_events)
+
+    positive = rng.random((n_events, n_fluorophores)) < 0.3
+    abundances = np.where(positive, rng.lognormal(np.log(5_000), 0.8, positive.shape), rng.normal(0, 50, positive.shape))
+    fluorescence = abundances @ spectra
+    fluorescence += rng.lognormal(np.log(300), 0.5, n_events)[:, None] * af_spectra[rng.integers(0, len(af_spectra), n_events)]
+    fluorescence += rng.normal(0, 30, fluorescence.shape)
+    events[:, 4:] = fluorescence
+    return events
+
+
+def write_synthetic_spectral_fcs(path, n_events, spectra, af_spectra, seed=0, chunk_size=1_000_000):
+    '''write a raw sample of n_events synthetic_spectral_events to path, chunk_size events at a time; returns its channels'''
+    pnn = spectral_pnn(spectra.shape[1])
+    writer = StreamingFCSWriter(path, define_raw_fcs_keywords(pnn, Path(path).stem, magnitude_ceiling), len(pnn))
+    for n, start in enumerate(range(0, n_events, chunk_size)):
+        writer.append(synthetic_spectral_events(min(chunk_size, n_events - start), spectra, af_spectra, first_event=start, seed=seed + n))
+    writer.close()
+    return pnn
+
+
+def transfer_matrix_from_process(raw_settings, unmixed_settings, spectral_process):
+    '''raw -> unmixed transfer matrix, (n_raw, n_unmixed), as Controller.initialise_transfer_matrix builds it'''
+    compensation = np.linalg.inv(np.array(spectral_process['spillover'])).T
+    transfer_matrix = np.zeros((len(unmixed_settings['event_channels_pnn']), len(raw_settings['event_channels_pnn'])))
+    transfer_matrix[np.ix_(unmixed_settings['fluorescence_channel_ids'], raw_settings['fluorescence_channel_ids'])] = \
+        compensation @ np.array(spectral_process['unmixing_matrix'])
+    transfer_matrix[np.ix_(unmixed_settings['scatter_channel_ids'], raw_settings['scatter_channel_ids'])] = np.eye(unmixed_settings['n_scatter_channels'])
+    transfer_matrix[unmixed_settings['time_channel_id'], raw_settings['time_channel_id']] = 1
+    return transfer_matrix.T
+
+
+@contextmanager
+def timed(timings, stage):
+    '''adds the seconds spent in the block to timings[stage]'''
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.) + time.perf_counter() - start_time
+
+
+def gated_controller(unmixed_settings):
+    '''a headless controller in unmixed mode holding the transformations, a typical gating hierarchy and plots for unmixed_settings'''
+    from honeychrome.controller import Controller
+
+    controller = Controller()
+    fluorescence_channels = unmixed_settings['fluorescence_channels']
+    controller.unmixed_transformations = generate_transformations(assign_default_transforms(unmixed_settings))
+    for label in unmixed_settings['event_channels_pnn']:
+        controller.unmixed_gating.transformations[label] = controller.unmixed_transformations[label].xform
+    controller.data_for_cytometry_plots = controller.data_for_cytometry_plots_unmixed
+    controller.data_for_cytometry_plots.update({
+        'pnn': unmixed_settings['event_channels_pnn'],
+        'fluoro_indices': unmixed_settings['fluorescence_channel_ids'],
+        'transformations': controller.unmixed_transformations, 'gating': controller.unmixed_gating,
+        'lookup_tables': controller.unmixed_lookup_tables,
+    })
+
+    x, y = fluorescence_channels[:2]
+    quadrant = f'{x}+ {y}+'
+    controller.create_or_update_gate(gate_name='Cells', gate_type='rectangle', gate_path=('root',),
+                                     gate_data={'pos': [0.1, 0.05], 'size': [0.5, 0.4]}, channel_x='FSC-A', channel_y='SSC-A')
+    controller.create_or_update_gate(gate_name='Singlets', gate_type='polygon', gate_path=('root', 'Cells'),
+                                     gate_data={'origin': [0, 0], 'points': [[0.05, 0], [0.95, 0.6], [0.95, 0.9], [0.05, 0.1]]},
+                                     channel_x='FSC-A', channel_y='FSC-H')
+    controller.create_or_update_gate(gate_name='Quadrants', gate_type='quad', gate_path=('root', 'Cells', 'Singlets'),
+                                     gate_data={'pos': [0.5, 0.5]}, channel_x=x, channel_y=y)
+    controller.create_or_update_gate(gate_name='Subset', gate_type='ellipse', gate_path=('root', 'Cells', 'Singlets', 'Quadrants', quadrant),
+                                     gate_data={'pos': [0.6, 0.6], 'size': [0.2, 0.1], 'angle': 30}, channel_x=fluorescence_channels[2],
+                                     channel_y=fluorescence_channels[3])
+
+    controller.data_for_cytometry_plots['plots'] = (
+        [{'type': 'hist1d', 'channel_x': 'Time', 'source_gate': 'root', 'child_gates': []},
+         {'type': 'hist2d', 'channel_x': 'FSC-A', 'channel_y': 'SSC-A', 'source_gate': 'root', 'child_gates': ['Cells']},
+         {'type': 'hist2d', 'channel_x': 'FSC-A', 'channel_y': 'FSC-H', 'source_gate': 'Cells', 'child_gates': ['Singlets']},
+         {'type': 'ribbon', 'source_gate': 'Singlets', 'child_gates': []},
+         {'type': 'hist2d', 'channel_x': x, 'channel_y': y, 'source_gate': 'Singlets', 'child_gates': ['Quadrants']},
+         {'type': 'hist2d', 'channel_x': fluorescence_channels[2], 'channel_y': fluorescence_channels[3], 'source_gate': quadrant, 'child_gates': ['Subset']}]
+        + [{'type': 'hist1d', 'channel_x': c, 'source_gate': 'Singlets', 'child_gates': []} for c in fluorescence_channels])
+    return controller
+
+
+def benchmark_sample(directory, n_events, n_detectors=benchmark_n_detectors, n_fluorophores=benchmark_n_fluorophores,
+                     n_af=benchmark_n_af, n_export_samples=benchmark_n_export_samples, seed=0):
+    '''
+    write a synthetic sample of n_events into directory and take it through every stage in turn;
+    returns the seconds spent in each stage
+    '''
+    from honeychrome.controller_components.spectral_functions import calculate_spectral_process
+    from honeychrome import __version__
+
+    directory = Path(directory)
+    spectra, af_spectra = synthetic_spectra(n_detectors, n_fluorophores, n_af, seed)
+    raw_settings = synthetic_raw_settings(spectral_pnn(n_detectors))
+    spectral_model = [{'label': f'Fluor {n:02d}'} for n in range(1, n_fluorophores + 1)]
+    profiles = {control['label']: spectrum.tolist() for control, spectrum in zip(spectral_model, spectra)}
+    unmixed_settings, spectral_process = calculate_spectral_process(raw_settings, spectral_model, profiles)
+    experiment_settings = {'raw': raw_settings, 'unmixed': unmixed_settings}
+    transfer_matrix = transfer_matrix_from_process(raw_settings, unmixed_settings, spectral_process)
+    fl_ids_raw = raw_settings['fluorescence_channel_ids']
+    fl_ids_unmixed = unmixed_settings['fluorescence_channel_ids']
+    timings = {}
+
+    # the sample itself is written in chunks (not timed); write_fcs is timed writing the unmixed events below
+    sample_path = directory / f'Synthetic {n_events}.fcs'
+    write_synthetic_spectral_fcs(sample_path, n_events, spectra, af_spectra, seed)
+
+    with timed(timings, 'sample_from_fcs'):
+        sample = sample_from_fcs(sample_path)
+        raw_event_data = sample.get_events(source='raw')
+    raw_keywords = sample.get_metadata()
+    del sample
+
+    with timed(timings, 'apply_transfer_matrix'):
+        unmixed_event_data = apply_transfer_matrix(transfer_matrix, raw_event_data)
+
+    af_precomputed = precompute_af_matrices(spectra, af_spectra)
+    af_precomputed.update(precompute_joint_cov_extras(af_precomputed, af_spectra))
+    with timed(timings, 'apply_af_unmixing'):
+        apply_af_unmixing(raw_event_data[:, fl_ids_raw], af_precomputed, af_spectra)
+    del raw_event_data
+    gc.collect()
+
+    controller = gated_controller(unmixed_settings)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # no events bus connected
+        with timed(timings, 'calculate_lookup_tables'):
+            controller.calculate_lookup_tables(mode='unmixed')
+
+    data = controller.data_for_cytometry_plots
+    data['event_data'] = unmixed_event_data
+    data['gate_membership'] = {'root': np.ones(n_events, dtype=np.bool_)}
+    with timed(timings, 'apply_gates_in_place'):
+        apply_gates_in_place(data, gates_to_calculate=[gate_id[0] for gate_id in data['gating'].get_gate_ids()])
+    with timed(timings, 'calc_hists'):
+        data['histograms'] = calc_hists(data, density_cutoff=settings.density_cutoff_retrieved)
+    with timed(timings, 'calc_stats'):
+        data['statistics'] = calc_stats(data)
+
+    fluorescence_channels = unmixed_settings['fluorescence_channels']
+    with timed(timings, 'nxn_grid'):
+        engine = NxNHistogramEngine(settings.tile_size_nxn_grid_retrieved, max_workers=settings.nxn_max_workers)
+        engine.reset(fluorescence_channels, [data['transformations'][c].scale for c in fluorescence_channels], settings.density_cutoff_retrieved)
+        engine.add_events(unmixed_event_data, data['gate_membership']['Singlets'], fl_ids_unmixed)
+        engine.compute_tiles()
+    del engine, controller, data
+
+    keywords = define_fcs_keywords(raw_keywords, unmixed_settings['event_channels_pnn'], unmixed_event_data, spectral_model,
+                                   unmixed_settings, raw_settings, np.array(spectral_process['spillover']), af_spectra,
+                                   spectra, sample_path.name, __version__)
+    with timed(timings, 'write_fcs'):
+        write_fcs(unmixed_event_data, keywords, directory / f'Synthetic {n_events} (write_fcs).fcs')
+    del unmixed_event_data
+    gc.collect()
+
+    # a folder of copies of the sample, each loaded, unmixed with AF correction and exported as the unmixed exporter does
+    batch_folder = directory / 'Batch'
+    unmixed_folder = directory / 'Unmixed'
+    batch_folder.mkdir(exist_ok=True)
+    unmixed_folder.mkdir(exist_ok=True)
+    for n in range(n_export_samples):
+        try:
+            os.link(sample_path, batch_folder / f'Sample {n + 1}.fcs')
+        except OSError:
+            shutil.copyfile(sample_path, batch_folder / f'Sample {n + 1}.fcs')
+    with timed(timings, 'batch_export'):
+        for path in sorted(batch_folder.glob('*.fcs')):
+            sample = sample_from_fcs(path)
+            raw_event_data = sample.get_events(source='raw')
+            unmixed = apply_transfer_matrix(transfer_matrix, raw_event_data, skip_columns=fl_ids_unmixed)
+            result = apply_af_unmixing(raw_event_data[:, fl_ids_raw], af_precomputed, af_spectra)
+            unmixed[:, fl_ids_unmixed] = result['unmixed']
+            export_unmixed_sample(path.stem, unmixed_folder, unmixed, unmixed_settings['event_channels_pnn'],
+                                  np.array(spectral_process['spillover']), sample.get_metadata(), spectral_model,
+                                  experiment_settings['unmixed'], experiment_settings['raw'], af_spectra, spectra, __version__)
+            del sample, raw_event_data, unmixed, result
+    shutil.rmtree(batch_folder)
+    shutil.rmtree(unmixed_folder)
+    sample_path.unlink()
+    (directory / f'Synthetic {n_events} (write_fcs).fcs').unlink()
+    gc.collect()
+
+    return {stage: timings[stage] for stage in stages}
+
+
+def run_benchmarks(sizes=benchmark_sizes, directory=None, n_detectors=benchmark_n_detectors, n_fluorophores=benchmark_n_fluorophores,
+                   n_af=benchmark_n_af, n_export_samples=benchmark_n_export_samples, seed=0):
+    '''
+    benchmark_sample at each of sizes (numbers of events) in turn, in directory (a temporary directory by default);
+    returns a dict of the configuration, the environment, and for each size the seconds spent in each stage
+    '''
+    from honeychrome import __version__
+
+    results = {
+        'honeychrome': __version__, 'numpy': np.__version__, 'python': platform.python_version(),
+        'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+        'af_kernel': AF_KERNEL_AVAILABLE,
+        'config': {'n_detectors': n_detectors, 'n_fluorophores': n_fluorophores, 'n_af': n_af,
+                   'n_export_samples': n_export_samples, 'seed': seed},
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for n_events in sizes:
+            timings = benchmark_sample(directory or temporary_directory, n_events, n_detectors, n_fluorophores, n_af, n_export_samples, seed)
+            results['runs'].append({'n_events': n_events, 'total': sum(timings.values()), 'stages': timings})
+            logger.info(f'run_benchmarks: {n_events} events: {timings}')
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    from contextlib import redirect_stdout
+
+    # keep stdout for the results (flowkit prints as it gates the lookup tables)
+    with redirect_stdout(sys.stderr):
+        results = run_benchmarks([int(n) for n in sys.argv[1:]] or benchmark_sizes)
+    print(json.dumps(results, indent=2))
@@ -36,21 +36,28 @@ from PySide6.QtCore import QObject, Slot, QTimer
 from flowkit import GatingStrategy, Sample, gates
 import threading
 from copy import deepcopy
-from multiprocessing import shared_memory
 import time
 
 from honeychrome.experiment_model import ExperimentModel, check_fcs_matches_experiment
-from honeychrome.controller_components.functions import apply_gates_in_place, apply_transfer_matrix, generate_transformations, update_transforms, initialise_hists, calc_hists, calc_stats, initialise_stats, assign_default_transforms, define_quad_gates, define_range_gate, define_polygon_gate, define_rectangle_gate, define_ellipse_gate, add_recent_file, empty_queue_nowait, define_process_plots, get_set_or_initialise_label_offset, sample_from_fcs, build_display_label_map
+from honeychrome.controller_components.functions import apply_gates_in_place, apply_transfer_matrix, update_compensation_in_place, generate_transformations, update_transforms, initialise_hists, calc_hists, calc_stats, initialise_stats, assign_default_transforms, define_quad_gates, define_range_gate, define_polygon_gate, define_rectangle_gate, define_ellipse_gate, add_recent_file, define_raw_fcs_keywords, StreamingFCSWriter, define_process_plots, get_set_or_initialise_label_offset, sample_from_fcs, build_display_label_map
 from honeychrome.controller_components.gml_functions_mod_from_flowkit import from_gml, to_gml
-from honeychrome.settings import traces_cache_size, traces_cache_dtype, adc_rate
+from honeychrome.controller_components.nxn_engine import NxNHistogramEngine
+from honeychrome.controller_components.events_spill import EventsSpillWriter, events_cache_dtype, events_to_float
+from honeychrome.controller_components.oscilloscope_slot import OscilloscopeSlot
+from honeychrome.controller_components.wakeup import Wakeup
+from honeychrome.controller_components.live_scheduler import LiveUpdateScheduler
+from honeychrome.controller_components import timing
+from honeychrome.controller_components.memory_accountant import MemoryAccountant
+from honeychrome.settings import adc_rate
 import honeychrome.settings as settings
 from honeychrome.settings import max_events_in_cache, n_channels_per_event, experiments_folder, live_data_process_repeat_time, settings_default, samples_default, channel_dict
 from honeychrome.view_components.busy_cursor import with_busy_cursor
 from honeychrome.controller_components.autospectral_functions import (
         get_af_spectra,
-        precompute_af_matrices,
         precompute_joint_cov_extras,
         combine_af_precomputed,
+        load_or_precompute_af_matrices,
+        af_precomputed_cache_key,
         apply_af_unmixing,
         apply_af_transfer,
      )
@@ -80,11 +87,9 @@ cytometry_data_dictionary = {
 
 class Controller(QObject):
     def __init__(self,
-        events_cache_name=None,
-        events_cache_lock=None,
-        index_head_events_cache=None,
-        index_tail_events_cache=None,
-        oscilloscope_traces_queue=None,
+        events_ring=None,
+        oscilloscope_slot=None,
+        events_ready=None,
         pipe_connection_instrument=None,
         pipe_connection_analyser=None):
         super().__init__()
@@ -103,10 +108,13 @@ class Controller(QObject):
         self.filtered_raw_fluorescence_channel_ids = None
         self.raw_lookup_tables = {}
         self.unmixed_lookup_tables = {}
+        self.nxn_engine = NxNHistogramEngine(settings.tile_size_nxn_grid_retrieved, max_workers=settings.nxn_max_workers)
         self.transfer_matrix = None
+        self.applied_spillover = None # spillover that transfer_matrix and unmixed_event_data were built with
         self.af_precomputed = None
         self.af_spectra = None
         self.af_precomputed_cache: dict = {}
+        self.af_combined_cache: dict = {} # (profile names) -> (combined precomputed, stacked af spectra), shared by all samples with that assignment
         self.raw_transformations = None
         self.unmixed_transformations = None
         self.raw_gating = GatingStrategy()
@@ -122,15 +130,14 @@ class Controller(QObject):
         self.pipe_connection_instrument = pipe_connection_instrument
         self.pipe_connection_analyser = pipe_connection_analyser
 
-        # Events cache
-        self.shm_events = None
-        self.events_cache = None
-        self.events_cache_name = events_cache_name
-        self.events_cache_lock = events_cache_lock
-        self.max_events_in_cache = max_events_in_cache
+        # Events cache (a SharedRing written by the trace analyser)
+        self.events_ring = events_ring
+        self.max_events_in_cache = events_ring.capacity if events_ring is not None else max_events_in_cache
         self.n_channels_per_event = n_channels_per_event
-        self.index_head_events_cache = index_head_events_cache
-        self.index_tail_events_cache = index_tail_events_cache
+        self.events_cache_dtype = events_cache_dtype(channel_dict['event_channels_pnn'])
+        self.events_ready = events_ready if events_ready is not None else Wakeup() # notified by the trace analyser when it commits events
+        self.events_spill = None
+        self.live_fcs_writer = None
         self.adc_rate = adc_rate
 
         # live data processing stop signal
@@ -138,17 +145,17 @@ class Controller(QObject):
         self.stop_live_data_processing.set()
         self.thread = None
 
-        if self.events_cache_name is not None:
-            self.shm_events = shared_memory.SharedMemory(name=self.events_cache_name)
-            with self.events_cache_lock:
-                self.events_cache = np.ndarray((self.max_events_in_cache, self.n_channels_per_event), dtype=np.int64, buffer=self.shm_events.buf)
-        else:
-            self.events_cache = None
+        # live update batching, and the plots in view (mode -> plot indices) which are updated first if it can't keep up
+        self.live_scheduler = LiveUpdateScheduler()
+        self.visible_plots = {}
+        self.deferred_live_hists = [] # (plot data, plots skipped, event data, gate membership) of updates that skipped some plots
 
         self.experiment_compatible_with_acquisition = None
+        self.session_started = datetime.now().strftime('%Y%m%d-%H%M%S') # names this session's timing trace
+        self.memory = MemoryAccountant(self) # reports the memory of the ephemeral data and keeps it to the budget in settings
 
-        # Oscilloscope traces queue
-        self.oscilloscope_traces_queue = oscilloscope_traces_queue
+        # Oscilloscope slot, polled by the oscilloscope viewer
+        self.oscilloscope_slot = oscilloscope_slot
 
         # signals: note controller actions are connected in view
         self.bus = None
@@ -259,6 +266,18 @@ class Controller(QObject):
         cache_dir.mkdir(parents=True, exist_ok=True)
         return cache_dir / 'cleaned.npz'
 
+    @property
+    def af_precomputed_cache_dir(self) -> Path | None:
+        """Folder for per-profile AF precomputed matrices (see load_or_precompute_af_matrices)."""
+        if self.experiment_dir is None:
+            return None
+        return self.experiment_dir / 'cache' / 'af_precomputed'
+
+    @property
+    def timing_trace_path(self) -> Path:
+        """Chrome trace of this session's timing spans, rewritten on every save while tracing (see timing)."""
+        return self.experiment_dir / 'cache' / 'timing' / f'{self.session_started}.trace.json'
+
     @property
     def _legacy_cleaned_npz_path(self) -> Path:
         """Pre-migration location, alongside the .kit file."""
@@ -280,6 +299,8 @@ class Controller(QObject):
             self._save_cleaned_events()
             self.experiment.save()
             logger.info(f'Controller: experiment saved {self.experiment_dir}')
+            if timing.is_tracing():
+                timing.write_chrome_trace(self.timing_trace_path)
             if self.bus:
                 QTimer.singleShot(100, lambda: self.bus.statusMessage.emit(f'Autosaved: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}'))
 
@@ -332,6 +353,7 @@ class Controller(QObject):
             self.data_for_cytometry_plots['statistics'] = initialise_stats(self.data_for_cytometry_plots['gating'])
             self.calc_hists_and_stats(gates_to_calculate=gates_to_recalculate, indices_plots_to_calculate=indices_plots_to_recalculate)
 
+    @timing.traced('lookup_tables')
     def calculate_lookup_tables(self, mode=None, top_gate='root'):
         # apply gating strategy to unit images to produce masks
         # called on initialise ephemeral data or if gate added
@@ -462,12 +484,15 @@ class Controller(QObject):
         self.raw_lookup_tables = {}
         self.unmixed_lookup_tables = {}
         self.transfer_matrix = None
+        self.applied_spillover = None
         self.af_precomputed_cache = {}
+        self.af_combined_cache = {}
         self.raw_transformations = None
         self.unmixed_transformations = None
         self.raw_gating = GatingStrategy()
         self.unmixed_gating = GatingStrategy()
         self.cleaned_events: dict = {}
+        self.nxn_engine.reset()
         self.data_for_cytometry_plots = {'pnn': None, 'fluoro_indices': None, 'lookup_tables': None, 'event_data': None, 'transformations': None, 'statistics': {}, 'gating': GatingStrategy(), 'plots': [], 'histograms': [], 'gate_membership': {}}
         self.data_for_cytometry_plots_raw = deepcopy(self.data_for_cytometry_plots)
         self.data_for_cytometry_plots_process = deepcopy(self.data_for_cytometry_plots)
@@ -633,36 +658,28 @@ class Controller(QObject):
         transfer_matrix = transfer_matrix.T
 
         self.transfer_matrix = transfer_matrix
+        self.applied_spillover = spillover.copy()
     
     def initialise_af_matrices(self):
         """
         Set self.af_precomputed and self.af_spectra for the currently loaded sample
-        by combining cached per-profile matrices via np.hstack.
+        from the combined matrices for its assigned profile set.
 
-        No matrix algebra is performed here — only dict lookups and hstack, which
-        are O(n_af * n_channels) and negligible compared to the linalg.solve that
-        was previously run per sample.
+        No matrix algebra is performed here beyond the first use of a profile set —
+        see get_af_matrices_for_profiles.
         """
-        af_spectra = self.get_combined_af_spectra_for_sample(self.current_sample_path)
-
-        if af_spectra is None:
-            self.af_precomputed = None
-            self.af_spectra = None
-            return
-
-        # Combine per-profile cached precomputed dicts
         profile_names = (
             self.experiment.samples
             .get('sample_af_profiles', {})
             .get(self.current_sample_path, [])
         )
-        cached = [
-            self.af_precomputed_cache[name]
-            for name in profile_names
-            if name in self.af_precomputed_cache
-        ]
+        if not profile_names:
+            self.af_precomputed = None
+            self.af_spectra = None
+            return
 
-        if not cached:
+        combined, af_spectra = self.get_af_matrices_for_profiles(profile_names)
+        if combined is None:
             logger.warning(
                 f'initialise_af_matrices: no cache hit for sample "{self.current_sample_path}". '
                 f'profile_names={profile_names}, '
@@ -671,17 +688,8 @@ class Controller(QObject):
             self.af_precomputed = None
             self.af_spectra = None
             return
-        
-        if len(cached) == 1:
-            combined = cached[0]
-        else:
-            combined = combine_af_precomputed(cached)
-            # Recompute af_error_weights across the full combined AF spectra
-            if af_spectra is not None:
-                combined.update(precompute_joint_cov_extras(combined, af_spectra))
 
         self.af_precomputed = combined
-        assert af_spectra is not None
         self.af_spectra = af_spectra
         logger.info(
         f'Controller: AF matrices set for {self.current_sample_path} '
@@ -689,6 +697,61 @@ class Controller(QObject):
         f'{len(profile_names)} profile(s)) — from cache.'
     )
 
+    def get_af_matrices_for_profiles(self, profile_names):
+        """
+        Return (combined precomputed dict, stacked AF spectra) for a profile set,
+        or (None, None) if none of the profiles are cached.
+
+        Per-profile matrices come from af_precomputed_cache and are combined via
+        np.hstack; the joint covariance extras are recomputed across the full
+        combined AF spectra.  The result is memoised in af_combined_cache so every
+        sample (and batch statistics) with the same assignment shares one copy.
+        """
+        key = tuple(profile_names)
+        if key in self.af_combined_cache:
+            return self.af_combined_cache[key]
+
+        af_profiles = self.experiment.process.get('af_profiles', {})
+        matrices = []
+        for name in profile_names:
+            entry = af_profiles.get(name)
+            if entry is None:
+                logger.warning(
+                    f'get_af_matrices_for_profiles: profile "{name}" not found in af_profiles — skipping.'
+                )
+                continue
+            matrices.append(np.array(entry['spectra']))
+
+        cached = [
+            self.af_precomputed_cache[name]
+            for name in profile_names
+            if name in self.af_precomputed_cache
+        ]
+        if not matrices or not cached:
+            return None, None
+        af_spectra = np.vstack(matrices)
+
+        if len(cached) == 1:
+            combined = cached[0]
+        else:
+            combined = combine_af_precomputed(cached)
+            # Recompute af_error_weights across the full combined AF spectra
+            combined.update(precompute_joint_cov_extras(combined, af_spectra))
+
+        self.af_combined_cache[key] = (combined, af_spectra)
+        return combined, af_spectra
+
+    def af_fluorescence_ids_for_whitelist(self):
+        """
+        Remap full-PNN fluorescence indices to whitelisted-PNN column positions.
+        Raw event data is loaded with col_order=whitelisted_pnn, so stored
+        fluorescence_channel_ids (full-PNN) must be translated first.
+        """
+        _raw = self.experiment.settings['raw']
+        pnn_raw = _raw.get('whitelisted_pnn') or _raw['event_channels_pnn']
+        full_pnn_raw = _raw['event_channels_pnn']
+        return [pnn_raw.index(full_pnn_raw[i]) for i in self.filtered_raw_fluorescence_channel_ids]
+
     def cache_af_profile(self, profile_name: str) -> bool:
         """
         Compute and cache the precomputed AF matrices for a single named profile.
@@ -718,9 +781,9 @@ class Controller(QObject):
 
         try:
             af_spectra  = np.array(entry['spectra'])
-            precomputed = precompute_af_matrices(fluor_spectra, af_spectra)
-            precomputed.update(precompute_joint_cov_extras(precomputed, af_spectra))
+            precomputed = load_or_precompute_af_matrices(fluor_spectra, af_spectra, self.af_precomputed_cache_dir)
             self.af_precomputed_cache[profile_name] = precomputed
+            self.af_combined_cache = {key: value for key, value in self.af_combined_cache.items() if profile_name not in key}
             logger.info(
                 f'Controller: cached AF precomputed matrices for "{profile_name}" '
                 f'({af_spectra.shape[0]} AF spectra).'
@@ -735,8 +798,11 @@ class Controller(QObject):
         (Re)compute precomputed matrices for every stored AF profile and replace
         the entire cache.  Called by initialise_transfer_matrix() after a spectral
         process refresh, because P depends on fluor_spectra which may have changed.
+        Matrices already saved in af_precomputed_cache_dir for the same fluorophore
+        and AF spectra are loaded rather than recomputed.
         """
         self.af_precomputed_cache = {}
+        self.af_combined_cache = {}
         af_profiles = self.experiment.process.get('af_profiles', {})
         if not af_profiles:
             logger.debug(f'cache_all_af_profiles: experiment.process has no af_profiles — keys present: {list(self.experiment.process.keys())}')
@@ -749,15 +815,23 @@ class Controller(QObject):
             )
             return
 
+        cache_dir = self.af_precomputed_cache_dir
+        current_entries = set()
         for name, entry in af_profiles.items():
             try:
                 af_spectra  = np.array(entry['spectra'])
-                precomputed = precompute_af_matrices(fluor_spectra, af_spectra)
-                precomputed.update(precompute_joint_cov_extras(precomputed, af_spectra))
+                precomputed = load_or_precompute_af_matrices(fluor_spectra, af_spectra, cache_dir)
                 self.af_precomputed_cache[name] = precomputed
+                current_entries.add(f'{af_precomputed_cache_key(fluor_spectra, af_spectra)}.npz')
             except Exception as e:
                 logger.error(f'cache_all_af_profiles: failed for "{name}": {e}')
 
+        # drop entries for superseded spectral models or deleted profiles
+        if cache_dir is not None and cache_dir.exists():
+            for path in cache_dir.glob('*.npz'):
+                if path.name not in current_entries:
+                    path.unlink(missing_ok=True)
+
         logger.info(
             f'Controller: AF cache rebuilt — '
             f'{len(self.af_precomputed_cache)}/{len(af_profiles)} profiles cached.'
@@ -815,6 +889,7 @@ class Controller(QObject):
             return None
 
 
+    @timing.traced('unmix')
     def _apply_unmixing(self, raw_event_data):
         """Apply unmixing — AF-corrected if matrices are set, otherwise plain OLS/WLS.
 
@@ -825,14 +900,7 @@ class Controller(QObject):
         until after this method returns.
         """
         if self.af_precomputed is not None and self.af_spectra is not None:
-            # Remap full-PNN fluorescence indices to whitelisted-PNN column positions.
-            # raw_event_data is loaded with col_order=whitelisted_pnn, so stored
-            # fluorescence_channel_ids (full-PNN) must be translated first.
-            _raw = self.experiment.settings['raw']
-            pnn_raw = _raw.get('whitelisted_pnn') or _raw['event_channels_pnn']
-            full_pnn_raw = _raw['event_channels_pnn']
-            fl_ids_remapped = [pnn_raw.index(full_pnn_raw[i])
-                               for i in self.filtered_raw_fluorescence_channel_ids]
+            fl_ids_remapped = self.af_fluorescence_ids_for_whitelist()
             result = apply_af_transfer(
                 raw_event_data,
                 self.transfer_matrix,
@@ -919,33 +987,38 @@ class Controller(QObject):
         check_pnn = whitelisted_pnn or self.experiment.settings['raw']['event_channels_pnn']
         if check_fcs_matches_experiment(self.experiment_dir / sample_path, check_pnn, self.experiment.settings['raw']['magnitude_ceiling']):
             self.current_sample_path = sample_path
-            self.current_sample = sample_from_fcs(self.experiment_dir / self.current_sample_path, self.bus)
+            load_started = time.perf_counter()
+            with timing.span('load', sample=sample_path):
+                self.current_sample = sample_from_fcs(self.experiment_dir / self.current_sample_path, self.bus)
 
             if self.current_sample_path == self.live_sample_path:
                 self.raw_event_data, n_events = self.copy_live_data(extent='update')
             else:
-                try:
-                    self.raw_event_data = self.current_sample.get_events(
-                        source='raw', col_order=whitelisted_pnn
-                    )
-                except (KeyError, ValueError) as e:
-                    logger.warning(
-                        'load_sample: col_order get_events failed (%s) — reading all channels', e
-                    )
-                    self.raw_event_data = self.current_sample.get_events(source='raw')
+                with timing.span('load_events', sample=sample_path):
+                    try:
+                        self.raw_event_data = self.current_sample.get_events(
+                            source='raw', col_order=whitelisted_pnn
+                        )
+                    except (KeyError, ValueError) as e:
+                        logger.warning(
+                            'load_sample: col_order get_events failed (%s) — reading all channels', e
+                        )
+                        self.raw_event_data = self.current_sample.get_events(source='raw')
                 n_events = self.current_sample.event_count
-                if np.any(np.isnan(self.raw_event_data)):
-                    n_nan = int(np.isnan(self.raw_event_data).sum())
-                    logger.warning('load_sample: %d NaN values in raw event data — replacing with 0', n_nan)
-                    self.raw_event_data = np.where(np.isnan(self.raw_event_data), 0.0, self.raw_event_data)
+                with timing.span('nan_scrub', n_events=n_events):
+                    if np.any(np.isnan(self.raw_event_data)):
+                        n_nan = int(np.isnan(self.raw_event_data).sum())
+                        logger.warning('load_sample: %d NaN values in raw event data — replacing with 0', n_nan)
+                        self.raw_event_data = np.where(np.isnan(self.raw_event_data), 0.0, self.raw_event_data)
                 logger.debug('load_sample: raw_event_data shape %s', self.raw_event_data.shape)
 
                 # Display cap — applied before unmixing so both arrays are consistently capped.
-                _cap = settings.max_display_events
+                _cap = self.memory.display_cap(sample_path) # lower than the setting if lowered for this sample to keep to budget
                 if _cap and len(self.raw_event_data) > _cap:
-                    _rng = np.random.default_rng(seed=42)
-                    _idx = np.sort(_rng.choice(len(self.raw_event_data), _cap, replace=False))
-                    self.raw_event_data = self.raw_event_data[_idx]
+                    with timing.span('subsample', n_events=n_events):
+                        _rng = np.random.default_rng(seed=42)
+                        _idx = np.sort(_rng.choice(len(self.raw_event_data), _cap, replace=False))
+                        self.raw_event_data = self.raw_event_data[_idx]
                     logger.info('load_sample: capped display events %d → %d', n_events, _cap)
                 logger.debug('load_sample: raw_event_data shape %s', self.raw_event_data.shape)
 
@@ -974,6 +1047,12 @@ class Controller(QObject):
 
             self.clear_data_for_cytometry_plots()
             self.initialise_data_for_cytometry_plots()
+            memory_steps = self.memory.enforce()
+            if self.bus and memory_steps:
+                self.bus.statusMessage.emit(f'Memory budget exceeded: {"; ".join(memory_steps)}.')
+            if self.bus and timing.is_enabled():
+                self.bus.statusMessage.emit(f'Loaded sample {self.current_sample_path}: {n_events} events '
+                                            f'({timing.summary(since=load_started)}).')
         else:
             if self.bus:
                 self.bus.openImportFCSWidget.emit(True)
@@ -1006,6 +1085,88 @@ class Controller(QObject):
             self.clear_data_for_cytometry_plots()
             self.initialise_data_for_cytometry_plots()
 
+    def _reapply_fine_tuning_incremental(self):
+        """
+        Apply a spillover edit to the loaded sample without re-unmixing it.
+
+        Compensation is the last linear step of both the plain and the AF-corrected
+        unmixing paths, so the unmixed fluorescence columns are updated in place
+        by a rank-one correction per edited cell (update_compensation_in_place),
+        and only process/unmixed plots showing the affected channels are
+        recalculated.  Returns the affected unmixed channel names, or None if the
+        incremental path does not apply (nothing loaded, live acquisition, or a
+        change in dimensions) and nothing has been done.
+        """
+        if self.applied_spillover is None or self.unmixed_event_data is None or self.raw_event_data is None:
+            return None
+        if not self.stop_live_data_processing.is_set() and self.current_sample_path == self.live_sample_path:
+            return None
+        spillover = self.experiment.process.get('spillover')
+        fl_ids = self.experiment.settings['unmixed']['fluorescence_channel_ids']
+        if spillover is None or np.shape(spillover) != self.applied_spillover.shape or len(fl_ids) != len(spillover):
+            return None
+
+        affected = update_compensation_in_place(self.unmixed_event_data, fl_ids, self.applied_spillover, spillover)
+        self.initialise_transfer_matrix()
+        pnn = self.experiment.settings['unmixed']['event_channels_pnn']
+        channels = [pnn[fl_ids[j]] for j in affected]
+        logger.info(f'Controller: fine tuning applied in place to {channels}')
+        if channels:
+            self.recalculate_plots_for_channels(channels)
+        return channels
+
+    def recalculate_plots_for_channels(self, channels):
+        """
+        After unmixed channels have changed in place, recalculate only the histograms that show them.
+        If any unmixed gate is drawn on one of the channels, gate membership is stale and everything is recalculated.
+        """
+        gated_channels = set()
+        for data in [self.data_for_cytometry_plots_process, self.data_for_cytometry_plots_unmixed]:
+            gating = data['gating']
+            for gate_name, gate_path in (gating.get_gate_ids() if gating else []):
+                if gating._get_gate_node(gate_name, gate_path).gate_type != 'Quadrant':
+                    for dim in gating.get_gate(gate_name).dimensions:
+                        gated_channels.add(getattr(dim, 'dimension_ref', None) or dim.id)
+        if gated_channels & set(channels):
+            self.clear_data_for_cytometry_plots()
+            self.initialise_data_for_cytometry_plots()
+            return
+
+        for data in [self.data_for_cytometry_plots_process, self.data_for_cytometry_plots_unmixed]:
+            if not data['plots'] or not data['histograms']:
+                continue
+            if data is not self.data_for_cytometry_plots:
+                # not on screen: recalculated in full on the next tab change
+                data['histograms'] = []
+                data['statistics'] = {}
+                if data is self.data_for_cytometry_plots_process:
+                    self.nxn_engine.reset()
+                continue
+            if data is self.data_for_cytometry_plots_process:
+                source_gate = data['plots'][0]['source_gate']
+                channel_ids = [data['pnn'].index(c) for c in self.nxn_engine.channels]
+                self.nxn_engine.update_channels(channels, data['event_data'], data['gate_membership'].get(source_gate), channel_ids)
+                if self.bus is not None:
+                    self.bus.histsStatsRecalculated.emit(self.current_mode, list(range(len(data['plots']))))
+                continue
+            indices = [n for n, plot in enumerate(data['plots'])
+                       if plot['type'] == 'ribbon' or plot.get('channel_x') in channels or plot.get('channel_y') in channels]
+            hists = calc_hists(data,
+                               indices_plots_to_calculate=indices,
+                               density_cutoff=settings.density_cutoff_retrieved,
+                               dot_plot_by_gate=settings.hist2dtype_retrieved=='Dot plot coloured by gate')
+            if len(hists) != len(indices):
+                # a source gate is missing from gate_membership: fall back to a full recalculation
+                self.clear_data_for_cytometry_plots()
+                self.initialise_data_for_cytometry_plots()
+                return
+            # process and unmixed may share one histogram list (see set_mode), so replace rather than mutate it
+            data['histograms'] = list(data['histograms'])
+            for n, hist in zip(indices, hists):
+                data['histograms'][n] = hist
+            if self.bus is not None:
+                self.bus.histsStatsRecalculated.emit(self.current_mode, indices)
+
     # added with busy cursor since with AF integration this may be noticeable
     # only call this decorated entry point from the main thread (e.g. direct
     # UI callbacks). Anything already running inside another @with_busy_cursor
@@ -1015,6 +1176,14 @@ class Controller(QObject):
     def reapply_fine_tuning(self):
         self._reapply_fine_tuning_impl()
 
+    @with_busy_cursor
+    def reapply_fine_tuning_incremental(self):
+        """Spillover edit from the NxN grid or spillover editor: in-place update if possible, otherwise full re-unmix (returns None)."""
+        channels = self._reapply_fine_tuning_incremental()
+        if channels is None:
+            self._reapply_fine_tuning_impl()
+        return channels
+
     @Slot()
     def on_gain_change(self, ch_name, value):
         logger.info(f"{ch_name} gain changed to {value}")
@@ -1054,6 +1223,16 @@ class Controller(QObject):
         response = self.pipe_connection_analyser.recv()
         logger.info(response)
 
+        # stream events into the sample file as they arrive, so that the events cache only holds the most recent events
+        if self.events_ring is not None and 'spilled' in self.events_ring.cursors:
+            pnn = self.experiment.settings['raw']['event_channels_pnn']
+            keywords = define_raw_fcs_keywords(pnn, Path(self.live_sample_path).stem, self.experiment.settings['raw']['magnitude_ceiling'],
+                                               flow_rate=61.234) #todo get this flow rate (float)
+            self.live_fcs_writer = StreamingFCSWriter(self.experiment_dir / self.live_sample_path, keywords, len(pnn))
+            self.events_spill = EventsSpillWriter(lambda events: self.live_fcs_writer.append(self.live_events_to_float(events)),
+                                                  self.events_ring, live_data_process_repeat_time, on_failure=self.live_spill_failed)
+            self.events_spill.start()
+
         if self.bus:
             self.bus.statusMessage.emit(f'Acquisition started')
 
@@ -1076,30 +1255,49 @@ class Controller(QObject):
 
         # stop live update thread
         self.stop_live_data_processing.set()
-        time.sleep(0.25)
-        while self.thread.is_alive():
-            logger.info('Controller: waiting until live data processing is complete')
-            time.sleep(0.25)
+        self.events_ready.notify()
+        logger.info('Controller: waiting until live data processing is complete')
         self.thread.join()
 
-        # save sample, load sample
-        self.raw_event_data, _ = self.copy_live_data(extent='all')
-        if self.raw_event_data is not None:
-            self.current_sample_path = self.live_sample_path
-            self.live_sample_path = None
-            sample_name = Path(self.current_sample_path).stem
-            self.current_sample = Sample(self.raw_event_data, sample_id=sample_name, channel_labels=self.experiment.settings['raw']['event_channels_pnn'])
-            self.current_sample.metadata['tubename'] = sample_name
-            self.current_sample.metadata['flow_rate'] = str(61.234) #todo get this flow rate (float)
-            self.current_sample.export(self.experiment_dir / self.current_sample_path, source='raw', include_metadata=True)
-            self.load_sample(self.current_sample_path)
-        else:
-            if self.bus:
+        if self.live_fcs_writer is not None:
+            # the sample file has been written as events arrived: finish it and load it (the writer is closed and the live
+            # state reset even if writing failed)
+            self.events_spill.stop() # never raises: a write error is reported by live_spill_failed, and events dropped
+            n_dropped = self.events_spill.n_dropped
+            try:
+                n_events = self.live_fcs_writer.close()
+            except Exception as e:
+                logger.exception(f'Controller: failed to finish the live sample file {self.live_sample_path}')
+                if self.bus:
+                    self.bus.statusMessage.emit(f'Failed to write the sample file {self.live_sample_path}: {e}')
+                n_events = 0
+            finally:
+                self.events_spill = None
+                self.live_fcs_writer = None
+                live_sample_path, self.live_sample_path = self.live_sample_path, None
+            logger.info(f'Controller: {n_events} events written to {live_sample_path}' + (f', {n_dropped} dropped' if n_dropped else ''))
+            if n_events:
+                self.current_sample_path = live_sample_path
+                self.load_sample(self.current_sample_path)
+                if n_dropped and self.bus:
+                    self.bus.statusMessage.emit(f'{n_dropped} events were not written to {live_sample_path} after a write error')
+            elif self.bus:
                 self.bus.statusMessage.emit(f'No data acquired')
 
-        # empty oscilloscope traces queue
-        removed = empty_queue_nowait(self.oscilloscope_traces_queue)
-        logger.info(f"Controller: emptied oscilloscope traces queue ({removed} traces)")
+        else:
+            # save sample, load sample (without a spill, every event is still in the events cache)
+            self.raw_event_data, _ = self.copy_live_data(extent='all')
+            if self.raw_event_data is not None:
+                self.current_sample_path = self.live_sample_path
+                self.live_sample_path = None
+                sample_name = Path(self.current_sample_path).stem
+                self.current_sample = Sample(self.raw_event_data, sample_id=sample_name, channel_labels=self.experiment.settings['raw']['event_channels_pnn'])
+                self.current_sample.metadata['tubename'] = sample_name
+                self.current_sample.metadata['flow_rate'] = str(61.234) #todo get this flow rate (float)
+                self.current_sample.export(self.experiment_dir / self.current_sample_path, source='raw', include_metadata=True)
+                self.load_sample(self.current_sample_path)
+            elif self.bus:
+                self.bus.statusMessage.emit(f'No data acquired')
 
         # update experiment file samples list
         self.experiment.samples['all_sample_nevents'][self.current_sample_path] = self.current_sample.event_count
@@ -1109,6 +1307,13 @@ class Controller(QObject):
 
 
 
+    def live_spill_failed(self, error):
+        # called on the spill thread: the acquisition goes on, but its events are no longer written to the sample file
+        logger.error(f'Controller: writing the live sample {self.live_sample_path} failed ({error}), further events are dropped')
+        if self.bus:
+            self.bus.statusMessage.emit(f'Failed to write events to the sample file ({error}): '
+                                        f'further events are not saved, stop the acquisition')
+
     def update_instrument_settings(self):
         self.pipe_connection_instrument.send({'command': 'set', 'data': 'TODO insert settings update here'})
         response = self.pipe_connection_instrument.recv()
@@ -1116,6 +1321,13 @@ class Controller(QObject):
         logger.info(response)
         # TODO self.view.display_instrument_status(response)
 
+    def record_traces(self, path=None):
+        # record the raw traces from the instrument to a trace recording at path (for replay), or stop recording if path is None
+        self.pipe_connection_instrument.send({'command': 'record', 'data': None if path is None else str(path)})
+        response = self.pipe_connection_instrument.recv()
+        logger.info(response)
+        return response
+
     def quit_instrument_quit_analyser(self):
         self.pipe_connection_analyser.send({'command': 'quit'})  # quit analyser
         response = self.pipe_connection_analyser.recv()
@@ -1125,31 +1337,39 @@ class Controller(QObject):
         response = self.pipe_connection_instrument.recv()
         logger.info(response)
 
+    def live_events_to_float(self, events):
+        # records of the events cache as float64 event data, time in seconds
+        data = events_to_float(events)
+        data[:,self.experiment.settings['raw']['time_channel_id']] /= 1000 #convert to seconds
+        return data
+
     def copy_live_data(self, extent='all'):
-        with self.index_head_events_cache.get_lock():
-            events_head = self.index_head_events_cache.value
-        with self.index_tail_events_cache.get_lock():
-            events_tail = self.index_tail_events_cache.value  # read only here - this is updated by trace analyser process
+        '''
+        events from the live events cache, converted to float64 and seconds
+        extent 'update': events since the last copy, but no more than the most recent live_window_events (the cache is a ring)
+        extent 'all': every event still in the cache (the live sample file holds every event when acquisition stops)
+        '''
+        events_head = self.events_ring.cursor('head')
+        events_tail = self.events_ring.cursor('tail')  # read only here - this is updated by trace analyser process
 
         n_new_events = events_tail - events_head
 
         if extent == 'all':
             start = 0
         else:  # extent == 'update'
-            start = events_head
+            start = max(events_head, events_tail - settings.live_window_events)
+            if start > events_head:
+                logger.info(f'Controller: live display skipped {start - events_head} events')
 
         if events_tail > start:
-            with self.events_cache_lock:
-                logger.info(f'Controller: copying live data {[start, events_tail]}')
-                data = self.events_cache[start:events_tail, :].astype(np.float64)
-                data[:,self.experiment.settings['raw']['time_channel_id']] /= 1000 #convert to seconds
+            logger.info(f'Controller: copying live data {[start, events_tail]}')
+            data, _ = self.events_ring.read(max(start, events_tail - self.max_events_in_cache), events_tail, convert=self.live_events_to_float)
 
             # update head of traces cache and tail of events cache
             events_head_new = events_tail
             logger.info(f'Controller: processed {n_new_events} events (events cache head:{events_head}, tail:{events_tail})')
 
-            with self.index_head_events_cache.get_lock():
-                self.index_head_events_cache.value = events_head_new
+            self.events_ring.advance('head', events_head_new)
         else:
             data = None
             logger.info(f'Controller: awaiting events (events cache head:{events_head}, tail:{events_tail})')
@@ -1168,7 +1388,7 @@ class Controller(QObject):
                 self.data_for_cytometry_plots = self.data_for_cytometry_plots_raw
             elif tab_name == 'Spectral Process':
                 self.current_mode = 'process'
-                self.data_for_cytometry_plots_process['histograms'] = self.data_for_cytometry_plots_unmixed['histograms']
+                # process histograms are placeholders for the NxN tiles: left empty after a clear so the tiles are recounted
                 self.data_for_cytometry_plots_process['statistics'] = self.data_for_cytometry_plots_unmixed['statistics']
                 self.data_for_cytometry_plots = self.data_for_cytometry_plots_process
             elif tab_name == 'Unmixed Data':
@@ -1191,6 +1411,7 @@ class Controller(QObject):
         for data in [self.data_for_cytometry_plots_raw, self.data_for_cytometry_plots_process, self.data_for_cytometry_plots_unmixed]:
             data['histograms'] = []
             data['statistics'] = {}
+        self.nxn_engine.reset()
 
     def initialise_data_for_cytometry_plots(self, force_recalc_histograms=False):
         # called on tab change (set mode), load sample, reset axes transforms all, refresh spectral process, initalise nxn grid
@@ -1219,7 +1440,7 @@ class Controller(QObject):
                                 transformation.set_transform(limits=[0, upper_limit])
 
                 self.data_for_cytometry_plots['statistics'] = initialise_stats(self.data_for_cytometry_plots['gating'])
-                self.data_for_cytometry_plots['histograms'] = initialise_hists(self.data_for_cytometry_plots['plots'], self.data_for_cytometry_plots)
+                self.data_for_cytometry_plots['histograms'] = self._initialise_histograms()
 
                 # initialise plots
                 if self.bus and self.data_for_cytometry_plots['plots']:
@@ -1241,7 +1462,7 @@ class Controller(QObject):
     def reinitialise_data_for_process_plots(self):
         if self.current_mode == 'process':
             self.data_for_cytometry_plots.update({'event_data': self.unmixed_event_data})
-            self.data_for_cytometry_plots['histograms'] = initialise_hists(self.data_for_cytometry_plots['plots'], self.data_for_cytometry_plots)
+            self.data_for_cytometry_plots['histograms'] = self._initialise_histograms()
             self.calc_hists_and_stats()
             logger.info('Controller: prepared hists for process plots')
 
@@ -1360,7 +1581,8 @@ class Controller(QObject):
     def update_hists_and_stats(self):
         # update thread, calculate hists and stats
         logger.info('Controller: live update hists and stats started')
-        last_update_time = time.perf_counter()
+        self.live_scheduler.reset(time.perf_counter())
+        self.deferred_live_hists = []
         while True:
             if self.stop_live_data_processing.is_set() or self.current_sample_path != self.live_sample_path:
                 logger.info('Controller: live update hists and stats stopped')
@@ -1375,17 +1597,101 @@ class Controller(QObject):
                 self.unmixed_event_data = apply_transfer_matrix(self.transfer_matrix, self.raw_event_data)
                 self.data_for_cytometry_plots['event_data'] = self.unmixed_event_data
 
-            self.calc_hists_and_stats()
+            update_start_time = time.perf_counter()
+            n_plots = len(self.data_for_cytometry_plots['plots'])
+            indices_plots_to_calculate = self.live_plots_to_calculate()
+            self.calc_hists_and_stats(indices_plots_to_calculate=indices_plots_to_calculate)
+            self.defer_or_catch_up_live_hists(indices_plots_to_calculate)
+
+            # measure acquisition rate and processing cost, and size the next batch from them
+            n_displayed = 0 if self.raw_event_data is None else len(self.raw_event_data)
+            n_plots_calculated = n_plots if indices_plots_to_calculate is None else len(indices_plots_to_calculate)
+            now = time.perf_counter()
+            self.live_scheduler.record_update(n_new_events, n_plots_calculated, n_plots, now - update_start_time, now,
+                                              n_skipped=n_new_events - n_displayed)
+            if self.bus:
+                self.bus.statusMessage.emit(self.live_scheduler.status())
 
-            # Calculate elapsed time and sleep precisely
-            new_update_time = time.perf_counter()
-            elapsed = new_update_time - last_update_time
-            last_update_time = new_update_time
+            # wait until the trace analyser commits the next batch of events (or, if none arrive, update anyway after a while)
+            self.events_ready.wait(self.n_live_events_waiting, self.live_scheduler.min_batch_events(), self.live_scheduler.max_batch_wait(),
+                                   timeout=live_data_process_repeat_time, stop=self.stop_live_data_processing)
 
-            live_events_per_second = int(n_new_events / elapsed)
-            if self.bus:
-                self.bus.statusMessage.emit(f'Live acquisition rate {live_events_per_second} events/s')
-            time.sleep(live_data_process_repeat_time)
+    @Slot(str, list)
+    def set_visible_plots(self, mode, indices):
+        self.visible_plots[mode] = set(indices)
+
+    def live_plots_to_calculate(self):
+        # every plot (None) unless live updates can't keep up: then only the plots in view (process plots have their own priorities)
+        visible = self.visible_plots.get(self.current_mode)
+        if not self.live_scheduler.overloaded or visible is None or self.data_for_cytometry_plots is self.data_for_cytometry_plots_process:
+            return None
+        return [n for n in range(len(self.data_for_cytometry_plots['plots'])) if n in visible]
+
+    def defer_or_catch_up_live_hists(self, indices_plots_calculated):
+        # keep the events of the plots skipped by this update, and add them to those plots once there is time (or they come into view)
+        data = self.data_for_cytometry_plots
+        if indices_plots_calculated is not None and data['event_data'] is not None:
+            skipped = [n for n in range(len(data['plots'])) if n not in indices_plots_calculated]
+            if skipped:
+                self.deferred_live_hists.append((data, skipped, data['event_data'], data['gate_membership']))
+        if not self.deferred_live_hists:
+            return
+        visible = self.visible_plots.get(self.current_mode, set())
+        n_deferred_events = sum(len(event_data) for _, _, event_data, _ in self.deferred_live_hists)
+        if (indices_plots_calculated is None or n_deferred_events > settings.live_window_events
+                or any(n in visible for _, skipped, _, _ in self.deferred_live_hists for n in skipped)):
+            self.catch_up_live_hists()
+
+    def catch_up_live_hists(self):
+        # add the deferred events to the plots that skipped them (those of another mode are complete once the sample is reloaded)
+        data = self.data_for_cytometry_plots
+        caught_up = set()
+        for deferred_data, skipped, event_data, gate_membership in self.deferred_live_hists:
+            if deferred_data is not data:
+                continue
+            hists = calc_hists(data | {'event_data': event_data, 'gate_membership': gate_membership}, indices_plots_to_calculate=skipped,
+                               density_cutoff=settings.density_cutoff_retrieved,
+                               dot_plot_by_gate=settings.hist2dtype_retrieved=='Dot plot coloured by gate')
+            for n, hist in zip(skipped, hists):
+                if n < len(data['histograms']) and data['histograms'][n].shape == hist.shape:
+                    data['histograms'][n] += hist
+                    caught_up.add(n)
+        logger.info(f'Controller: live plots {sorted(caught_up)} caught up with {len(self.deferred_live_hists)} deferred updates')
+        self.deferred_live_hists = []
+        if self.bus is not None and caught_up:
+            self.bus.histsStatsRecalculated.emit(self.current_mode, sorted(caught_up))
+
+    def n_live_events_waiting(self):
+        # events committed by the trace analyser and not yet copied for display
+        return self.events_ring.cursor('tail') - self.events_ring.cursor('head')
+
+    def _initialise_histograms(self):
+        # process plot histograms are tiles held by nxn_engine (see NxNGrid); only keep a placeholder per plot
+        if self.data_for_cytometry_plots is self.data_for_cytometry_plots_process:
+            self.reset_nxn_engine()
+            return [None] * len(self.data_for_cytometry_plots['plots'])
+        return initialise_hists(self.data_for_cytometry_plots['plots'], self.data_for_cytometry_plots)
+
+    def reset_nxn_engine(self):
+        # start the NxN tiles afresh for the fluorescence channels and transforms of the process plots
+        data = self.data_for_cytometry_plots_process
+        channels = []
+        if data['pnn'] is not None and data['plots'] and data['transformations']:
+            channels = [data['pnn'][n] for n in data['fluoro_indices']]
+        self.nxn_engine.tile_bins = settings.tile_size_nxn_grid_retrieved
+        self.nxn_engine.reset(channels, [data['transformations'][c].scale for c in channels], settings.density_cutoff_retrieved)
+
+    def add_events_to_nxn_engine(self):
+        data = self.data_for_cytometry_plots_process
+        if not self.nxn_engine.channels or data['event_data'] is None:
+            return
+        source_gate = data['plots'][0]['source_gate']
+        mask = data['gate_membership'].get(source_gate)
+        if mask is None:
+            logger.warning(f"Controller: source gate '{source_gate}' not in gate_membership, NxN tiles not updated")
+            return
+        channel_ids = [data['pnn'].index(c) for c in self.nxn_engine.channels]
+        self.nxn_engine.add_events(data['event_data'], mask, channel_ids)
 
     def calc_hists_and_stats(self, gates_to_calculate=None, indices_plots_to_calculate=None, status_message_signal=None):
         # guard first against this being reached by wrong path
@@ -1406,11 +1712,19 @@ class Controller(QObject):
             statistics = calc_stats(self.data_for_cytometry_plots)
             self.data_for_cytometry_plots['statistics'] = statistics
 
-            hists = calc_hists(self.data_for_cytometry_plots,
-                               indices_plots_to_calculate=indices_plots_to_calculate,
-                               status_message_signal=status_message_signal,
-                               density_cutoff=settings.density_cutoff_retrieved,
-                               dot_plot_by_gate=settings.hist2dtype_retrieved=='Dot plot coloured by gate')
+            if self.data_for_cytometry_plots is self.data_for_cytometry_plots_process:
+                # process plots all share one source gate: recount every tile rather than individual plots
+                if indices_plots_to_calculate is not None:
+                    self.reset_nxn_engine()
+                # tiles are counted on request (see NxNGrid)
+                self.add_events_to_nxn_engine()
+                hists = []
+            else:
+                hists = calc_hists(self.data_for_cytometry_plots,
+                                   indices_plots_to_calculate=indices_plots_to_calculate,
+                                   status_message_signal=status_message_signal,
+                                   density_cutoff=settings.density_cutoff_retrieved,
+                                   dot_plot_by_gate=settings.hist2dtype_retrieved=='Dot plot coloured by gate')
             if indices_plots_to_calculate is None:
                 indices_plots_to_calculate = list(range(len(self.data_for_cytometry_plots['plots'])))
 
@@ -1663,7 +1977,7 @@ class Controller(QObject):
 if __name__ == '__main__':
     import multiprocessing as mp
     mp.set_start_method("spawn")
-    from multiprocessing import Lock
+    from honeychrome.controller_components.shared_ring import create_traces_ring, create_events_ring
 
     '''
     1.
@@ -1762,21 +2076,15 @@ if __name__ == '__main__':
     -Runs unmixing
     '''
 
-    # Allocate shared memory block, plus head and tail indices
-    traces_cache_shm = shared_memory.SharedMemory(create=True, size=np.zeros(traces_cache_size, dtype=traces_cache_dtype).nbytes)
-    traces_cache_lock = Lock()
-    index_head_traces_cache = mp.Value('i', 0)
-    index_tail_traces_cache = mp.Value('i', 0)
-
-    events_cache_shm = shared_memory.SharedMemory(create=True,
-                                                  size=np.zeros((max_events_in_cache, n_channels_per_event),
-                                                                dtype=np.int64).nbytes)
-    events_cache_lock = Lock()
-    index_head_events_cache = mp.Value('i', 0)
-    index_tail_events_cache = mp.Value('i', 0)
-
-    # oscilloscope traces
-    oscilloscope_traces_queue = mp.Queue()
+    # traces and events caches
+    traces_ring = create_traces_ring()
+    events_ring = create_events_ring(channel_dict['event_channels_pnn'])
+
+    # oscilloscope trace
+    oscilloscope_slot = OscilloscopeSlot()
+    # wakeups: instrument -> analyser -> controller
+    traces_ready = Wakeup()
+    events_ready = Wakeup()
     # command pipes
     pipe_experiment_instrument_e, pipe_experiment_instrument_i = mp.Pipe()
     pipe_experiment_analyser_e, pipe_experiment_analyser_a = mp.Pipe()
@@ -1785,11 +2093,9 @@ if __name__ == '__main__':
     Firstly, set up experiment controller
     '''
     kc = Controller(
-            events_cache_name=events_cache_shm.name,
-            events_cache_lock=events_cache_lock,
-            index_head_events_cache=index_head_events_cache,
-            index_tail_events_cache=index_tail_events_cache,
-            oscilloscope_traces_queue=oscilloscope_traces_queue,
+            events_ring=events_ring,
+            oscilloscope_slot=oscilloscope_slot,
+            events_ready=events_ready,
             pipe_connection_instrument=pipe_experiment_instrument_e,
             pipe_connection_analyser=pipe_experiment_analyser_e)
 
@@ -1805,9 +2111,8 @@ if __name__ == '__main__':
     # start instrument dummy
     from honeychrome.instrument_communicator import Instrument
 
-    instrument = Instrument(use_dummy_instrument=True, traces_cache_name=traces_cache_shm.name,
-        traces_cache_lock=traces_cache_lock, index_head_traces_cache=index_head_traces_cache,
-        index_tail_traces_cache=index_tail_traces_cache, pipe_connection=pipe_experiment_instrument_i)
+    instrument = Instrument(use_dummy_instrument=True, traces_ring=traces_ring, traces_ready=traces_ready,
+        pipe_connection=pipe_experiment_instrument_i)
     instrument.start()
 
     '''
@@ -1815,11 +2120,8 @@ if __name__ == '__main__':
     '''
     from honeychrome.trace_analyst import TraceAnalyser
 
-    trace_analyser = TraceAnalyser(traces_cache_name=traces_cache_shm.name, traces_cache_lock=traces_cache_lock,
-        index_head_traces_cache=index_head_traces_cache, index_tail_traces_cache=index_tail_traces_cache,
-        events_cache_name=events_cache_shm.name, events_cache_lock=events_cache_lock,
-        index_head_events_cache=index_head_events_cache, index_tail_events_cache=index_tail_events_cache,
-        oscilloscope_traces_queue=oscilloscope_traces_queue,
+    trace_analyser = TraceAnalyser(traces_ring=traces_ring, events_ring=events_ring, oscilloscope_slot=oscilloscope_slot,
+        traces_ready=traces_ready, events_ready=events_ready,
         pipe_connection=pipe_experiment_analyser_a)
     trace_analyser.start()
 
@@ -1853,7 +2155,9 @@ if __name__ == '__main__':
     kc.quit_instrument_quit_analyser()
     trace_analyser.join()
     instrument.join()
-    traces_cache_shm.close()
-    events_cache_shm.close()
-    traces_cache_shm.unlink()
-    events_cache_shm.unlink()
+    traces_ring.close()
+    events_ring.close()
+    traces_ring.unlink()
+    events_ring.unlink()
+    oscilloscope_slot.close()
+    oscilloscope_slot.unlink()
@@ -17,6 +17,11 @@ precompute_af_matrices(fluor_spectra, af_spectra)
     Precomputes projection matrices; call once after spectral process refresh
     and cache the result on the controller.
 
+load_or_precompute_af_matrices(fluor_spectra, af_spectra, cache_dir)
+    precompute_af_matrices plus precompute_joint_cov_extras, persisted as .npz
+    in cache_dir keyed by a hash of both spectra, so they are computed once
+    per spectral model and AF profile rather than on every load.
+
 apply_af_transfer(raw_event_data, transfer_matrix, af_precomputed, af_spectra, settings)
     Assembles a full unmixed event array, overwriting fluorescence columns
     with AF-corrected OLS values.
@@ -30,10 +35,18 @@ load_af_profile_csv(csv_path)
     Returns (profile_name, spectra_ndarray, channel_names).
 """
 
+import contextlib
+import hashlib
 import numpy as np
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from threadpoolctl import threadpool_limits
+
+from honeychrome.settings import af_unmixing_max_workers
+from honeychrome.controller_components.timing import traced
+
 try:
     from honeychrome.controller_components.af_kernel_wrapper import (
         joint_cov_l1_argmin as _c_joint_cov_l1_argmin,
@@ -198,6 +211,55 @@ def precompute_joint_cov_extras(precomputed: dict, af_spectra: np.ndarray) -> di
     return {'af_error_weights': af_error_weights}
 
 
+def af_precomputed_cache_key(fluor_spectra: np.ndarray, af_spectra: np.ndarray) -> str:
+    """Hash of the fluorophore and AF spectra that determine precompute_af_matrices()."""
+    h = hashlib.sha1()
+    for spectra in (fluor_spectra, af_spectra):
+        spectra = np.ascontiguousarray(spectra, dtype=np.float64)
+        h.update(str(spectra.shape).encode())
+        h.update(spectra.tobytes())
+    return h.hexdigest()
+
+
+def load_or_precompute_af_matrices(fluor_spectra: np.ndarray, af_spectra: np.ndarray,
+                                   cache_dir: str | Path | None = None) -> dict:
+    """
+    Return precompute_af_matrices() merged with precompute_joint_cov_extras(),
+    reading them from cache_dir if they were saved for these exact spectra.
+
+    Parameters
+    ----------
+    fluor_spectra : (n_fluors, n_channels)
+    af_spectra    : (n_af, n_channels)
+    cache_dir     : folder for the .npz entries (usually <experiment>/cache/af_precomputed);
+                    None disables persistence
+
+    Returns
+    -------
+    dict with keys P, S_t, v_library, r_library, r_dots, af_error_weights
+    """
+    path = None
+    if cache_dir is not None:
+        path = Path(cache_dir) / f'{af_precomputed_cache_key(fluor_spectra, af_spectra)}.npz'
+        if path.exists():
+            try:
+                with np.load(path, allow_pickle=False) as npz:
+                    return {key: npz[key] for key in npz.files}
+            except (OSError, ValueError) as e:
+                logger.warning(f'load_or_precompute_af_matrices: unreadable cache entry {path} ({e}), recomputing')
+
+    precomputed = precompute_af_matrices(fluor_spectra, af_spectra)
+    precomputed.update(precompute_joint_cov_extras(precomputed, af_spectra))
+
+    if path is not None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            np.savez_compressed(path, **precomputed)
+        except OSError as e:
+            logger.warning(f'load_or_precompute_af_matrices: could not write cache entry {path} ({e})')
+    return precomputed
+
+
 def combine_af_precomputed(precomputed_list: list) -> dict:
     """
     Combine a list of per-profile precomputed dicts into one combined dict.
@@ -235,7 +297,7 @@ def combine_af_precomputed(precomputed_list: list) -> dict:
 # ---------------------------------------------------------------------------
 
 def apply_af_transfer(raw_event_data, transfer_matrix, af_precomputed, af_spectra, settings,
-                      filtered_fl_ids_raw=None, spillover=None):
+                      filtered_fl_ids_raw=None, spillover=None, n_workers=None, limit_blas_threads=False):
     """
     Assemble a full unmixed event array with AF-corrected fluorescence columns.
     Scatter, time, and event_id columns come from the standard transfer_matrix path.
@@ -245,6 +307,7 @@ def apply_af_transfer(raw_event_data, transfer_matrix, af_precomputed, af_spectr
     to those fluorescence columns so the result matches the compensated transfer_matrix
     path. The transpose matches spillover's row-spills-into-column convention to the
     column-vector multiplication used below (see controller.py::initialise_transfer_matrix).
+    n_workers and limit_blas_threads are passed to apply_af_unmixing.
     """
     from honeychrome.controller_components.functions import apply_transfer_matrix
 
@@ -258,15 +321,16 @@ def apply_af_transfer(raw_event_data, transfer_matrix, af_precomputed, af_spectr
         
     fl_ids_unmixed = np.array(unmixed_settings['fluorescence_channel_ids'])
 
-    unmixed = raw_event_data @ transfer_matrix
+    # fluorescence columns are about to be overwritten, so only the pass-through columns are built here
+    unmixed = apply_transfer_matrix(transfer_matrix, raw_event_data, skip_columns=fl_ids_unmixed)
 
     raw_fl = raw_event_data[:, fl_ids_raw]
-    result = apply_af_unmixing(raw_fl, af_precomputed, af_spectra)
+    result = apply_af_unmixing(raw_fl, af_precomputed, af_spectra, n_workers=n_workers, limit_blas_threads=limit_blas_threads)
     af_unmixed_fl = result['unmixed']  # (n_cells, n_fluors) — plain OLS space
 
     if spillover is not None:
         compensation = np.linalg.inv(np.array(spillover)).T
-        af_unmixed_fl = (compensation @ af_unmixed_fl.T).T
+        af_unmixed_fl = af_unmixed_fl @ compensation.T
 
     unmixed[:, fl_ids_unmixed] = af_unmixed_fl
 
@@ -281,12 +345,110 @@ def apply_af_transfer(raw_event_data, transfer_matrix, af_precomputed, af_spectr
 # Per-sample unmixing
 # ---------------------------------------------------------------------------
 
-# after
+def _af_chunk_scratch(chunk_size: int, n_channels: int, n_fluors: int, n_af: int, use_c: bool = False) -> dict:
+    """Per-worker scratch buffers for _af_unmix_chunk, sized for a full chunk (with those of the C kernel path if use_c)."""
+    scratch = {
+        'chunk':      np.empty((chunk_size, n_channels), dtype=np.float64),
+        'init_fluor': np.empty((chunk_size, n_fluors),   dtype=np.float64),
+        'K':          np.empty((chunk_size, n_af),       dtype=np.float64),
+        'residual':   np.empty((chunk_size, n_channels), dtype=np.float64),
+    }
+    if use_c:
+        scratch.update({
+            'fluor_nn':     np.empty((chunk_size, n_fluors),   dtype=np.float64),
+            'resid_base':   np.empty((chunk_size, n_channels), dtype=np.float64),
+            'rb_rl':        np.empty((chunk_size, n_af),       dtype=np.float64),
+            'e_resid':      np.empty((chunk_size, n_af),       dtype=np.float64),
+            'rb_sq':        np.empty(chunk_size,               dtype=np.float64),
+            'base_e_resid': np.empty(chunk_size,               dtype=np.float64),
+            'base_e_fluor': np.empty(chunk_size,               dtype=np.float64),
+        })
+    else:
+        scratch.update({
+            'error': np.empty((chunk_size, n_af), dtype=np.float64),
+            'term':  np.empty((chunk_size, n_af), dtype=np.float64),
+        })
+    return scratch
+
+
+def _af_unmix_chunk(raw_chunk, consts, scratch, unmixed_out, af_scale_out, af_idx_out):
+    """
+    AF-unmix one chunk of cells into the given output slices, using only the
+    caller's scratch buffers for the (B, ·) intermediates.
+    """
+    P, P_t, S_t = consts['P'], consts['P_t'], consts['S_t']
+    v_library, r_library, r_dots = consts['v_library'], consts['r_library'], consts['r_dots']
+    af_spectra, w = consts['af_spectra'], consts['w']
+
+    B     = raw_chunk.shape[0]
+    chunk = scratch['chunk'][:B]
+    chunk[...] = raw_chunk
+
+    init_fluor = np.matmul(chunk, P_t, out=scratch['init_fluor'][:B])
+    K          = np.matmul(chunk, r_library, out=scratch['K'][:B])
+    K         /= r_dots[np.newaxis, :]
+
+    if w is not None:
+        # L2 residual term — vectorised NumPy, in the scratch buffers (contiguous, as the kernel needs)
+        fluor_nn   = np.maximum(init_fluor, 0.0, out=scratch['fluor_nn'][:B])
+        resid_base = np.matmul(fluor_nn, S_t.T, out=scratch['resid_base'][:B])
+        np.subtract(chunk, resid_base, out=resid_base)
+        rb_sq      = np.einsum('ij,ij->i', resid_base, resid_base, out=scratch['rb_sq'][:B])
+        rb_rl      = np.matmul(resid_base, r_library, out=scratch['rb_rl'][:B])
+        # |resid_base - K r|^2 = rb_sq - 2 K rb_rl + K^2 r_dots = rb_sq + K (K r_dots - 2 rb_rl)
+        e_resid    = np.multiply(K, r_dots[np.newaxis, :], out=scratch['e_resid'][:B])
+        rb_rl     *= 2.0
+        e_resid   -= rb_rl
+        e_resid   *= K
+        e_resid   += rb_sq[:, np.newaxis]
+        np.maximum(e_resid, 0.0, out=e_resid)
+        np.sqrt(e_resid, out=e_resid)
+        base_e_resid  = np.sqrt(rb_sq, out=scratch['base_e_resid'][:B])
+        base_e_resid += 1e-6
+        abs_fluor     = np.abs(init_fluor, out=fluor_nn) # fluor_nn is free again
+        base_e_fluor  = np.matmul(abs_fluor, w, out=scratch['base_e_fluor'][:B])
+        base_e_fluor += 1e-6
+
+        # C kernel: L1 fluor scoring + argmin, OpenMP-parallel
+        best_j = _c_joint_cov_l1_argmin(
+            init_fluor,
+            K,
+            v_library,
+            w,
+            base_e_fluor,
+            e_resid,
+            base_e_resid,
+        )
+    else:
+        # NumPy fallback: plain L1 accumulated one fluorophore at a time into
+        # the (B, n_af) error block, so no (B, n_fluors, n_af) temporary is built
+        error = scratch['error'][:B]
+        term  = scratch['term'][:B]
+        error[...] = 0.0
+        for f in range(P.shape[0]):
+            np.multiply(K, v_library[f], out=term)
+            np.subtract(init_fluor[:, f:f + 1], term, out=term)
+            np.abs(term, out=term)
+            error += term
+        best_j = np.argmin(error, axis=1)
+
+    best_k   = K[np.arange(B), best_j]
+    residual = scratch['residual'][:B]
+    np.multiply(best_k[:, np.newaxis], af_spectra[best_j], out=residual)
+    np.subtract(chunk, residual, out=residual)
+    np.matmul(residual, P_t, out=unmixed_out)
+    af_scale_out[:] = best_k
+    af_idx_out[:]   = best_j + 1
+
+
+@traced('af_unmixing')
 def apply_af_unmixing(
     raw_data: np.ndarray,
     precomputed: dict,
     af_spectra: np.ndarray,
     chunk_size: int = 50_000,
+    n_workers: int | None = None,
+    limit_blas_threads: bool = False,
 ) -> dict:
     """
     Per-cell AF extraction and OLS unmixing (fluorescence channels only).
@@ -296,6 +458,18 @@ def apply_af_unmixing(
     over cells with OpenMP.  Falls back to plain NumPy L1 if the extension
     is absent or if af_error_weights is missing from precomputed.
 
+    On the NumPy path chunks are processed concurrently on a thread pool
+    (NumPy and BLAS release the GIL); the C kernel path is parallel within
+    each chunk (OpenMP), so runs its chunks in one thread.  Each worker owns
+    preallocated scratch buffers for every (B, ·) intermediate and writes
+    straight into its chunks' slices of the output arrays.
+
+    BLAS and OpenMP thread pools are per process, not per thread, so they are
+    left alone unless limit_blas_threads: then they are limited to one thread
+    for the whole process while the workers run.  Only set it where this call
+    owns the process (a statistics worker process), never in the app's own
+    process, where it would slow every other NumPy call meanwhile.
+
     Parameters
     ----------
     raw_data    : (n_cells, n_channels) raw fluorescence only
@@ -303,81 +477,62 @@ def apply_af_unmixing(
                   with precompute_joint_cov_extras() merged in
     af_spectra  : (n_af, n_channels)
     chunk_size  : cells per processing batch
+    n_workers   : worker threads; None uses settings af_unmixing_max_workers
+                  on the NumPy path and 1 on the C kernel path (capped at the
+                  number of chunks), 1 runs chunks serially in this thread
+    limit_blas_threads : limit BLAS/OpenMP to one thread, process-wide, while
+                  more than one worker runs (see above)
 
     Returns
     -------
     dict with keys: unmixed (n_cells, n_fluors), af_scale (n_cells,),
                     af_idx (n_cells,) 1-based
     """
-    P         = precomputed['P']           # (n_fluors, n_channels)
-    v_library = precomputed['v_library']   # (n_fluors, n_af)
-    r_library = precomputed['r_library']   # (n_channels, n_af)
-    r_dots    = precomputed['r_dots']      # (n_af,)
-    S_t       = precomputed['S_t']         # (n_channels, n_fluors)
-
+    P = np.asarray(precomputed['P'], dtype=np.float64)  # (n_fluors, n_channels)
     w = precomputed.get('af_error_weights')
     use_c = AF_KERNEL_AVAILABLE and w is not None
 
-    n_cells, _ = raw_data.shape
-    n_fluors   = P.shape[0]
+    consts = {
+        'P':          P,
+        'P_t':        np.ascontiguousarray(P.T),
+        'S_t':        np.asarray(precomputed['S_t'], dtype=np.float64),                        # (n_channels, n_fluors)
+        'v_library':  np.ascontiguousarray(precomputed['v_library'], dtype=np.float64),        # (n_fluors, n_af)
+        'r_library':  np.ascontiguousarray(precomputed['r_library'], dtype=np.float64),        # (n_channels, n_af)
+        'r_dots':     np.asarray(precomputed['r_dots'], dtype=np.float64),                     # (n_af,)
+        'af_spectra': np.asarray(af_spectra, dtype=np.float64),
+        'w':          np.ascontiguousarray(w, dtype=np.float64) if use_c else None,
+    }
+
+    n_cells, n_channels = raw_data.shape
+    n_fluors = P.shape[0]
+    n_af     = consts['r_dots'].shape[0]
 
     unmixed_out  = np.empty((n_cells, n_fluors), dtype=np.float64)
     af_scale_out = np.empty(n_cells,             dtype=np.float64)
     af_idx_out   = np.empty(n_cells,             dtype=np.int32)
 
-    if use_c:
-        w       = np.ascontiguousarray(w, dtype=np.float64)
-        v_lib_c = np.ascontiguousarray(v_library, dtype=np.float64)
-
-    for start in range(0, n_cells, chunk_size):
-        end   = min(start + chunk_size, n_cells)
-        chunk = np.ascontiguousarray(raw_data[start:end], dtype=np.float64)
-        B     = end - start
-
-        init_fluor = chunk @ P.T
-        K          = (chunk @ r_library) / r_dots[np.newaxis, :]
-
-        if use_c:
-            # L2 residual term — vectorised NumPy
-            init_fluor_nn = np.where(init_fluor < 0.0, 0.0, init_fluor)
-            resid_base    = chunk - init_fluor_nn @ S_t.T
-            rb_sq         = np.sum(resid_base ** 2, axis=1)
-            rb_rl         = resid_base @ r_library
-            er_sq         = (rb_sq[:, np.newaxis]
-                             - 2.0 * K * rb_rl
-                             + K ** 2 * r_dots[np.newaxis, :])
-            e_resid      = np.ascontiguousarray(np.sqrt(np.maximum(er_sq, 0.0)))
-            base_e_resid = np.sqrt(rb_sq) + 1e-6
-            base_e_fluor = (np.sum(w[np.newaxis, :] * np.abs(init_fluor), axis=1)
-                            + 1e-6)
-
-            # C kernel: L1 fluor scoring + argmin, OpenMP-parallel
-            best_j = _c_joint_cov_l1_argmin(
-                np.ascontiguousarray(init_fluor),
-                np.ascontiguousarray(K),
-                v_lib_c,
-                w,
-                np.ascontiguousarray(base_e_fluor),
-                e_resid,
-                np.ascontiguousarray(base_e_resid),
-            )
-        else:
-            # NumPy fallback: plain L1, 3D temporary
-            error = np.sum(
-                np.abs(
-                    init_fluor[:, :, np.newaxis]
-                    - K[:, np.newaxis, :] * v_library[np.newaxis, :, :]
-                ),
-                axis=1,
-            )
-            best_j = np.argmin(error, axis=1)
-
-        best_k   = K[np.arange(B), best_j]
-        best_af  = af_spectra[best_j]
-        residual = chunk - best_k[:, np.newaxis] * best_af
-        unmixed_out[start:end]  = residual @ P.T
-        af_scale_out[start:end] = best_k
-        af_idx_out[start:end]   = best_j + 1
+    starts = list(range(0, n_cells, chunk_size))
+    if n_workers is None:
+        n_workers = 1 if use_c else af_unmixing_max_workers
+    n_workers = max(1, min(n_workers, len(starts)))
+    buffer_rows = min(chunk_size, n_cells)
+
+    def worker(worker_starts):
+        scratch = _af_chunk_scratch(buffer_rows, n_channels, n_fluors, n_af, use_c)
+        for start in worker_starts:
+            end = min(start + chunk_size, n_cells)
+            _af_unmix_chunk(raw_data[start:end], consts, scratch,
+                            unmixed_out[start:end], af_scale_out[start:end], af_idx_out[start:end])
+
+    if n_workers == 1:
+        worker(starts)
+    else:
+        # if the process is ours, the workers are the parallelism: one BLAS (and OpenMP) thread each
+        with (threadpool_limits(limits=1) if limit_blas_threads else contextlib.nullcontext()), \
+                ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # interleave chunks across workers so the last partial chunk doesn't skew one worker
+            for future in [executor.submit(worker, starts[i::n_workers]) for i in range(n_workers)]:
+                future.result()
 
     return {'unmixed': unmixed_out, 'af_scale': af_scale_out, 'af_idx': af_idx_out}
 
@@ -0,0 +1,129 @@
+'''
+The live events cache ring and the spilling of its events.
+
+Events are stored as records with one named field per event channel, in the
+layout set by settings.events_cache_layout: compact records hold Time (in ms)
+and event_id as uint32 and the measurements as float32, 4 bytes a value.
+
+The events cache shared with the trace analyser is a ring of the most recent
+events (a SharedRing, see shared_ring). The spill writer hands every
+published event to a write function, in order, and then advances the ring's
+spilled cursor. The controller writes them straight into the live sample's
+FCS file (StreamingFCSWriter). The spilled cursor is the ring's release
+cursor, so no event is overwritten before it is on disk, and an acquisition
+of any length runs in the fixed memory of the ring.
+
+If writing fails (the disk is full, the file was removed), the spill writer
+detaches: it reports the error through on_failure, once, and from then on
+releases events without writing them, so the trace analyser is not held up
+waiting for space; the events dropped are counted and logged.
+'''
+import threading
+
+import numpy as np
+
+from honeychrome.settings import events_cache_layout
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def events_cache_dtype(event_channels_pnn, layout=events_cache_layout):
+    '''record dtype of the events cache for these event channels'''
+    if layout == 'compact':
+        return np.dtype([(channel, '<u4' if channel in ('Time', 'event_id') else '<f4') for channel in event_channels_pnn])
+    if layout == 'int64':
+        return np.dtype([(channel, '<i8') for channel in event_channels_pnn])
+    raise ValueError(f'events_cache_dtype: unknown events cache layout {layout}')
+
+
+def events_to_float(events):
+    '''
+    events cache records as a new float64 (n_events, n_channels) array, channels in record order
+    all fields are the same size, so the records are read as one 2D array of the commonest field type and the other fields patched in
+    '''
+    names = events.dtype.names
+    field_dtypes = [events.dtype.fields[name][0] for name in names]
+    common = max(set(field_dtypes), key=field_dtypes.count)
+    data = np.ascontiguousarray(events).view(common).reshape(len(events), len(names)).astype(np.float64)
+    for n, field_dtype in enumerate(field_dtypes):
+        if field_dtype != common:
+            data[:, n] = events[names[n]]
+    return data
+
+
+class EventsSpillWriter:
+    '''
+    passes events from the events ring to write(events) on a background thread, every interval seconds
+    the events are views of the ring (valid during the call); its spilled cursor is advanced here once they are written
+    on_failure(exception), if given, is called (on the spill thread, or in stop()) the first time writing fails; after
+    that events are released unwritten (n_dropped), and error holds the exception
+    '''
+    def __init__(self, write, events_ring, interval, on_failure=None):
+        self.write = write
+        self.events_ring = events_ring
+        self.interval = interval
+        self.on_failure = on_failure
+        self.n_events = 0
+        self.n_dropped = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.n_events = self.events_ring.cursor('spilled')
+        self.n_dropped = 0
+        self.error = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.spill_or_drop()
+
+    def spill(self):
+        '''write all events committed since the last spill; returns the number written'''
+        n_spilled = 0
+        for events in self.events_ring.views(self.n_events, self.events_ring.cursor('tail')):
+            self.write(events)
+            n_spilled += len(events)
+            self.n_events += len(events)
+            self.events_ring.advance('spilled', self.n_events)
+        return n_spilled
+
+    def drop(self):
+        '''release all events committed since the last spill without writing them; returns the number dropped'''
+        tail = self.events_ring.cursor('tail')
+        n_dropped = tail - self.n_events - self.n_dropped
+        if n_dropped > 0:
+            self.n_dropped += n_dropped
+            self.events_ring.advance('spilled', tail)
+            logger.warning(f'EventsSpillWriter: {n_dropped} events dropped ({self.n_dropped} in all), not written since {self.error}')
+        return max(n_dropped, 0)
+
+    def spill_or_drop(self):
+        '''spill, or once writing has failed, drop; never raises'''
+        if self.error is None:
+            try:
+                return self.spill()
+            except Exception as e:
+                logger.exception(f'EventsSpillWriter: failed to spill events, releasing them unwritten from now on ({e})')
+                self.error = e
+                if self.on_failure is not None:
+                    try:
+                        self.on_failure(e)
+                    except Exception:
+                        logger.exception('EventsSpillWriter: on_failure failed')
+        self.drop()
+        return 0
+
+    def stop(self):
+        '''stop the thread and spill what is left; returns the number of events spilled (never raises: see error)'''
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.spill_or_drop()
+            logger.info(f'EventsSpillWriter: {self.n_events} events spilled' + (f', {self.n_dropped} dropped' if self.n_dropped else ''))
+        return self.n_events
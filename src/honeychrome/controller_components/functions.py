@@ -8,6 +8,7 @@ from time import perf_counter
 from functools import wraps
 from pathlib import Path
 from honeychrome.controller_components.transform import Transform
+from honeychrome.controller_components.timing import span, traced
 from honeychrome.settings import linear_a, logicle_w, logicle_m, logicle_a, log_m
 
 q_settings = QSettings("honeychrome", "ExperimentSelector")
@@ -167,6 +168,7 @@ def add_recent_file(path):
     recent.insert(0, path)
     q_settings.setValue("recent_files", recent)  # store full history
 
+@traced('export')
 def export_unmixed_sample(
     sample_name: str,
     unmixed_folder: 'Path | str',
@@ -245,6 +247,23 @@ def export_unmixed_sample(
 
     write_fcs(export_event_data, keywords, file_path)
 
+def define_raw_fcs_keywords(pnn: list, tube_name: str, magnitude_ceiling: int, flow_rate: float | None = None) -> dict:
+    """
+    TEXT keywords for a raw sample acquired on the instrument, as flowkit's Sample.export writes them
+    (float32 parameters with no gain or log amplification), for write_fcs or StreamingFCSWriter.
+    """
+    keywords = {}
+    for n, channel in enumerate(pnn, start=1):
+        keywords[f'$P{n}N'] = channel
+        keywords[f'$P{n}B'] = '32'
+        keywords[f'$P{n}E'] = '0,0'
+        keywords[f'$P{n}G'] = '1.0'
+        keywords[f'$P{n}R'] = str(magnitude_ceiling)
+    keywords['TUBENAME'] = tube_name
+    if flow_rate is not None:
+        keywords['FLOW_RATE'] = str(flow_rate)
+    return keywords
+
 def define_fcs_keywords(
     raw_keywords: 'dict[str, str]',
     pnn: list,
@@ -499,26 +518,23 @@ def _format_spillover(fl_pnn: list[str], spillover: np.ndarray) -> str:
     names = ','.join(fl_pnn)
     return f'{n},{names},{vals}'
 
-def write_fcs(
-    event_data: np.ndarray,  # (n_events, n_channels), float32 written row-major
+def fcs_header_and_text(
     keywords: dict[str, str],
-    file_path: Path | str,
-    chunk_rows: int = 131_072,
-) -> None:
+    n_events: int,
+    n_channels: int,
+    data_start: int | None = None,
+) -> tuple[bytes, bytes]:
     """
-    Write a minimal FCS 3.1 file (HEADER + TEXT + DATA).
-    Data written as little-endian float32, row-major (one event per row).
-    Mirrors writeFCS.R from AutoSpectral.
+    HEADER and TEXT segments of an FCS 3.1 file of float32 list-mode data.
+    With data_start None, DATA follows TEXT directly; otherwise DATA begins at data_start (TEXT must end before it),
+    which lets a file written in place keep its DATA where it is while TEXT is rewritten.
     """
-    import struct
-
     DELIM = '|'
-    file_path = Path(file_path)
 
     # Mandatory field overrides (ensure consistency)
     kw = dict(keywords)
-    kw['$TOT']           = str(event_data.shape[0])
-    kw['$PAR']           = str(event_data.shape[1])
+    kw['$TOT']           = str(n_events)
+    kw['$PAR']           = str(n_channels)
     kw['$DATATYPE']      = 'F'
     kw['$BYTEORD']       = '1,2,3,4'
     kw['$NEXTDATA']      = '0'
@@ -537,43 +553,54 @@ def write_fcs(
             f'{k}{DELIM}{v}{DELIM}' for k, v in kw_dict.items()
         )
 
-    text = _build_text(kw)
-    text_bytes = text.encode('utf-8')
-    TEXT_END = TEXT_START + len(text_bytes) - 1
-    data_bytes = event_data.shape[0] * event_data.shape[1] * 4  # float32
+    data_bytes = n_events * n_channels * 4  # float32
 
-    # Iterative layout: grow TEXT_END until $BEGINDATA/$ENDDATA digit-lengths stabilise.
-    # Seed with the actual encoded lengths of the placeholder values already in kw.
-    kw_len_old = len(kw['$BEGINDATA']) + len(kw['$ENDDATA'])
-    while True:
-        DATA_START = TEXT_END + 1
+    if data_start is not None:
+        DATA_START = data_start
         DATA_END   = DATA_START + data_bytes - 1
-        kw_len_new = len(str(DATA_START)) + len(str(DATA_END))
-        if kw_len_new > kw_len_old:
-            TEXT_END  += kw_len_new - kw_len_old
-            kw_len_old = kw_len_new
-        else:
-            break
-
-    # Patch offsets and iterate until the encoded text length stops changing.
-    # Each rebuild may change $BEGINDATA/$ENDDATA digit counts, which shifts
-    # DATA_START and therefore DATA_END, which may change digit counts again.
-    for _ in range(8):  # converges in ≤3 iterations in practice
         kw['$BEGINDATA'] = str(DATA_START)
         kw['$ENDDATA']   = str(DATA_END)
+        text_bytes = _build_text(kw).encode('latin-1')
+        TEXT_END = TEXT_START + len(text_bytes) - 1
+        if TEXT_END >= DATA_START:
+            raise ValueError(f'fcs_header_and_text: TEXT ({len(text_bytes)} bytes) does not fit before DATA at {DATA_START}')
+    else:
         text = _build_text(kw)
-        text_bytes = text.encode('latin-1')
-        new_TEXT_END = TEXT_START + len(text_bytes) - 1
-        new_DATA_START = new_TEXT_END + 1
-        new_DATA_END   = new_DATA_START + data_bytes - 1
-        if new_DATA_START == DATA_START and new_DATA_END == DATA_END:
+        text_bytes = text.encode('utf-8')
+        TEXT_END = TEXT_START + len(text_bytes) - 1
+
+        # Iterative layout: grow TEXT_END until $BEGINDATA/$ENDDATA digit-lengths stabilise.
+        # Seed with the actual encoded lengths of the placeholder values already in kw.
+        kw_len_old = len(kw['$BEGINDATA']) + len(kw['$ENDDATA'])
+        while True:
+            DATA_START = TEXT_END + 1
+            DATA_END   = DATA_START + data_bytes - 1
+            kw_len_new = len(str(DATA_START)) + len(str(DATA_END))
+            if kw_len_new > kw_len_old:
+                TEXT_END  += kw_len_new - kw_len_old
+                kw_len_old = kw_len_new
+            else:
+                break
+
+        # Patch offsets and iterate until the encoded text length stops changing.
+        # Each rebuild may change $BEGINDATA/$ENDDATA digit counts, which shifts
+        # DATA_START and therefore DATA_END, which may change digit counts again.
+        for _ in range(8):  # converges in ≤3 iterations in practice
+            kw['$BEGINDATA'] = str(DATA_START)
+            kw['$ENDDATA']   = str(DATA_END)
+            text = _build_text(kw)
+            text_bytes = text.encode('latin-1')
+            new_TEXT_END = TEXT_START + len(text_bytes) - 1
+            new_DATA_START = new_TEXT_END + 1
+            new_DATA_END   = new_DATA_START + data_bytes - 1
+            if new_DATA_START == DATA_START and new_DATA_END == DATA_END:
+                TEXT_END = new_TEXT_END
+                break
             TEXT_END = new_TEXT_END
-            break
-        TEXT_END = new_TEXT_END
-        DATA_START = new_DATA_START
-        DATA_END   = new_DATA_END
-    else:
-        raise RuntimeError(f'write_fcs: offset layout did not converge for {file_path}')
+            DATA_START = new_DATA_START
+            DATA_END   = new_DATA_END
+        else:
+            raise RuntimeError('fcs_header_and_text: offset layout did not converge')
 
     # FCS 3.1 §3.1: header offset fields are 8 chars each.
     # If DATA_START or DATA_END exceed 8 digits, write 0 in the header —
@@ -585,9 +612,28 @@ def write_fcs(
         + _h(DATA_START)  + _h(DATA_END)
         + '       0'      + '       0'   # STEXT always 0
     )
+    return header.encode('ascii'), text_bytes
+
+@traced('write_fcs')
+def write_fcs(
+    event_data: np.ndarray,  # (n_events, n_channels), float32 written row-major
+    keywords: dict[str, str],
+    file_path: Path | str,
+    chunk_rows: int = 131_072,
+) -> None:
+    """
+    Write a minimal FCS 3.1 file (HEADER + TEXT + DATA).
+    Data written as little-endian float32, row-major (one event per row).
+    Mirrors writeFCS.R from AutoSpectral.
+    """
+    file_path = Path(file_path)
+    try:
+        header, text_bytes = fcs_header_and_text(keywords, event_data.shape[0], event_data.shape[1])
+    except RuntimeError:
+        raise RuntimeError(f'write_fcs: offset layout did not converge for {file_path}')
 
     with open(file_path, 'wb') as fh:
-        fh.write(header.encode('ascii'))
+        fh.write(header)
         fh.write(text_bytes)
         # Write event data in chunks (row-major, float32 little-endian)
         rows_remaining = event_data.shape[0]
@@ -601,6 +647,59 @@ def write_fcs(
         fh.write(b'00000000')  # CRC placeholder
 
 
+class StreamingFCSWriter:
+    """
+    FCS 3.1 file written while events arrive, in the layout of write_fcs.
+    TEXT is given room for its largest offsets and event count up front, so DATA
+    never moves: append() adds events at the end of DATA and rewrites TEXT and
+    HEADER in place for the new event count. The file on disk is therefore a
+    valid FCS file of every event appended so far, even if the writer never
+    gets to close() (which adds the CRC placeholder, as write_fcs does).
+    """
+    _max_digits = 20
+
+    def __init__(self, file_path: Path | str, keywords: dict[str, str], n_channels: int):
+        self.file_path = Path(file_path)
+        self.keywords = dict(keywords)
+        self.n_channels = n_channels
+        self.n_events = 0
+
+        # room for TEXT with the widest $TOT, $BEGINDATA and $ENDDATA it will ever hold
+        _, text_bytes = fcs_header_and_text(self.keywords, 10 ** self._max_digits, n_channels, data_start=10 ** self._max_digits)
+        self.data_start = 58 + len(text_bytes)
+
+        self._fh = open(self.file_path, 'wb')
+        self._write_header_and_text()
+        self._fh.seek(self.data_start)
+
+    def _write_header_and_text(self):
+        header, text_bytes = fcs_header_and_text(self.keywords, self.n_events, self.n_channels, data_start=self.data_start)
+        position = self._fh.tell()
+        self._fh.seek(0)
+        self._fh.write(header)
+        self._fh.write(text_bytes)
+        self._fh.write(b' ' * (self.data_start - 58 - len(text_bytes))) # TEXT is never longer than when the file was created
+        self._fh.seek(position)
+
+    def append(self, event_data: np.ndarray) -> None:
+        """add events (n_events, n_channels) to DATA, then update TEXT and HEADER to include them"""
+        if len(event_data) == 0:
+            return
+        self._fh.write(np.ascontiguousarray(event_data, dtype='<f4').tobytes())
+        self.n_events += len(event_data)
+        self._fh.flush()
+        self._write_header_and_text()
+        self._fh.flush()
+
+    def close(self) -> int:
+        """finish the file; returns the number of events in it"""
+        if self._fh is not None:
+            self._fh.write(b'00000000')  # CRC placeholder
+            self._fh.close()
+            self._fh = None
+        return self.n_events
+
+
 # All subfolders recursively
 def get_all_subfolders_recursive(path, experiment_dir):
     """Get all subfolders recursively using pathlib"""
@@ -608,11 +707,12 @@ def get_all_subfolders_recursive(path, experiment_dir):
     return [p.relative_to(experiment_dir)] + [folder.relative_to(experiment_dir) for folder in p.rglob('*') if folder.is_dir()]
 
 def timer(func):
-    """Decorator to report execution time of a function."""
+    """Decorator to report execution time of a function (and time it as a span, see timing)."""
     @wraps(func)
     def wrapper(*args, **kwargs):
         start_time = perf_counter()
-        result = func(*args, **kwargs)
+        with span(func.__qualname__):
+            result = func(*args, **kwargs)
         end_time = perf_counter()
         execution_time = end_time - start_time
         logging.info(f"Function '{func.__name__}' executed in {execution_time:0.6f} seconds")
@@ -709,7 +809,47 @@ def generate_transformations(transforms):
     return transformations
 
 
-def apply_transfer_matrix(transfer_matrix, raw_event_data):
+def transfer_matrix_structure(transfer_matrix):
+    '''
+    split a (n_raw, n_unmixed) transfer matrix into
+        pass-through columns: a single 1 in the column, i.e. a copy of one raw column (scatter, time, event_id)
+        zero columns: nothing maps into them
+        the dense block: every other column, with the raw rows that feed it (fluorescence unmixing)
+    '''
+    nonzero = transfer_matrix != 0
+    counts = nonzero.sum(axis=0)
+    source = nonzero.argmax(axis=0)
+    columns = np.arange(transfer_matrix.shape[1])
+    passthrough = (counts == 1) & (transfer_matrix[source, columns] == 1)
+    dense_cols = np.flatnonzero(~passthrough & (counts > 0))
+    dense_rows = np.flatnonzero(nonzero[:, dense_cols].any(axis=1))
+    return {
+        'passthrough_dst': columns[passthrough],
+        'passthrough_src': source[passthrough],
+        'zero_cols': np.flatnonzero(counts == 0),
+        'dense_rows': dense_rows,
+        'dense_cols': dense_cols,
+        'dense_block': transfer_matrix[np.ix_(dense_rows, dense_cols)],
+    }
+
+
+def _as_slice(ids):
+    # contiguous index arrays become slices so numpy takes views instead of copies
+    if len(ids) > 0 and ids[-1] - ids[0] == len(ids) - 1:
+        return slice(int(ids[0]), int(ids[-1]) + 1)
+    return ids
+
+
+def _passthrough_runs(dst, src):
+    # group pass-through columns into runs that are consecutive in both raw and unmixed, copied as one block each
+    start = 0
+    for n in range(1, len(dst) + 1):
+        if n == len(dst) or dst[n] != dst[n - 1] + 1 or src[n] != src[n - 1] + 1:
+            yield slice(int(dst[start]), int(dst[n - 1]) + 1), slice(int(src[start]), int(src[n - 1]) + 1)
+            start = n
+
+
+def apply_transfer_matrix(transfer_matrix, raw_event_data, out=None, skip_columns=None):
     '''
     called when:
         sample loaded
@@ -717,8 +857,70 @@ def apply_transfer_matrix(transfer_matrix, raw_event_data):
         live data updated
         calculate stats
         export unmixed FCS
+
+    returns raw_event_data @ transfer_matrix
+    out: optional preallocated (n_events, n_unmixed) array to write into
+    skip_columns: unmixed columns to leave unwritten, e.g. fluorescence columns that AF unmixing fills in.
+        The remaining columns are built from the matrix structure: pass-through columns (scatter, time, event_id)
+        are copied and BLAS only runs on whatever dense columns are left, so the fluorescence block is never
+        multiplied just to be overwritten. Without skip_columns a single dense product is used - the product is
+        memory-bound, and one BLAS pass over the events is faster than a copy pass plus a narrower product.
     '''
-    return raw_event_data @ transfer_matrix
+    if skip_columns is None:
+        return np.matmul(raw_event_data, transfer_matrix, out=out)
+
+    structure = transfer_matrix_structure(transfer_matrix)
+    if out is None:
+        out = np.empty((raw_event_data.shape[0], transfer_matrix.shape[1]), dtype=np.result_type(raw_event_data, transfer_matrix))
+
+    dst, src = structure['passthrough_dst'], structure['passthrough_src']
+    zero_cols = structure['zero_cols']
+    dense_cols, dense_block = structure['dense_cols'], structure['dense_block']
+    keep = ~np.isin(dst, skip_columns)
+    dst, src = dst[keep], src[keep]
+    zero_cols = zero_cols[~np.isin(zero_cols, skip_columns)]
+    keep = ~np.isin(dense_cols, skip_columns)
+    dense_cols, dense_block = dense_cols[keep], dense_block[:, keep]
+
+    for dst_run, src_run in _passthrough_runs(dst, src):
+        out[:, dst_run] = raw_event_data[:, src_run]
+    if len(zero_cols):
+        out[:, _as_slice(zero_cols)] = 0
+    if len(dense_cols):
+        dense_out = _as_slice(dense_cols)
+        dense_in = raw_event_data[:, _as_slice(structure['dense_rows'])]
+        if isinstance(dense_out, slice):
+            np.matmul(dense_in, dense_block, out=out[:, dense_out])
+        else:
+            out[:, dense_out] = dense_in @ dense_block
+    return out
+
+
+def update_compensation_in_place(event_data, fl_ids, old_spillover, new_spillover, tolerance=1e-12):
+    '''
+    called when:
+        spillover (fine tuning) matrix edited
+
+    compensated fluorescence rows are Y = X @ inv(S) (see Controller.initialise_transfer_matrix), so changing one cell
+    S[r, c] by delta is a rank-one change (Sherman-Morrison):
+        Y' = Y - outer(Y[:, r], w),  w = delta * inv(S)[c, :] / (1 + delta * inv(S)[c, r])
+    w is zero outside the columns coupled to c, so only those columns of event_data are touched.
+    each changed cell is applied in turn; returns the sorted positions (into fl_ids) of the columns that changed
+    '''
+    old_spillover = np.array(old_spillover, dtype=np.float64)
+    new_spillover = np.array(new_spillover, dtype=np.float64)
+    current = old_spillover.copy()
+    affected = set()
+    for r, c in np.argwhere(new_spillover != old_spillover):
+        delta = new_spillover[r, c] - current[r, c]
+        inv_current = np.linalg.inv(current)
+        w = delta * inv_current[c, :] / (1.0 + delta * inv_current[c, r])
+        y_r = event_data[:, fl_ids[r]].copy()
+        for j in np.flatnonzero(np.abs(w) > tolerance):
+            event_data[:, fl_ids[j]] -= w[j] * y_r
+            affected.add(int(j))
+        current[r, c] = new_spillover[r, c]
+    return sorted(affected)
 
 
 def define_quad_gates(x, y, channel_x, channel_y, transformations):
@@ -803,6 +1005,7 @@ def define_ellipse_gate(pos, size, angle, channel_x, channel_y, transformations)
     return dim_x, dim_y, coordinates, covariance_matrix, distance_square
 
 
+@traced('gating')
 def apply_gates_in_place(data_for_cytometry_plots, gates_to_calculate=None):
     # calculate only gates in gates_to_calculate
     # gates_to_calculate should be in order of ancestry (parent to child)
@@ -907,6 +1110,7 @@ def initialise_stats(gating):
     return statistics
 
 
+@traced('histograms')
 def calc_hists(data_for_cytometry_plots, indices_plots_to_calculate=None, status_message_signal=None, density_cutoff=None, dot_plot_by_gate=False):
     plots = data_for_cytometry_plots['plots']
     gate_membership = data_for_cytometry_plots['gate_membership']
@@ -952,6 +1156,7 @@ def calc_hists(data_for_cytometry_plots, indices_plots_to_calculate=None, status
         hists.append(histogram)
     return hists
 
+@traced('statistics')
 def calc_stats(data_for_cytometry_plots, initialise=True):
     statistics = {}
     # gate_ids = data_for_cytometry_plots['lookup_tables'].keys()
@@ -1072,7 +1277,11 @@ def calc_hist2d(event_data, mask, id_channel_x, id_channel_y, transform_x, trans
 
     # Calculate 2D histogram (density)
     heatmap, xedges, yedges = np.histogram2d(x, y, bins=[transform_x.scale, transform_y.scale])
+    return scale_hist2d_for_display(heatmap, density_cutoff)
+
 
+def scale_hist2d_for_display(heatmap, density_cutoff):
+    # shared by calc_hist2d and the NxN engine tiles; modifies heatmap in place and returns it
     # make sure all unit bins get lowest LUT
     global_max_value = heatmap.max()
     inside_max_value = heatmap[1:-1,1:-1].max()
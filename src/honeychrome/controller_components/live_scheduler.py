@@ -0,0 +1,103 @@
+'''
+Scheduling of the live display updates during acquisition.
+
+Each live update gates the new events, calculates their statistics and adds them to the histograms of the plots. The
+scheduler measures the rate at which events arrive and what each update costs, and from these sizes the next batch: the
+controller waits for rate x interval events (or at most the interval), where the interval is the target update interval,
+stretched if updates take longer than the processing budget (utilisation) allows. Small batches at low rates keep the
+display responsive, and larger batches at high rates amortise the cost of each update.
+
+The cost of an update is modelled as cost_per_event x n_events x (n_plots + 1), gating and statistics counting as one
+more plot. If that is more than the budget at the measured rate, the scheduler is overloaded: the controller then
+updates only the visible plots, and the others catch up with the events they missed when it is no longer overloaded.
+How far the display lags behind the acquisition is smoothed over updates, and reported when it stays above lag_warning.
+'''
+from honeychrome.settings import live_min_batch_events, live_max_batch_wait, live_window_events, live_update_utilisation, live_lag_warning
+
+
+class LiveUpdateScheduler:
+    '''
+    sizes the batches of live display updates from the measured arrival rate and processing cost, and tracks the lag
+    call reset when acquisition starts, record_update after each update, then wait for min_batch_events() or max_batch_wait()
+    '''
+    recovery = 0.8 # leaves overload once the load is this fraction of the budget, so it doesn't flip between states every update
+
+    def __init__(self, min_batch=live_min_batch_events, target_interval=live_max_batch_wait, max_batch=live_window_events,
+                 utilisation=live_update_utilisation, lag_warning=live_lag_warning, smoothing=0.3):
+        self.min_batch = min_batch
+        self.target_interval = target_interval
+        self.max_batch = max_batch
+        self.utilisation = utilisation
+        self.lag_warning = lag_warning
+        self.smoothing = smoothing
+        self.reset(0.)
+
+    def reset(self, now):
+        self.last_update = now
+        self.rate = None # events per second
+        self.cost_per_event = None # seconds per event per plot
+        self.processing_time = 0. # seconds per update
+        self.lag = 0. # seconds
+        self.n_skipped = 0
+        self.overloaded = False
+
+    def _smooth(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def record_update(self, n_events, n_plots_calculated, n_plots, processing_time, now, n_skipped=0):
+        '''
+        record an update that processed the n_events that arrived since the last update (n_skipped of them were left out
+        of the display), calculating n_plots_calculated of the n_plots plots in processing_time seconds, finishing at now
+        '''
+        elapsed = now - self.last_update
+        self.last_update = now
+        if elapsed > 0:
+            self.rate = self._smooth(self.rate, n_events / elapsed)
+        n_processed = n_events - n_skipped
+        if n_processed > 0:
+            self.cost_per_event = self._smooth(self.cost_per_event, processing_time / (n_processed * (n_plots_calculated + 1)))
+        self.processing_time = self._smooth(self.processing_time, processing_time)
+        # the first event of this batch arrived about when the last update finished, and is displayed now
+        self.lag = self._smooth(self.lag, elapsed if n_events else 0.)
+        self.n_skipped += n_skipped
+
+        load = self.load(n_plots)
+        if load > self.utilisation:
+            self.overloaded = True
+        elif load < self.recovery * self.utilisation:
+            self.overloaded = False
+
+    def load(self, n_plots):
+        '''fraction of the time it would take to process every event into every plot at the measured rate'''
+        if self.rate is None or self.cost_per_event is None:
+            return 0.
+        return self.rate * self.cost_per_event * (n_plots + 1)
+
+    def interval(self):
+        # the target interval, or longer if updates take longer than the budget allows
+        return max(self.target_interval, self.processing_time / self.utilisation)
+
+    def min_batch_events(self):
+        '''the number of events to wait for before the next update'''
+        if self.rate is None:
+            return self.min_batch
+        return int(min(max(self.rate * self.interval(), self.min_batch), self.max_batch))
+
+    def max_batch_wait(self):
+        '''the longest to wait for the batch after the first event of it arrives'''
+        return self.interval()
+
+    @property
+    def lagging(self):
+        return self.lag > self.lag_warning
+
+    def status(self):
+        '''status bar message: the acquisition rate, and the lag and skipped events while the display is falling behind'''
+        message = f'Live acquisition rate {int(self.rate or 0)} events/s'
+        if self.lagging:
+            message += f' - display lagging {self.lag:.1f} s behind'
+        if self.n_skipped:
+            message += f' ({self.n_skipped} events not displayed)'
+        if self.overloaded:
+            message += ' - updating visible plots first'
+        return message
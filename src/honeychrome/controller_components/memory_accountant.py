@@ -0,0 +1,279 @@
+'''
+Memory accountant:
+-Reports the bytes held by each of the controller's ephemeral structures (event data, AF sidecar, the loaded flowkit
+ sample, lookup tables, the data for cytometry plots of each mode with their gate membership masks and histograms, nxn
+ tiles, cleaned events and AF caches) and per sample (the loaded sample, and the cleaned events of each control)
+-Arrays shared between structures are counted once, against the first structure holding them (e.g. the event data
+ in the data for cytometry plots is counted as raw_event_data or unmixed_event_data), and a view counts its whole base
+-Other holders of memory (the nxn tile image cache in the view, plugins keeping copies of event data) register a size
+ function and optionally an eviction function
+-enforce() keeps the total to a budget (settings memory_budget_mb, or memory_budget_fraction of physical memory), taking
+ the cheapest steps first until it is under: evicting caches that are rebuilt when next needed, downcasting the loaded
+ event data to float32, and lowering the display cap of the loaded sample (subsampling it and recalculating its plots)
+-A lowered display cap is kept for that sample only (while the budget is unchanged), so reloading it subsamples straight
+ to the cap, and other samples are loaded to settings max_display_events
+'''
+import os
+
+import numpy as np
+
+import honeychrome.settings as settings
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def nbytes(obj, seen=None, n_rows=None):
+    '''
+    bytes of the numpy arrays held by obj, searching dicts, sequences and object attributes
+    seen: ids already counted; n_rows: count only arrays of n_rows rows (one per event)
+    '''
+    if seen is None:
+        seen = set()
+    if obj is None or isinstance(obj, (str, int, float, bool, complex)) or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        owner = obj
+        while isinstance(owner.base, np.ndarray):
+            owner = owner.base
+        if owner is not obj:
+            if id(owner) in seen:
+                return 0
+            seen.add(id(owner))
+        if n_rows is not None and (owner.ndim == 0 or len(owner) != n_rows):
+            return 0
+        return owner.nbytes
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj) if n_rows is None else 0
+    if isinstance(obj, dict):
+        return sum(nbytes(value, seen, n_rows) for value in obj.values())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sum(nbytes(value, seen, n_rows) for value in obj)
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        return sum(nbytes(value, seen, n_rows) for value in vars(obj).values())
+    return 0
+
+
+def physical_memory():
+    '''total physical memory in bytes, or None if it cannot be found'''
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().total
+    except ImportError:
+        return None
+
+
+def process_memory():
+    '''resident set size of this process in bytes, or None if it cannot be found'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, AttributeError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def default_budget():
+    '''the budget in bytes from the settings: memory_budget_mb, or if 0 a fraction of physical memory (None if unknown)'''
+    if settings.memory_budget_mb_retrieved:
+        return settings.memory_budget_mb_retrieved * 2**20
+    total = physical_memory()
+    return int(total * settings.memory_budget_fraction) if total else None
+
+
+def format_bytes(n_bytes):
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(n_bytes) < 1024 or unit == 'GB':
+            return f'{n_bytes:.0f} {unit}' if unit == 'B' else f'{n_bytes:.1f} {unit}'
+        n_bytes /= 1024
+
+
+class MemoryAccountant:
+    '''
+    accounts for the memory of a controller's ephemeral data, and keeps it to budget
+    budget: bytes (0 for no budget), or None to follow the settings (default_budget())
+    '''
+    sample_structures = ['raw_event_data', 'unmixed_event_data', 'af_sidecar_data', 'current_sample',
+                         'data_for_cytometry_plots_raw', 'data_for_cytometry_plots_process',
+                         'data_for_cytometry_plots_unmixed', 'data_for_cytometry_plots', 'nxn_engine']
+
+    def __init__(self, controller, budget=None):
+        self.controller = controller
+        self._budget = budget
+        self._registered = {} # name -> (size function, evict function or None)
+        self._display_caps = {} # sample path -> (display cap lowered to keep to budget, that budget)
+
+    @property
+    def budget(self):
+        return default_budget() if self._budget is None else self._budget
+
+    @budget.setter
+    def budget(self, budget):
+        self._budget = budget
+
+    def display_cap(self, sample_path):
+        '''the display cap for loading sample_path: settings max_display_events, or lower if it was lowered for this sample'''
+        cap = settings.max_display_events
+        lowered, budget = self._display_caps.get(sample_path, (None, None))
+        if lowered is not None and budget == self.budget:
+            cap = min(cap, lowered) if cap else lowered
+        return cap
+
+    def register(self, name, size, evict=None):
+        '''
+        account for memory held outside the controller: size() returns its bytes (or the object holding it, whose arrays
+        are counted); evict(), if given, frees what it can when over budget and returns the bytes freed
+        '''
+        self._registered[name] = (size, evict)
+
+    def unregister(self, name, size=None):
+        '''stop accounting for name (only if it is still registered with this size function, if given)'''
+        if size is None or self._registered.get(name, (None,))[0] is size:
+            self._registered.pop(name, None)
+
+    def _structures(self):
+        # (name, object) in the order shared arrays are attributed
+        c = self.controller
+        return [
+            ('raw_event_data', c.raw_event_data),
+            ('unmixed_event_data', c.unmixed_event_data),
+            ('af_sidecar_data', c.af_sidecar_data),
+            ('current_sample', c.current_sample),
+            ('lookup_tables', [c.raw_lookup_tables, c.unmixed_lookup_tables]),
+            ('data_for_cytometry_plots_raw', c.data_for_cytometry_plots_raw),
+            ('data_for_cytometry_plots_process', c.data_for_cytometry_plots_process),
+            ('data_for_cytometry_plots_unmixed', c.data_for_cytometry_plots_unmixed),
+            ('data_for_cytometry_plots', c.data_for_cytometry_plots),
+            ('deferred_live_hists', c.deferred_live_hists),
+            ('cleaned_events', getattr(c, 'cleaned_events', None)),
+            ('af_matrices', [c.af_precomputed, c.af_spectra]),
+            ('af_precomputed_cache', c.af_precomputed_cache),
+            ('af_combined_cache', c.af_combined_cache),
+        ]
+
+    def report(self):
+        '''
+        {'structures': {name: bytes}, 'samples': {sample or control label: bytes}, 'total': bytes, 'budget': bytes or None,
+        'process_rss': bytes or None}
+        '''
+        seen = set()
+        structures = {name: nbytes(obj, seen) for name, obj in self._structures()}
+        structures['nxn_engine'] = self.controller.nxn_engine.nbytes()
+        for name, (size, _) in self._registered.items():
+            value = size()
+            structures[name] = value if isinstance(value, (int, np.integer)) else nbytes(value, seen)
+
+        samples = {}
+        if self.controller.current_sample_path is not None:
+            samples[str(self.controller.current_sample_path)] = sum(structures[name] for name in self.sample_structures)
+        seen = set()
+        for label, entry in (getattr(self.controller, 'cleaned_events', None) or {}).items():
+            samples[label] = nbytes(entry, seen)
+
+        return {'structures': structures, 'samples': samples, 'total': sum(structures.values()), 'budget': self.budget,
+                'process_rss': process_memory()}
+
+    def summary(self, report=None, n_largest=3):
+        '''one line for the status bar or log, e.g. "1.2 GB of 4.0 GB: unmixed_event_data 610.4 MB, ..."'''
+        report = report or self.report()
+        largest = sorted(report['structures'].items(), key=lambda item: -item[1])[:n_largest]
+        budget = f' of {format_bytes(report["budget"])}' if report['budget'] else ''
+        return f'{format_bytes(report["total"])}{budget}: ' + ', '.join(f'{name} {format_bytes(value)}' for name, value in largest if value)
+
+    def enforce(self):
+        '''
+        take steps until the total is within budget: evict caches, downcast the loaded event data to float32, lower the
+        display cap; returns the steps taken (descriptions), empty if already within budget or no budget is set
+        '''
+        budget = self.budget
+        if not budget:
+            return []
+        steps = []
+        total = self.report()['total']
+        for step in [self.evict_caches, self.downcast_event_data, self.lower_display_cap]:
+            if total <= budget:
+                break
+            description = step(total - budget)
+            if description:
+                steps.append(description)
+                total = self.report()['total']
+
+        if steps:
+            logger.warning(f'MemoryAccountant: over budget, {"; ".join(steps)}. Now {self.summary()}')
+        if total > budget:
+            logger.warning(f'MemoryAccountant: still over budget: {self.summary()}')
+        return steps
+
+    def _loaded_sample_is_live(self):
+        c = self.controller
+        return c.current_sample_path is not None and c.current_sample_path == c.live_sample_path
+
+    def evict_caches(self, excess):
+        '''drop the caches that are rebuilt when next needed: combined AF matrices, display-scaled nxn tiles, registered caches'''
+        c = self.controller
+        freed = nbytes(c.af_combined_cache) # matrices in use for the loaded sample are still held by af_precomputed
+        c.af_combined_cache = {}
+        freed += c.nxn_engine.evict_tiles()
+        for name, (_, evict) in self._registered.items():
+            if evict is not None:
+                freed += evict() or 0
+        return f'evicted caches ({format_bytes(freed)})' if freed else None
+
+    def downcast_event_data(self, excess):
+        '''convert the loaded sample's float64 event data to float32 (not the live sample, which is added to as acquired)'''
+        c = self.controller
+        if self._loaded_sample_is_live():
+            return None
+        converted = []
+        for name in ['raw_event_data', 'unmixed_event_data', 'af_sidecar_data']:
+            data = getattr(c, name)
+            if data is not None and data.dtype == np.float64:
+                setattr(c, name, data.astype(np.float32))
+                converted.append(name)
+        if not converted:
+            return None
+        c.data_for_cytometry_plots_raw['event_data'] = c.raw_event_data
+        c.data_for_cytometry_plots_process['event_data'] = c.unmixed_event_data
+        c.data_for_cytometry_plots_unmixed['event_data'] = c.unmixed_event_data
+        return f'downcast {", ".join(converted)} to float32'
+
+    def lower_display_cap(self, excess):
+        '''
+        lower the loaded sample's display cap so that its data and plots fit, to no lower than memory_min_display_events,
+        and subsample it to the cap (kept for that sample, see display_cap())
+        '''
+        c = self.controller
+        if self._loaded_sample_is_live() or c.raw_event_data is None:
+            return None
+        n_events = len(c.raw_event_data)
+        seen = set() # bytes per event that subsampling frees (the flowkit sample keeps its own copy of every event)
+        event_bytes = sum(nbytes(obj, seen, n_rows=n_events) for name, obj in self._structures()
+                          if name in self.sample_structures and name != 'current_sample')
+        if not event_bytes or n_events <= settings.memory_min_display_events:
+            return None
+        cap = max(settings.memory_min_display_events, int(n_events * max(0., 1 - excess / event_bytes)))
+        if cap >= n_events:
+            return None
+
+        rng = np.random.default_rng(seed=42)
+        index = np.sort(rng.choice(n_events, cap, replace=False))
+        c.raw_event_data = c.raw_event_data[index]
+        if c.unmixed_event_data is not None:
+            c.unmixed_event_data = c.unmixed_event_data[index]
+        if c.af_sidecar_data is not None:
+            c.af_sidecar_data = c.af_sidecar_data[index]
+        self._display_caps[c.current_sample_path] = (cap, self.budget)
+        for data in [c.data_for_cytometry_plots_raw, c.data_for_cytometry_plots_process, c.data_for_cytometry_plots_unmixed]:
+            data['gate_membership'] = {}
+        c.clear_data_for_cytometry_plots()
+        c.initialise_data_for_cytometry_plots()
+        return f'lowered display cap {n_events} → {cap} events'
@@ -0,0 +1,349 @@
+'''
+Histogram engine for the Spectral Process NxN grid.
+
+The NxN grid shows every pair of unmixed fluorescence channels as a small tile,
+so n fluorophores need n(n-1) 2D histograms of the same events. Rather than
+running np.histogram2d at full display resolution for each plot, the engine
+digitizes each channel once, directly at tile resolution (the full-resolution
+bin from the channel's transform scale, rebinned to tile_bins), and fills the
+tiles of one row with a single batched bincount over all its columns.
+
+Tiles are counted lazily: tile() counts a single tile on demand, compute_tiles()
+counts everything outstanding on a thread pool across row blocks, and
+TileScheduler counts tiles on a background thread in priority order (the NxN
+grid asks for the tiles on screen first, nearest the selected cell first). Events added
+later (live acquisition) are appended to the stored codes and added to any
+tile already counted, so a tile is always the histogram of all events added
+since the last reset.
+
+Tiles are oriented as calc_hist2d output, [x bin, y bin], and scaled for display
+with the same scale_hist2d_for_display.
+'''
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from honeychrome.controller_components.functions import scale_hist2d_for_display
+from honeychrome.controller_components.timing import traced
+
+import logging
+logger = logging.getLogger(__name__)
+
+# upper bound on the number of intp indices built for one batched bincount (32 MB)
+_block_elements = 1 << 22
+
+
+def digitize_to_tiles(values, scale, tile_bins):
+    '''
+    bin values on the full-resolution edges in scale (as np.histogram: last bin closed, values outside dropped)
+    and rebin to tile_bins; returns uint16 codes with tile_bins marking events outside the scale
+    '''
+    n_bins = len(scale) - 1
+    full = np.searchsorted(scale, values, side='right') - 1
+    full[values == scale[-1]] = n_bins - 1
+    codes = full * tile_bins // n_bins
+    codes[(full < 0) | (full >= n_bins)] = tile_bins
+    return codes.astype(np.uint16)
+
+
+def count_row(codes, row, columns, tile_bins):
+    '''
+    counts for tiles (column, row) of every column at once: one bincount per block of columns
+    codes: (n_channels, n_events) from digitize_to_tiles; returns (len(columns), tile_bins, tile_bins)
+    '''
+    stride = tile_bins + 1
+    tile_size = stride * stride
+    n_events = codes.shape[1]
+    counts = np.empty((len(columns), tile_bins, tile_bins), dtype=np.int64)
+    if n_events == 0:
+        counts[:] = 0
+        return counts
+    code_y = codes[row].astype(np.intp)
+    block = max(1, _block_elements // n_events)
+    for start in range(0, len(columns), block):
+        block_columns = columns[start:start + block]
+        index = codes[block_columns].astype(np.intp)
+        index *= stride
+        index += code_y
+        index += (np.arange(len(block_columns), dtype=np.intp) * tile_size)[:, None]
+        flat = np.bincount(index.ravel(), minlength=len(block_columns) * tile_size)
+        counts[start:start + len(block_columns)] = flat.reshape(len(block_columns), stride, stride)[:, :tile_bins, :tile_bins]
+    return counts
+
+
+class NxNHistogramEngine:
+    '''
+    pairwise tile histograms of a set of channels, keyed by channel name
+    tile(channel_x, channel_y) is the tile for the process plot with those axes
+    '''
+    def __init__(self, tile_bins, max_workers=1):
+        self.tile_bins = tile_bins
+        self.max_workers = max_workers
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self, channels=(), scales=(), density_cutoff=0):
+        '''forget all events and tiles; channels are pnn names, scales their transform.scale bin edges'''
+        with self._lock:
+            self.channels = list(channels)
+            self._channel_index = {channel: n for n, channel in enumerate(self.channels)}
+            self._scales = [np.asarray(scale) for scale in scales]
+            self.density_cutoff = density_cutoff
+            self._chunks = []
+            self._codes = np.empty((len(self.channels), 0), dtype=np.uint16)
+            self._counts = {}
+            self._tiles = {}
+            self._versions = {}
+            self._generation = getattr(self, '_generation', 0) + 1
+            self._data_version = 0
+
+    @property
+    def n_events(self):
+        with self._lock:
+            return self._codes.shape[1] + sum(chunk.shape[1] for chunk in self._chunks)
+
+    def nbytes(self):
+        '''bytes held in event codes, counts and display-scaled tiles'''
+        with self._lock:
+            return (self._codes.nbytes + sum(chunk.nbytes for chunk in self._chunks)
+                    + sum(counts.nbytes for counts in self._counts.values()) + sum(tile.nbytes for tile in self._tiles.values()))
+
+    def evict_tiles(self):
+        '''drop the display-scaled tiles, which are scaled again from the counts when next requested; returns bytes freed'''
+        with self._lock:
+            n_bytes = sum(tile.nbytes for tile in self._tiles.values())
+            self._tiles = {}
+            return n_bytes
+
+    def _digitize(self, event_data, mask, channel_ids, channels=None):
+        positions = range(len(self.channels)) if channels is None else [self._channel_index[c] for c in channels]
+        selected = event_data if mask is None else event_data[mask]
+        codes = np.empty((len(positions), len(selected)), dtype=np.uint16)
+        for n, position in enumerate(positions):
+            codes[n] = digitize_to_tiles(selected[:, channel_ids[position]], self._scales[position], self.tile_bins)
+        return codes
+
+    def _all_codes(self):
+        if self._chunks:
+            self._codes = np.concatenate([self._codes] + self._chunks, axis=1)
+            self._chunks = []
+        return self._codes
+
+    def _bump(self, key):
+        self._versions[key] = self._versions.get(key, 0) + 1
+        self._tiles.pop(key, None)
+
+    def add_events(self, event_data, mask, channel_ids):
+        '''
+        append events (rows of event_data selected by the boolean mask; channel_ids are the columns of self.channels)
+        tiles already counted are updated with the new events, the rest are counted from all events when requested
+        '''
+        new_codes = self._digitize(event_data, mask, channel_ids)
+        with self._lock:
+            self._chunks.append(new_codes)
+            self._data_version += 1
+            counted = {}
+            for channel_x, channel_y in self._counts:
+                counted.setdefault(channel_y, []).append(channel_x)
+            for channel_y, columns_x in counted.items():
+                row = self._channel_index[channel_y]
+                columns = [self._channel_index[c] for c in columns_x]
+                for channel_x, counts in zip(columns_x, count_row(new_codes, row, columns, self.tile_bins)):
+                    self._counts[(channel_x, channel_y)] += counts
+                    self._bump((channel_x, channel_y))
+
+    def update_channels(self, channels, event_data, mask, channel_ids):
+        '''re-digitize channels whose values changed in place (same events) and drop the tiles that involve them'''
+        channels = [c for c in channels if c in self._channel_index]
+        if not channels:
+            return
+        new_codes = self._digitize(event_data, mask, channel_ids, channels)
+        with self._lock:
+            codes = self._all_codes()
+            if codes.shape[1] != new_codes.shape[1]:
+                logger.warning('NxNHistogramEngine: event count changed, cannot update channels in place')
+                return
+            codes = codes.copy() # compute_tiles may still be counting from the old array
+            for n, channel in enumerate(channels):
+                codes[self._channel_index[channel]] = new_codes[n]
+            self._codes = codes
+            self._data_version += 1
+            for key in [k for k in self._counts if k[0] in channels or k[1] in channels]:
+                del self._counts[key]
+                self._bump(key)
+
+    @traced('nxn_tiles')
+    def _count_rows(self, rows, codes, generation):
+        # rows: [(channel_y, [channel_x, ...]), ...], counted outside the lock and stored only if no events were added or changed meanwhile
+        results = []
+        for channel_y, columns_x in rows:
+            counts = count_row(codes, self._channel_index[channel_y], [self._channel_index[c] for c in columns_x], self.tile_bins)
+            results.extend(((channel_x, channel_y), tile_counts) for channel_x, tile_counts in zip(columns_x, counts))
+        with self._lock:
+            if generation != (self._generation, self._data_version):
+                return 0
+            for key, tile_counts in results:
+                if key not in self._counts:
+                    self._counts[key] = tile_counts
+                    self._bump(key)
+        return len(results)
+
+    def compute_tiles(self, pairs=None):
+        '''
+        count every outstanding tile (or only those in pairs, as (channel_x, channel_y)), batched by row
+        and spread over max_workers threads in blocks of rows
+        '''
+        with self._lock:
+            codes = self._all_codes()
+            generation = (self._generation, self._data_version)
+            if pairs is None:
+                pairs = [(x, y) for y in self.channels for x in self.channels if x != y]
+            rows = {}
+            for channel_x, channel_y in pairs:
+                if (channel_x, channel_y) not in self._counts and channel_x in self._channel_index and channel_y in self._channel_index:
+                    rows.setdefault(channel_y, []).append(channel_x)
+        rows = list(rows.items())
+        if not rows:
+            return 0
+        n_workers = max(1, min(self.max_workers, len(rows)))
+        if n_workers == 1:
+            return self._count_rows(rows, codes, generation)
+        blocks = [rows[n::n_workers] for n in range(n_workers)]
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return sum(executor.map(lambda block: self._count_rows(block, codes, generation), blocks))
+
+    def tile(self, channel_x, channel_y):
+        '''display-scaled histogram for the plot channel_x vs channel_y, counted now if necessary (zeros for unknown channels)'''
+        tile = self.counted_tile(channel_x, channel_y)
+        if tile is None:
+            self.compute_tiles([(channel_x, channel_y)])
+            tile = self.counted_tile(channel_x, channel_y)
+        if tile is None:
+            return np.zeros((self.tile_bins, self.tile_bins))
+        return tile
+
+    def is_counted(self, channel_x, channel_y):
+        with self._lock:
+            return (channel_x, channel_y) in self._counts
+
+    def counted_tile(self, channel_x, channel_y):
+        '''as tile(), but None rather than counting if the tile has not been counted yet'''
+        key = (channel_x, channel_y)
+        with self._lock:
+            if key in self._tiles:
+                return self._tiles[key]
+            if channel_x not in self._channel_index or channel_y not in self._channel_index or channel_x == channel_y:
+                return np.zeros((self.tile_bins, self.tile_bins))
+            counts = self._counts.get(key)
+            if counts is None:
+                return None
+            tile = scale_hist2d_for_display(counts.astype(np.float64), self.density_cutoff)
+            self._tiles[key] = tile
+            return tile
+
+    def versioned_tile(self, channel_x, channel_y):
+        '''(counted_tile(), tile_version()) read together'''
+        with self._lock:
+            return self.counted_tile(channel_x, channel_y), self.tile_version(channel_x, channel_y)
+
+    def tile_version(self, channel_x, channel_y):
+        '''changes whenever the tile's contents change'''
+        with self._lock:
+            return (self._generation, self._versions.get((channel_x, channel_y), 0))
+
+
+class TileScheduler:
+    '''
+    counts engine tiles on a background thread, lowest priority first
+    tiles in the same row and of the same priority class (priority[0]) are counted together in one batch
+    tiles_ready(keys) is called from the background thread after each batch, never once stop() has returned
+    '''
+    def __init__(self, engine, tiles_ready):
+        self.engine = engine
+        self.tiles_ready = tiles_ready
+        self._heap = []
+        self._queued = {} # key -> priority of its live heap entry
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def _push(self, key, priority):
+        self._queued[key] = priority
+        heapq.heappush(self._heap, (priority, next(self._order), key))
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def request(self, key, priority):
+        '''queue one tile (channel_x, channel_y), or raise its priority if it is already queued'''
+        with self._condition:
+            if key in self._queued and self._queued[key] <= priority:
+                return
+            self._push(key, priority)
+            self._ensure_thread()
+            self._condition.notify()
+
+    def schedule(self, priorities):
+        '''replace everything queued with {key: priority}'''
+        with self._condition:
+            self._heap = []
+            self._queued = {}
+            for key, priority in priorities.items():
+                self._push(key, priority)
+            if self._heap:
+                self._ensure_thread()
+                self._condition.notify()
+
+    def cancel(self):
+        '''drop everything queued; a batch already being counted is discarded by the engine if its events changed'''
+        self.schedule({})
+
+    def stop(self):
+        '''drop everything queued and end the thread once any batch being counted is done (without reporting it)'''
+        with self._condition:
+            self._stopped = True
+            self._heap = []
+            self._queued = {}
+            self._condition.notify()
+
+    @property
+    def pending(self):
+        with self._condition:
+            return len(self._queued)
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                while not self._heap and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return None
+                priority, _, key = heapq.heappop(self._heap)
+                if self._queued.get(key) == priority:
+                    break # otherwise superseded by a later request
+            batch = [key] + [k for k, p in self._queued.items() if k != key and k[1] == key[1] and p[0] == priority[0]]
+            for k in batch:
+                del self._queued[k]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self.engine.compute_tiles(batch)
+            except Exception as e:
+                logger.warning(f'TileScheduler: counting tiles failed ({e})')
+                continue
+            with self._condition: # so that stop() can't return between the check and the call
+                if self._stopped:
+                    return
+                self.tiles_ready(batch)
@@ -0,0 +1,93 @@
+'''
+The latest oscilloscope trace, in shared memory.
+
+The trace analyser writes the traces and peak measurements of the last event
+it committed into a single slot; the oscilloscope viewer polls it. Each write
+overwrites the last, so nothing queues up and nothing is pickled, and the
+viewer always shows the freshest trace.
+
+The single writer writes the slot, and a reader copies it, with a lock held
+(as SharedRing holds one for its counters): taking and releasing it orders
+the accesses to shared memory on every platform, so a reader never sees a
+half-written trace even on weakly ordered CPUs. The slot is a few kB, so the
+lock is only ever held for microseconds. A sequence counter, incremented by
+each write, tells a reader whether there is anything new.
+'''
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from honeychrome.settings import n_channels_trace, n_time_points_in_event
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class OscilloscopeSlot:
+    '''
+    latest-value slot for the oscilloscope trace: creates the shared memory if name is None, otherwise attaches to it
+    holds event_id, time, n_start, n_end, the scaled traces (n_channels, n_time_points) and the baselines of every channel
+    picklable, so it can be passed to a process
+    '''
+    n_meta = 4 # event_id, time, n_start, n_end
+
+    def __init__(self, name=None, n_channels=n_channels_trace, n_time_points=n_time_points_in_event, fence=None):
+        self.n_channels = n_channels
+        self.n_time_points = n_time_points
+        self._fence = fence if fence is not None else mp.Lock()
+        size = 8 * (1 + self.n_meta + n_channels) + 4 * n_channels * n_time_points
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        buf = self.shm.buf
+        self.sequence = np.ndarray((1,), dtype=np.uint64, buffer=buf)
+        offset = 8
+        self.meta = np.ndarray((self.n_meta,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += 8 * self.n_meta
+        self.baselines = np.ndarray((n_channels,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += 8 * n_channels
+        self.traces = np.ndarray((n_channels, n_time_points), dtype=np.float32, buffer=buf, offset=offset)
+        if name is None:
+            self.sequence[0] = 0
+
+    def __getstate__(self):
+        # attach to the same shared memory, with the same lock, in the process it is passed to
+        return {'name':self.name, 'n_channels':self.n_channels, 'n_time_points':self.n_time_points, 'fence':self._fence}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def write(self, oscilloscope):
+        '''write an oscilloscope dict (event_id, time, traces, n_start, n_end, baselines) into the slot; one writer only'''
+        with self._fence:
+            self.meta[:] = oscilloscope['event_id'], oscilloscope['time'], oscilloscope['n_start'], oscilloscope['n_end']
+            self.baselines[:] = oscilloscope['baselines']
+            self.traces[:] = oscilloscope['traces']
+            self.sequence[0] += 1
+
+    def read(self, last_sequence=0):
+        '''
+        (sequence, oscilloscope dict) copied from the slot, or (last_sequence, None) if nothing newer than last_sequence
+        has been written
+        '''
+        with self._fence:
+            sequence = int(self.sequence[0])
+            if sequence == last_sequence or sequence == 0:
+                return last_sequence, None
+            meta = self.meta.copy()
+            baselines = self.baselines.copy()
+            traces = self.traces.copy()
+        event_id, time, n_start, n_end = meta
+        return sequence, {'event_id':int(event_id), 'time':int(time), 'n_start':int(n_start), 'n_end':int(n_end),
+                          'traces':traces, 'baselines':baselines}
+
+    def close(self):
+        self.sequence = self.meta = self.baselines = self.traces = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
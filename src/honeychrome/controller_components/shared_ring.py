@@ -0,0 +1,160 @@
+'''
+Single-producer rings of records in shared memory: the traces cache (instrument -> trace analyser) and the events cache
+(trace analyser -> controller).
+
+Record n of a ring is held in row n % capacity. The counters of the ring are held in the same shared memory, each in a
+cache line of its own (so that writing one doesn't invalidate the others in the other processes' caches):
+    reserved - the producer may be writing records up to here
+    tail     - records up to here are published: complete and readable
+    cursors  - how far each consumer has got, e.g. head (read for display) or spilled (written to disk)
+The producer writes only beyond the tail and below release cursor + capacity, so it never overwrites a record that the
+releasing consumer has not finished with. It reserves the records it is about to write, writes them, and then publishes
+them by advancing the tail.
+
+The counters that order accesses to the records - reserved, tail and the release cursor - are read and written with one
+lock, shared by every process, held for just that access: taking and releasing it orders the accesses to the records
+around it on every platform (publishing the tail releases the records written before it, reading it acquires them,
+and likewise reserving before writing and releasing after reading). So every publish, reserve and release, and every
+read of those counters, takes that lock (for well under a microsecond; no lock is held while records are written or
+read). A consumer cursor that does not release records (head, when spilled releases) orders nothing: it is read and
+written without the lock, as an aligned 8-byte value, which is read and written whole.
+
+Consumers read published records in place: views() gives zero-copy views of a range (two if it wraps round the ring).
+A consumer that does not release records (reading for display, behind another that does) may find the oldest of them
+overwritten as it reads: read() drops any that the producer had reserved by the time it finished.
+'''
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from math import prod
+
+import numpy as np
+
+from honeychrome.settings import max_events_in_traces_cache, traces_cache_dtype, trace_n_points, max_events_in_cache
+from honeychrome.controller_components.events_spill import events_cache_dtype
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SharedRing:
+    '''
+    ring of capacity records (dtype, record_shape) in shared memory, written by one producer and read by the consumers
+    named in cursors, of which release bounds what the producer may overwrite
+    creates the shared memory if name is None, otherwise attaches to it; picklable, so it can be passed to a process
+    '''
+    cache_line = 64
+
+    def __init__(self, capacity, dtype, record_shape=(), cursors=('head',), release='head', name=None, fence=None):
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.record_shape = tuple(record_shape)
+        self.cursors = ('reserved', 'tail') + tuple(cursors)
+        if release not in self.cursors[2:]:
+            raise ValueError(f'SharedRing: release cursor {release} is not one of the consumer cursors {cursors}')
+        self.release = release
+        self._fence = fence if fence is not None else mp.Lock()
+        self._fenced = {self.cursors.index(name) for name in ('reserved', 'tail', release)} # the counters read and written with the lock
+
+        header_size = self.cache_line * len(self.cursors)
+        if name is None:
+            size = header_size + capacity * prod(self.record_shape) * self.dtype.itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self._counters = np.ndarray((len(self.cursors), self.cache_line // 8), dtype=np.int64, buffer=self.shm.buf)
+        self.records = np.ndarray((capacity,) + self.record_shape, dtype=self.dtype, buffer=self.shm.buf, offset=header_size)
+        if name is None:
+            self._counters[:] = 0
+
+    def __getstate__(self):
+        # attach to the same shared memory, with the same lock, in the process it is passed to
+        return {'capacity':self.capacity, 'dtype':self.dtype, 'record_shape':self.record_shape, 'cursors':self.cursors[2:],
+                'release':self.release, 'name':self.name, 'fence':self._fence}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def cursor(self, name='tail'):
+        '''value of a counter: reserved, tail or a consumer cursor'''
+        n = self.cursors.index(name)
+        if n not in self._fenced:
+            return int(self._counters[n, 0])
+        with self._fence:
+            return int(self._counters[n, 0])
+
+    def advance(self, name, value):
+        '''set a counter: the producer reserves and publishes (tail), each consumer advances its own cursor'''
+        n = self.cursors.index(name)
+        if n not in self._fenced:
+            self._counters[n, 0] = value
+            return
+        with self._fence:
+            self._counters[n, 0] = value
+
+    def publish(self, tail):
+        '''make the records up to tail readable'''
+        self.advance('tail', tail)
+
+    def reset(self):
+        '''empty the ring (when neither the producer nor a consumer is using it)'''
+        with self._fence:
+            self._counters[:, 0] = 0
+
+    def space(self, begin):
+        '''the number of records that can be written from begin without overwriting any not yet released'''
+        return self.cursor(self.release) + self.capacity - begin
+
+    def rows(self, begin, end):
+        '''the rows of records begin:end'''
+        return np.arange(begin, end) % self.capacity
+
+    def views(self, begin, end):
+        '''zero-copy views of records begin:end, one or (if the range wraps round the ring) two'''
+        if end <= begin:
+            return []
+        first, last = begin % self.capacity, end % self.capacity
+        if first < last:
+            return [self.records[first:last]]
+        return [view for view in (self.records[first:], self.records[:last]) if len(view)]
+
+    def write(self, begin, records):
+        '''write records from begin, wrapping round the ring (producer only, within the space reserved)'''
+        n = 0
+        for view in self.views(begin, begin + len(records)):
+            view[...] = records[n:n + len(view)]
+            n += len(view)
+
+    def read(self, begin, end, convert=np.copy):
+        '''
+        convert(records) of records begin:end, as a new array, and the index of the first record in it: records that the
+        producer may have overwritten during the read are dropped from the front (and any before end - capacity at the start)
+        '''
+        begin = max(begin, end - self.capacity)
+        parts = [convert(view) for view in self.views(begin, end)]
+        if not parts:
+            return convert(self.records[:0]), begin
+        data = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        n_overwritten = self.cursor('reserved') - self.capacity - begin
+        if n_overwritten > 0:
+            logger.info(f'SharedRing: {n_overwritten} records overwritten while being read')
+            return data[n_overwritten:], begin + n_overwritten
+        return data, begin
+
+    def close(self):
+        self._counters = self.records = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def create_traces_ring():
+    '''the traces cache: traces from the instrument, released by the trace analyser'''
+    return SharedRing(max_events_in_traces_cache, traces_cache_dtype, record_shape=(trace_n_points,))
+
+
+def create_events_ring(event_channels_pnn, spill=True):
+    '''the events cache: events from the trace analyser, read for display (head) and, if spill, released once written to disk'''
+    return SharedRing(max_events_in_cache, events_cache_dtype(event_channels_pnn), cursors=('head', 'spilled') if spill else ('head',),
+                      release='spilled' if spill else 'head')
@@ -6,8 +6,10 @@ from pathlib import Path
 import numpy as np
 from PySide6.QtCore import QObject, Signal, QTimer
 
-from honeychrome.controller_components.functions import timer, apply_gates_in_place, apply_transfer_matrix, calc_stats, sample_from_fcs, calc_hist1d
+from honeychrome.controller_components.statistics_engine import (array_hash, gating_hash, sample_cache_key,
+                                                                  load_cached_statistics, save_cached_statistics, run_statistics_jobs)
 from honeychrome.view_components.busy_cursor import with_busy_cursor
+import honeychrome.settings as settings
 
 import logging
 logger = logging.getLogger(__name__)
@@ -31,92 +33,104 @@ class StatisticsCalculator(QObject):
         samples_by_set = {sample_set:[sample for sample in samples_to_calculate if sample.startswith(sample_set)] for sample_set in sample_sets}
 
         if self.controller.experiment.process['unmixing_matrix'] is not None:
-            data_for_statistics_comparison = self.controller.data_for_cytometry_plots_unmixed.copy()
-            # set up data first by sample
+            data_for_statistics_comparison = self.controller.data_for_cytometry_plots_unmixed
+            gating = data_for_statistics_comparison['gating']
+
+            # check all referenced gates still exist before doing any work
+            if samples_to_calculate:
+                gate_names = ['root'] + [g[0] for g in gating.get_gate_ids() if gating._get_gate_node(g[0], g[1]).gate_type != 'QuadrantGate']
+                for statistics_comparison in experiment_statistics:
+                    gate_name = statistics_comparison['gate']
+                    if gate_name not in gate_names:
+                        text = (f'Cannot calculate statistics: gate "{gate_name}" no longer exists.  '
+                                f'Please either create the gate again or delete any statistics plots below that reference {gate_name}.')
+                        warnings.warn(text)
+                        if self.bus:
+                            self.bus.warningMessage.emit(text)
+                            self.bus.progress.emit(0,0)
+                            self.bus.statusMessage.emit(text)
+                        self.finished.emit()
+                        return
+
+            requests = list(dict.fromkeys((statistics_comparison['gate'], statistics_comparison['statistic'], statistics_comparison.get('channel'))
+                                          for statistics_comparison in experiment_statistics))
+            context = {
+                'transfer_matrix': self.controller.transfer_matrix,
+                'whitelisted_pnn': self.controller.experiment.settings['raw'].get('whitelisted_pnn'),
+                'pnn': data_for_statistics_comparison['pnn'],
+                'transformations': data_for_statistics_comparison['transformations'],
+                'lookup_tables': data_for_statistics_comparison['lookup_tables'],
+                'gating': gating,
+                'settings': self.controller.experiment.settings,
+                'spillover': self.controller.experiment.process.get('spillover'),
+                'af_fl_ids': None,
+                'af_sets': {},
+            }
+            cache_dir = self.controller.experiment_dir / 'cache' / 'statistics'
+            tm_hash = array_hash(context['transfer_matrix'])
+            g_hash = gating_hash(context)
+            sample_af_profiles = self.controller.experiment.samples.get('sample_af_profiles', {})
+
+            # set up data first by sample, taking results from the cache where inputs are unchanged
             data_by_sample = {}
-            for n in range(len(samples_to_calculate)):
-                logger.info(f'StatisticsCalculator: sample {n+1}/{len(samples_to_calculate)}')
-                if self.bus:
-                    self.bus.progress.emit(n, len(samples_to_calculate))
-
-                sample_name = all_samples[samples_to_calculate[n]]
-                path_components = Path(samples_to_calculate[n]).parts
+            jobs = {}
+            cache_keys = {}
+            for sample_key in samples_to_calculate:
+                path_components = Path(sample_key).parts
                 depth = len(path_components)
-
-                if depth > 2:
-                    group_name = path_components[-2]
+                group_name = path_components[-2] if depth > 2 else None
+                category_name = '/'.join(path_components[1:-2]) if depth > 3 else None
+                data_by_sample[sample_key] = {'Sample': all_samples[sample_key], 'Group': group_name, 'Category': category_name, 'Statistics': {}}
+
+                # AF-corrected unmixing as in Controller._apply_unmixing, one combined matrix set per distinct profile assignment
+                af_key = tuple(sample_af_profiles.get(sample_key) or []) or None
+                if af_key is not None and af_key not in context['af_sets']:
+                    af_precomputed, af_spectra = self.controller.get_af_matrices_for_profiles(af_key)
+                    if af_precomputed is None:
+                        logger.warning(f'StatisticsCalculator: AF matrices not cached for {af_key} — using standard unmixing for {sample_key}')
+                        af_key = None
+                    else:
+                        context['af_sets'][af_key] = (af_precomputed, af_spectra)
+                        context['af_fl_ids'] = self.controller.af_fluorescence_ids_for_whitelist()
+
+                full_sample_path = str(self.controller.experiment_dir / sample_key)
+                af_assignment = [list(af_key), array_hash(context['af_sets'][af_key][1])] if af_key else None
+                cache_keys[sample_key] = sample_cache_key(full_sample_path, tm_hash, g_hash, af_assignment)
+                cached = load_cached_statistics(cache_dir, sample_key, cache_keys[sample_key], requests)
+                if cached is None:
+                    jobs[sample_key] = (full_sample_path, af_key)
                 else:
-                    group_name = None
+                    data_by_sample[sample_key]['Statistics'] = cached
 
-                if depth > 3:
-                    category_name = '/'.join(path_components[1:-2])
-                else:
-                    category_name = None
-
-                full_sample_path = str(self.controller.experiment_dir / samples_to_calculate[n])
-                sample = sample_from_fcs(full_sample_path)
-                whitelisted_pnn = self.controller.experiment.settings['raw'].get('whitelisted_pnn')
-                try:
-                    raw_event_data = sample.get_events(source='raw', col_order=whitelisted_pnn)
-                except (KeyError, ValueError) as e:
+            n_cached = len(samples_to_calculate) - len(jobs)
+            logger.info(f'StatisticsCalculator: {n_cached} samples from cache, {len(jobs)} to calculate')
+            if self.bus:
+                self.bus.progress.emit(n_cached, len(samples_to_calculate))
+
+            for n, (sample_key, result) in enumerate(run_statistics_jobs(jobs, context, requests, settings.statistics_max_workers_retrieved)):
+                logger.info(f'StatisticsCalculator: sample {n_cached+n+1}/{len(samples_to_calculate)}')
+                if self.bus:
+                    self.bus.progress.emit(n_cached+n+1, len(samples_to_calculate))
+
+                if result['status'] == 'skipped':
                     logger.warning(
                         'StatisticsCalculator: col_order get_events failed (%s) for %s — '
                         'skipping sample (channels do not match experiment whitelist)',
-                        e, full_sample_path,
+                        result['error'], jobs[sample_key][0],
                     )
                     if self.bus:
                         self.bus.warningMessage.emit(
-                            f'Skipped "{sample_name}" when calculating statistics: '
-                            f'its channels do not match the experiment whitelist ({e}).'
+                            f'Skipped "{data_by_sample[sample_key]["Sample"]}" when calculating statistics: '
+                            f'its channels do not match the experiment whitelist ({result["error"]}).'
                         )
+                    data_by_sample.pop(sample_key)
                     continue
-                n_events = sample.event_count
-
-                data_by_sample[samples_to_calculate[n]] = {'Sample': sample_name, 'Group': group_name, 'Category': category_name, 'Statistics': {}}
-                if n_events > 0:
-                    unmixed_event_data = apply_transfer_matrix(self.controller.transfer_matrix, raw_event_data)
-                    data_for_statistics_comparison.update({'event_data': unmixed_event_data})
-
-                    gate_membership = {'root': np.ones(len(data_for_statistics_comparison['event_data']), dtype=np.bool_)}
-                    data_for_statistics_comparison.update({'gate_membership': gate_membership})
-                    gates_to_calculate = [g[0] for g in data_for_statistics_comparison['gating'].get_gate_ids()]
-                    # gates_to_calculate = list(set([statistics_comparison['gate'] for statistics_comparison in experiment_statistics]))
-                    apply_gates_in_place(data_for_statistics_comparison, gates_to_calculate=gates_to_calculate)
-                    sample_statistics = calc_stats(data_for_statistics_comparison)
-                    for statistics_comparison in experiment_statistics:
-                        gate_name = statistics_comparison['gate']
-                        statistic = statistics_comparison['statistic']
-                        if gate_name in sample_statistics:
-                            if statistic == "% Total Events":
-                                value = sample_statistics[gate_name]['p_gate_total'] * 100
-                            elif statistic == "% Parent":
-                                value = sample_statistics[gate_name]['p_gate_parent'] * 100
-                            elif statistic == "Event Concentration":
-                                value = sample_statistics[gate_name]['n_events_gate'] / 60
-                            elif statistic == "Number of Events":
-                                value = sample_statistics[gate_name]['n_events_gate']
-                            else: #if statistic == "Mean Intensity..." or "Intensity...":
-                                channel_index = data_for_statistics_comparison['pnn'].index(statistics_comparison['channel'])
-                                gate_membership = data_for_statistics_comparison['gate_membership'][gate_name]
-                                if statistic.startswith('Mean'):
-                                    value = float(data_for_statistics_comparison['event_data'][gate_membership,channel_index].mean())
-                                else:
-                                    transform = data_for_statistics_comparison['transformations'][statistics_comparison['channel']]
-                                    histogram = calc_hist1d(data_for_statistics_comparison['event_data'], gate_membership, channel_index, transform)
-                                    value = histogram.tolist()
-
-                            data_by_sample[samples_to_calculate[n]]['Statistics'][(gate_name, statistic)] = value
-
-                        else:
-                            text = (f'Cannot calculate statistics: gate "{gate_name}" no longer exists.  '
-                                    f'Please either create the gate again or delete any statistics plots below that reference {gate_name}.')
-                            warnings.warn(text)
-                            if self.bus:
-                                self.bus.warningMessage.emit(text)
-                                self.bus.progress.emit(0,0)
-                                self.bus.statusMessage.emit(text)
-                            self.finished.emit()
-                            return
+
+                data_by_sample[sample_key]['Statistics'] = result['values']
+                save_cached_statistics(cache_dir, sample_key, cache_keys[sample_key], result['values'], empty=result['status'] == 'empty')
+
+            # keep skipped samples out of the table, as before
+            samples_by_set = {sample_set: [sample for sample in samples if sample in data_by_sample] for sample_set, samples in samples_by_set.items()}
 
             # assemble the data into experiment statistics data table
             for m, statistics_comparison in enumerate(experiment_statistics):
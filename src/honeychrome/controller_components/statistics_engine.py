@@ -0,0 +1,217 @@
+'''
+Batch statistics engine used by StatisticsCalculator.
+
+Each sample is loaded, unmixed, gated and reduced to the requested statistics
+in a worker process. Results are cached per sample in the experiment cache
+directory, keyed by the file fingerprint, the transfer matrix, the gating
+(including transformations and lookup tables) and the sample's AF assignment,
+so that a refresh only recomputes samples whose inputs have changed.
+
+Samples with AutoSpectral profiles assigned are unmixed exactly as in
+Controller._apply_unmixing. The combined AF matrices for each distinct profile
+set are built once by the controller and shipped to every worker in the
+shared context, so AF correction costs no per-sample precomputation.
+'''
+import hashlib
+import json
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from honeychrome.controller_components.functions import apply_gates_in_place, apply_transfer_matrix, calc_stats, sample_from_fcs, calc_hist1d
+from honeychrome.controller_components.autospectral_functions import apply_af_transfer
+from honeychrome.controller_components.gml_functions_mod_from_flowkit import to_gml
+
+import logging
+logger = logging.getLogger(__name__)
+
+# context shared by all samples, set once per worker process by _initialise_worker
+_worker_context = None
+# apply_af_transfer options in a worker process: its share of the cores, as threads with one BLAS thread each
+_worker_af_options = {}
+
+
+def _update_hash(h, array):
+    array = np.ascontiguousarray(array)
+    h.update(str(array.dtype).encode())
+    h.update(str(array.shape).encode())
+    h.update(array.tobytes())
+
+
+def file_fingerprint(path):
+    stat = Path(path).stat()
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def array_hash(array):
+    h = hashlib.sha1()
+    _update_hash(h, array)
+    return h.hexdigest()
+
+
+def gating_hash(context):
+    '''hash of everything that determines gate membership and histogram binning'''
+    h = hashlib.sha1()
+    h.update(to_gml(context['gating']).encode())
+    h.update(json.dumps(context['pnn']).encode())
+    h.update(json.dumps(context['whitelisted_pnn']).encode())
+    for name in sorted(context['lookup_tables']):
+        h.update(name.encode())
+        _update_hash(h, context['lookup_tables'][name])
+    for label in sorted(context['transformations']):
+        h.update(label.encode())
+        _update_hash(h, context['transformations'][label].scale)
+    return h.hexdigest()
+
+
+def sample_cache_key(full_sample_path, tm_hash, g_hash, af_assignment):
+    return json.dumps([file_fingerprint(full_sample_path), tm_hash, g_hash, af_assignment])
+
+
+def statistics_cache_path(cache_dir, sample_key):
+    name = hashlib.sha1(str(sample_key).encode()).hexdigest()
+    return Path(cache_dir) / f'{name}.json'
+
+
+def load_cached_statistics(cache_dir, sample_key, key, requests):
+    '''return {(gate, statistic): value} if every request is in the cache entry for this key, else None'''
+    path = statistics_cache_path(cache_dir, sample_key)
+    if not path.exists():
+        return None
+    try:
+        entry = json.loads(path.read_text())
+    except (OSError, ValueError) as e:
+        logger.warning(f'StatisticsEngine: unreadable cache entry {path} ({e}), recalculating')
+        return None
+    if entry.get('key') != key:
+        return None
+    values = {(gate, statistic): value for gate, statistic, value in entry['values']}
+    if entry.get('empty') or all((gate, statistic) in values for gate, statistic, channel in requests):
+        return values
+    return None
+
+
+def save_cached_statistics(cache_dir, sample_key, key, values, empty=False):
+    '''write values for this key, merging with any values already cached under the same key'''
+    path = statistics_cache_path(cache_dir, sample_key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        merged = load_cached_statistics(cache_dir, sample_key, key, []) or {}
+        merged.update(values)
+        entry = {'key': key, 'empty': empty,
+                 'values': [[gate, statistic, value] for (gate, statistic), value in merged.items()]}
+        path.write_text(json.dumps(entry))
+    except OSError as e:
+        logger.warning(f'StatisticsEngine: could not write cache entry {path} ({e})')
+
+
+def sample_statistics_values(event_data, context, requests):
+    '''reduce one sample's unmixed event data to {(gate, statistic): value} for each (gate, statistic, channel) request'''
+    data = {
+        'event_data': event_data,
+        'pnn': context['pnn'],
+        'transformations': context['transformations'],
+        'lookup_tables': context['lookup_tables'],
+        'gating': context['gating'],
+        'gate_membership': {'root': np.ones(len(event_data), dtype=np.bool_)},
+    }
+    gates_to_calculate = [g[0] for g in data['gating'].get_gate_ids()]
+    apply_gates_in_place(data, gates_to_calculate=gates_to_calculate)
+    sample_statistics = calc_stats(data)
+
+    values = {}
+    for gate_name, statistic, channel in requests:
+        if gate_name not in sample_statistics:
+            continue
+        if statistic == "% Total Events":
+            value = sample_statistics[gate_name]['p_gate_total'] * 100
+        elif statistic == "% Parent":
+            value = sample_statistics[gate_name]['p_gate_parent'] * 100
+        elif statistic == "Event Concentration":
+            value = sample_statistics[gate_name]['n_events_gate'] / 60
+        elif statistic == "Number of Events":
+            value = sample_statistics[gate_name]['n_events_gate']
+        else: #if statistic == "Mean Intensity..." or "Intensity...":
+            channel_index = data['pnn'].index(channel)
+            gate_membership = data['gate_membership'][gate_name]
+            if statistic.startswith('Mean'):
+                value = float(event_data[gate_membership, channel_index].mean())
+            else:
+                transform = data['transformations'][channel]
+                histogram = calc_hist1d(event_data, gate_membership, channel_index, transform)
+                value = histogram.tolist()
+        if not isinstance(value, list):
+            value = float(value) if isinstance(value, (float, np.floating)) else int(value)
+        values[(gate_name, statistic)] = value
+    return values
+
+
+def unmix_sample(raw_event_data, context, af_key=None):
+    '''same unmixing as Controller._apply_unmixing: AF-corrected if af_key names a profile set in the context, otherwise plain transfer matrix'''
+    if af_key is not None:
+        af_precomputed, af_spectra = context['af_sets'][af_key]
+        result = apply_af_transfer(
+            raw_event_data,
+            context['transfer_matrix'],
+            af_precomputed,
+            af_spectra,
+            context['settings'],
+            filtered_fl_ids_raw=context['af_fl_ids'],
+            spillover=context['spillover'],
+            **_worker_af_options,
+        )
+        return result['unmixed']
+    return apply_transfer_matrix(context['transfer_matrix'], raw_event_data)
+
+
+def calculate_sample_statistics(full_sample_path, requests, af_key=None, context=None):
+    '''
+    load, unmix, gate and reduce a single sample
+    af_key selects a precomputed AF profile set from context['af_sets'] (None for plain unmixing)
+    returns {'status': 'ok' | 'empty', 'values': {...}} or {'status': 'skipped', 'error': str}
+    '''
+    if context is None:
+        context = _worker_context
+    sample = sample_from_fcs(full_sample_path)
+    try:
+        raw_event_data = sample.get_events(source='raw', col_order=context['whitelisted_pnn'])
+    except (KeyError, ValueError) as e:
+        return {'status': 'skipped', 'error': str(e)}
+
+    if sample.event_count == 0:
+        return {'status': 'empty', 'values': {}}
+
+    unmixed_event_data = unmix_sample(raw_event_data, context, af_key)
+    return {'status': 'ok', 'values': sample_statistics_values(unmixed_event_data, context, requests)}
+
+
+def _initialise_worker(context, n_processes):
+    global _worker_context, _worker_af_options
+    _worker_context = context
+    # the process is the worker's own, so its AF unmixing may limit BLAS threads process-wide
+    _worker_af_options = {'n_workers': max(1, (os.cpu_count() or 1) // n_processes), 'limit_blas_threads': True}
+
+
+def run_statistics_jobs(jobs, context, requests, max_workers):
+    '''
+    jobs: {sample_key: (full_sample_path, af_key)}
+    the context, including the AF matrices for every profile set in use, is sent to each worker once rather than per sample
+    yields (sample_key, result) as samples complete
+    runs in-process if there is only one job or max_workers <= 1, otherwise in a spawned process pool
+    '''
+    if len(jobs) <= 1 or max_workers <= 1:
+        for sample_key, (full_sample_path, af_key) in jobs.items():
+            yield sample_key, calculate_sample_statistics(full_sample_path, requests, af_key, context)
+        return
+
+    n_workers = min(max_workers, len(jobs))
+    logger.info(f'StatisticsEngine: calculating {len(jobs)} samples on {n_workers} worker processes')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn'),
+                             initializer=_initialise_worker, initargs=(context, n_workers)) as executor:
+        futures = {executor.submit(calculate_sample_statistics, full_sample_path, requests, af_key): sample_key
+                   for sample_key, (full_sample_path, af_key) in jobs.items()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -0,0 +1,195 @@
+'''
+Timing spans:
+-Spans time the stages of processing a sample (load, NaN scrub, subsample, unmix, AF unmixing, lookup tables, gating,
+ statistics, histograms, rendering, export): "with span('unmix'):" around a block, or @traced('unmix') on a function
+-Off by default (settings timing_spans), when span() returns a shared do-nothing context manager, so spans can stay in
+ the hot path
+-On, each span adds to the totals of its stage (count, total, last and longest), read by stage_timings() or summary()
+ for the status bar, and spans nest (an af_unmixing span inside unmix counts towards both)
+-With tracing on (settings timing_trace, which turns spans on too), every span is kept (up to timing_trace_max_events, oldest dropped) and
+ write_chrome_trace() writes them as Chrome trace event json, for chrome://tracing or Perfetto, e.g. to the experiment
+ cache so slow experiments can be diagnosed from a user's report
+-PhaseTimer times the phases of starting the app (always, whether spans are on or not) for the startup report
+
+The spans are per process: the totals are those of the process that ran them.
+'''
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from honeychrome.settings import timing_spans_retrieved, timing_trace_retrieved, timing_trace_max_events
+
+import logging
+logger = logging.getLogger(__name__)
+
+_enabled = False
+_tracing = False
+_lock = threading.Lock()
+_stages = {} # stage -> [count, total, last, longest, last end (perf_counter)] in seconds
+_trace = deque(maxlen=timing_trace_max_events) # (stage, start, duration, thread id, args) of every span while tracing
+_origin = time.perf_counter() # trace timestamps are from here
+_null_span = contextlib.nullcontext()
+
+
+def enable(trace=False):
+    '''start timing spans (and keeping them for the trace if trace)'''
+    global _enabled, _tracing
+    _enabled = True
+    _tracing = trace
+
+
+def disable():
+    global _enabled, _tracing
+    _enabled = False
+    _tracing = False
+
+
+def configure(spans, trace):
+    '''apply the timing_spans and timing_trace settings: tracing needs the spans, so either turns them on'''
+    if spans or trace:
+        enable(trace=trace)
+    else:
+        disable()
+
+
+configure(timing_spans_retrieved, timing_trace_retrieved)
+
+
+def is_enabled():
+    return _enabled
+
+
+def is_tracing():
+    return _tracing
+
+
+def reset():
+    '''forget all timings and the trace'''
+    with _lock:
+        _stages.clear()
+        _trace.clear()
+
+
+class _Span:
+    __slots__ = ('stage', 'args', 'start')
+
+    def __init__(self, stage, args):
+        self.stage = stage
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        duration = end - self.start
+        with _lock:
+            totals = _stages.get(self.stage)
+            if totals is None:
+                _stages[self.stage] = [1, duration, duration, duration, end]
+            else:
+                totals[0] += 1
+                totals[1] += duration
+                totals[2] = duration
+                totals[3] = max(totals[3], duration)
+                totals[4] = end
+            if _tracing:
+                _trace.append((self.stage, self.start, duration, threading.get_ident(), self.args))
+        return False
+
+
+def span(stage, **args):
+    '''context manager timing its block as stage; args (e.g. n_events) are shown with the span in the trace'''
+    if not _enabled:
+        return _null_span
+    return _Span(stage, args)
+
+
+def traced(stage):
+    '''decorator timing every call of the function as stage'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(stage, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stage_timings(since=None):
+    '''
+    {stage: {'count', 'total', 'mean', 'last', 'longest'}} in seconds, in the order the stages were first timed
+    since: a time.perf_counter() time, to leave out stages that have not finished a span since
+    '''
+    with _lock:
+        return {stage: {'count': count, 'total': total, 'mean': total / count, 'last': last, 'longest': longest}
+                for stage, (count, total, last, longest, last_end) in _stages.items() if since is None or last_end >= since}
+
+
+def summary(stages=None, since=None):
+    '''the last time of each stage (or of stages) as one line for the status bar, e.g. "load 120 ms, unmix 35 ms"'''
+    timings = stage_timings(since)
+    return ', '.join(f'{stage} {timings[stage]["last"] * 1000:.0f} ms' for stage in (stages or timings) if stage in timings)
+
+
+def chrome_trace():
+    '''the spans kept while tracing as Chrome trace event json (a dict), timestamps in microseconds'''
+    pid = os.getpid()
+    with _lock:
+        spans = list(_trace)
+    events = [{'name': stage, 'cat': 'honeychrome', 'ph': 'X', 'ts': (start - _origin) * 1e6, 'dur': duration * 1e6,
+               'pid': pid, 'tid': tid, 'args': args} for stage, start, duration, tid, args in spans]
+    events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'honeychrome'}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'stage_timings': stage_timings()}}
+
+
+def write_chrome_trace(path):
+    '''write chrome_trace() to path (creating its folder); returns the number of spans written'''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    trace = chrome_trace()
+    with open(path, 'w') as f:
+        json.dump(trace, f, default=str)
+    logger.info(f'timing: wrote {len(trace["traceEvents"]) - 1} spans to {path}')
+    return len(trace['traceEvents']) - 1
+
+
+class PhaseTimer:
+    '''
+    times consecutive phases (e.g. of starting the app) and marks moments, in seconds from started (a time.perf_counter()
+    time, by default when it is created); each phase is also a span
+    '''
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases = {} # phase -> seconds
+        self.marks = {} # mark -> seconds since started
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            with span(name):
+                yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def mark(self, name):
+        self.marks[name] = time.perf_counter() - self.started
+
+    def report(self):
+        '''{'phases': {phase: seconds}, 'marks': {mark: seconds since started}}'''
+        return {'phases': dict(self.phases), 'marks': dict(self.marks)}
+
+    def summary(self):
+        '''one line for the log, e.g. "first_window at 0.31 s, main_window at 2.40 s (import_view 1.62 s, ...)"'''
+        marks = ', '.join(f'{name} at {seconds:.2f} s' for name, seconds in self.marks.items())
+        phases = ', '.join(f'{name} {seconds:.2f} s' for name, seconds in self.phases.items())
+        return f'{marks} ({phases})' if marks else phases
@@ -9,7 +9,7 @@ from flowkit import Sample
 from typing import cast
 
 from honeychrome.controller_components.functions import apply_transfer_matrix, export_unmixed_sample, sample_from_fcs
-from honeychrome.controller_components.autospectral_functions import precompute_af_matrices, combine_af_precomputed, apply_af_transfer
+from honeychrome.controller_components.autospectral_functions import load_or_precompute_af_matrices, precompute_joint_cov_extras, combine_af_precomputed, apply_af_transfer
 import honeychrome.settings as settings
 from honeychrome.__init__ import __version__
 
@@ -227,17 +227,23 @@ class UnmixedExporter(QObject):
                     active_profiles = [all_af_profiles[name] for name in assigned_profile_names if name in all_af_profiles]
 
                     if active_profiles:
-                        # Build combined AF precomputed matrices for this sample's assigned profiles
-                        fluor_spectra = self.controller._build_fluor_spectra()
-                        precomputed_list = [
-                            precompute_af_matrices(
-                                fluor_spectra,
-                                np.array(p['spectra'])
-                            )
-                            for p in active_profiles
-                        ]
-                        af_precomputed = combine_af_precomputed(precomputed_list)
-                        af_spectra = np.vstack([np.array(p['spectra']) for p in active_profiles])
+                        # Combined AF precomputed matrices for this sample's assigned profiles,
+                        # shared with the controller (and every other sample with the same profiles)
+                        af_precomputed, af_spectra = self.controller.get_af_matrices_for_profiles(assigned_profile_names)
+                        if af_precomputed is None:
+                            fluor_spectra = self.controller._build_fluor_spectra()
+                            precomputed_list = [
+                                load_or_precompute_af_matrices(
+                                    fluor_spectra,
+                                    np.array(p['spectra']),
+                                    self.controller.af_precomputed_cache_dir,
+                                )
+                                for p in active_profiles
+                            ]
+                            af_spectra = np.vstack([np.array(p['spectra']) for p in active_profiles])
+                            af_precomputed = combine_af_precomputed(precomputed_list)
+                            if len(precomputed_list) > 1:
+                                af_precomputed.update(precompute_joint_cov_extras(af_precomputed, af_spectra))
 
                         # Remap fluorescence channel indices from full event_channels_pnn
                         # to positions in pnn_raw (the column order of raw_event_data).
@@ -0,0 +1,52 @@
+'''
+Wakeups between the stages of acquisition: instrument -> trace analyser -> controller.
+
+Each stage used to poll the head and tail indices it shares with the stage
+upstream and sleep for a fixed period between polls, so data waited most of a
+period at every stage. A Wakeup is notified by the upstream stage whenever it
+commits data (advances a tail index), and the downstream stage waits on it
+instead of sleeping. A downstream stage can still gather data into batches:
+it waits for min_batch items, but no longer than max_batch_wait after the
+first has arrived.
+'''
+import multiprocessing as mp
+import time
+
+
+class Wakeup:
+    '''
+    notified by an upstream stage when it commits data; the downstream stage waits on it
+    shared between processes: create it before the processes and pass it to them, like the locks and indices
+    '''
+    def __init__(self):
+        self._condition = mp.Condition()
+
+    def notify(self):
+        '''wake every waiting stage (call after the tail index has been advanced, or to have a waiter check its stop event)'''
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait(self, n_available, min_batch=1, max_batch_wait=0., timeout=None, stop=None):
+        '''
+        wait for data and return n_available(), the number of items waiting
+        returns once there are min_batch items, or max_batch_wait seconds after the first item was seen, or after timeout seconds
+        if no item arrives (None waits indefinitely), or once the stop event is set (it must be notified when it is set)
+        '''
+        start = time.monotonic()
+        first_seen = None
+        with self._condition:
+            while True:
+                n = n_available()
+                now = time.monotonic()
+                if n >= min_batch or (stop is not None and stop.is_set()):
+                    return n
+                if n > 0:
+                    first_seen = first_seen or now
+                    remaining = first_seen + max_batch_wait - now
+                elif timeout is not None:
+                    remaining = start + timeout - now
+                else:
+                    remaining = None
+                if remaining is not None and remaining <= 0:
+                    return n
+                self._condition.wait(remaining)
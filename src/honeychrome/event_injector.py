@@ -0,0 +1,243 @@
+'''
+Event Injector:
+-Stands in for the instrument and the trace analyser, to benchmark the controller's live path without hardware or Qt
+-Answers their commands from the controller (connect, start, stop, set, quit and start, stop, set_channels, quit)
+-Writes events into the events cache (a SharedRing) at a set rate while acquiring, as the trace analyser would: reserving,
+ writing and publishing them, and notifying events_ready
+-Events are pre-generated (an array, e.g. from the synthetic populations) or taken from an FCS file, and cycled through
+
+benchmark_live_path runs a controller against it at increasing rates and reports the highest rate at which the live
+histograms and statistics keep up (python -m honeychrome.event_injector prints the results as json).
+'''
+
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import threading
+import time
+
+import numpy as np
+
+from honeychrome.settings import channel_dict, injector_interval, injector_rates, injector_duration
+from honeychrome.controller_components.events_spill import events_cache_dtype
+from honeychrome.controller_components.wakeup import Wakeup
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def synthetic_events(n_events, event_channels_pnn=channel_dict['event_channels_pnn'], seed=0):
+    '''n_events (n_events, n_channels) of populations with lognormal spreads, like the synthetic instrument's'''
+    from honeychrome.settings import synthetic_populations
+
+    rng = np.random.default_rng(seed)
+    fractions = np.array([population['fraction'] for population in synthetic_populations])
+    populations = rng.choice(len(fractions), size=n_events, p=fractions / fractions.sum())
+    events = np.zeros((n_events, len(event_channels_pnn)))
+    for n, population in enumerate(synthetic_populations):
+        in_population = populations == n
+        spread = np.exp(rng.standard_normal((in_population.sum(), len(event_channels_pnn))) * population['cv'])
+        for m, channel in enumerate(event_channels_pnn):
+            adc_channel, _, parameter = channel.rpartition('-')
+            height = population['heights'].get(adc_channel, 1.) * 1000 # uV
+            if parameter == 'A': # gaussian pulse, uV.us
+                events[in_population, m] = height * population['width_us'] * np.sqrt(2 * np.pi) * spread[:, m]
+            elif parameter == 'H':
+                events[in_population, m] = height * spread[:, m]
+            elif parameter == 'W': # full width at half maximum, ns
+                events[in_population, m] = 2.355 * population['width_us'] * 1000 * spread[:, m] ** 0.1
+    return events
+
+
+class EventInjector(mp.Process):
+    def __init__(self,
+                 events_ring=None,
+                 events_ready=None,
+                 events=None,
+                 fcs_path=None,
+                 event_rate=injector_rates[0],
+                 pipe_connection_instrument=None,
+                 pipe_connection_analyser=None):
+        super().__init__()
+        self.events_ring = events_ring
+        self.events_ready = events_ready if events_ready is not None else Wakeup()
+        self.events = events # (n_events, n_channels) in the order of event_channels_pnn, or None to read fcs_path
+        self.fcs_path = fcs_path
+        self.event_rate = event_rate
+        self.pipe_connection_instrument = pipe_connection_instrument
+        self.pipe_connection_analyser = pipe_connection_analyser
+        self.event_channels_pnn = channel_dict['event_channels_pnn']
+        self.records = None
+        self.stop_injection = None
+        self.thread = None
+        self.n_events = 0
+
+    def run(self):
+        # initialise the things that can't be pickled
+        self.stop_injection = threading.Event()
+        self.records = self.prepare_records()
+        self.thread = threading.Thread(target=self.inject, daemon=True)
+
+        # main loop waiting for commands from experiment control, on either pipe
+        connections = [self.pipe_connection_instrument, self.pipe_connection_analyser]
+        running = True
+        while running:
+            for connection in wait(connections):
+                try:
+                    command = connection.recv()
+                except EOFError:
+                    running = False
+                    break
+                response = self.respond(command, 'Instrument driver' if connection is self.pipe_connection_instrument else 'Trace Analyser')
+                connection.send(response)
+                if command['command'] == 'quit':
+                    connections.remove(connection)
+                    running = bool(connections)
+
+        self.stop_injecting()
+        self.events_ring.close()
+        print('[Event injector] Quit')
+
+    def respond(self, command, source):
+        if command['command'] == 'start' and source == 'Trace Analyser':
+            self.start_injecting()
+        elif command['command'] == 'stop' and source == 'Trace Analyser':
+            self.stop_injecting()
+        elif command['command'] == 'set' and isinstance(command.get('data'), dict):
+            self.event_rate = command['data'].get('event_rate', self.event_rate)
+        elif command['command'] == 'set_channels':
+            self.event_channels_pnn = command['data']['event_channels_pnn']
+            self.records = self.prepare_records()
+        return {'source':f'[{source}]', 'status':'OK', 'message':f'[Event injector] {command["command"]}'}
+
+    def start_injecting(self):
+        # like the trace analyser: flush the events cache and start writing events into it
+        self.stop_injecting()
+        self.events_ring.records[:] = 0
+        self.events_ring.reset()
+        self.n_events = 0
+        self.stop_injection.clear()
+        self.thread = threading.Thread(target=self.inject, daemon=True)
+        self.thread.start()
+
+    def stop_injecting(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.stop_injection.set()
+            self.thread.join()
+
+    def prepare_records(self):
+        # the events to cycle through as records of the events cache, in the channel order of the events cache
+        events = self.events
+        if events is None and self.fcs_path is not None:
+            from flowkit import Sample
+            sample = Sample(self.fcs_path)
+            pnn = list(sample.pnn_labels)
+            raw = sample.get_events(source='raw')
+            events = np.zeros((len(raw), len(self.event_channels_pnn)))
+            for m, channel in enumerate(self.event_channels_pnn):
+                if channel in pnn:
+                    events[:, m] = raw[:, pnn.index(channel)]
+        elif events is None:
+            events = synthetic_events(100_000, self.event_channels_pnn)
+
+        records = np.zeros(len(events), dtype=events_cache_dtype(self.event_channels_pnn))
+        for m, channel in enumerate(self.event_channels_pnn):
+            records[channel] = np.clip(events[:, m], 0, None)
+        return records
+
+    def inject(self):
+        # publish rate x elapsed events every injector_interval, waiting for space in the ring if the controller falls behind
+        start_time = time.perf_counter()
+        while not self.stop_injection.wait(injector_interval):
+            elapsed = time.perf_counter() - start_time
+            n = min(int(self.event_rate * elapsed) - self.n_events, self.events_ring.space(self.n_events))
+            if n <= 0:
+                continue
+            begin = self.n_events
+            batch = np.take(self.records, np.arange(begin, begin + n) % len(self.records))
+            batch['Time'] = int(elapsed * 1000)
+            batch['event_id'] = np.arange(begin, begin + n)
+            self.events_ring.advance('reserved', begin + n)
+            self.events_ring.write(begin, batch)
+            self.n_events = begin + n
+            self.events_ring.publish(self.n_events)
+            self.events_ready.notify()
+
+
+def benchmark_live_path(experiment_path, rates=injector_rates, duration=injector_duration, events=None, fcs_path=None,
+                        plots=None, gates=None):
+    '''
+    run acquisitions into a new experiment at experiment_path, injecting events at each rate in turn for duration seconds,
+    and return a dict of results: for each rate, the events injected and displayed, processing time per update, lag,
+    events skipped and whether the live updates kept up; and the highest rate that kept up (sustained_rate)
+    plots: plots to add to the raw data tab (by default a 2D histogram of the first two scatter channels and a histogram
+    of each fluorescence channel); gates: gates to add first, as create_or_update_gate keyword arguments
+    '''
+    from honeychrome.controller import Controller
+    from honeychrome.controller_components.shared_ring import create_events_ring
+
+    events_ring = create_events_ring(channel_dict['event_channels_pnn'])
+    events_ready = Wakeup()
+    pipe_instrument_c, pipe_instrument_i = mp.Pipe()
+    pipe_analyser_c, pipe_analyser_i = mp.Pipe()
+    injector = EventInjector(events_ring=events_ring, events_ready=events_ready, events=events, fcs_path=fcs_path,
+                             pipe_connection_instrument=pipe_instrument_i, pipe_connection_analyser=pipe_analyser_i)
+    injector.start()
+
+    results = {'rates': [], 'sustained_rate': 0}
+    try:
+        controller = Controller(events_ring=events_ring, events_ready=events_ready,
+                                pipe_connection_instrument=pipe_instrument_c, pipe_connection_analyser=pipe_analyser_c)
+        controller.new_experiment(experiment_path)
+        controller.set_mode('Raw Data')
+        for gate in gates or []:
+            controller.create_or_update_gate(**gate)
+        if plots is None:
+            scatter = [c + '-A' for c in channel_dict['scatter_channels']]
+            plots = [{'type': 'hist2d', 'channel_x': scatter[0], 'channel_y': scatter[1], 'source_gate': 'root', 'child_gates': []}]
+            plots += [{'type': 'hist1d', 'channel_x': c + '-A', 'source_gate': 'root', 'child_gates': []}
+                      for c in channel_dict['fluorescence_channels']]
+        controller.data_for_cytometry_plots['plots'] += plots
+
+        for rate in rates:
+            pipe_instrument_c.send({'command': 'set', 'data': {'event_rate': rate}})
+            pipe_instrument_c.recv()
+            controller.start_acquisition()
+            start_time = time.perf_counter()
+            time.sleep(duration)
+            scheduler = controller.live_scheduler
+            n_injected = events_ring.cursor('tail')
+            elapsed = time.perf_counter() - start_time
+            result = {'rate': rate, 'n_plots': len(controller.data_for_cytometry_plots['plots']), 'injected_rate': n_injected / elapsed, 'n_injected': n_injected,
+                      'n_displayed': events_ring.cursor('head') - scheduler.n_skipped, 'n_skipped': scheduler.n_skipped,
+                      'update_processing_time': scheduler.processing_time, 'lag': scheduler.lag,
+                      'overloaded': scheduler.overloaded}
+            controller.stop_acquisition()
+            # kept up: every event was injected on time and added to every plot, and the display did not fall behind
+            result['kept_up'] = (n_injected >= 0.9 * rate * elapsed and not result['n_skipped'] and not result['overloaded']
+                                 and result['lag'] < scheduler.lag_warning)
+            results['rates'].append(result)
+            logger.info(f'benchmark_live_path: {result}')
+            if not result['kept_up']:
+                break
+            results['sustained_rate'] = rate
+    finally:
+        pipe_analyser_c.send({'command': 'quit'})
+        pipe_analyser_c.recv()
+        pipe_instrument_c.send({'command': 'quit'})
+        pipe_instrument_c.recv()
+        injector.join()
+        events_ring.close()
+        events_ring.unlink()
+    return results
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    import tempfile
+    from pathlib import Path
+    mp.set_start_method("spawn")
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = benchmark_live_path(Path(directory) / 'live benchmark', fcs_path=sys.argv[1] if len(sys.argv) > 1 else None)
+    print(json.dumps(results, indent=2))
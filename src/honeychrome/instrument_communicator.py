@@ -4,8 +4,9 @@ instrument communicator
 
 Process to manage communications with instrument
 Can use various instrument drivers (Cytkit, Picoscope, Dummy Instrument)
-Method "run" is run as a process, listens for commands from controller: [connect, start, stop, set, quit]
-Method "transfer" is started as thread when start command is received, repeadedly transfers traces to traces_cache
+Method "run" is run as a process, listens for commands from controller: [connect, start, stop, set, record, quit]
+Method "transfer" is started as thread when start command is received, repeadedly transfers traces to the traces ring
+and notifies traces_ready, which wakes the trace analyser
 
 Example workflow:
     Connects to instrument
@@ -18,32 +19,35 @@ Example workflow:
     Sets gains
     Sets laser
 
-test instrument data generator
+test instrument data generators: dummy_device (events from a bundled FCS file) and synthetic_device (configurable rate,
+populations, noise and coincidence, for load testing)
+replay_device replays a trace recording, made with the record command (see trace_recording)
 
-Shared memory: cache, head, tail, instrument settings
+Shared memory: traces ring (with its head and tail), instrument settings
 '''
 
 import multiprocessing as mp
-from multiprocessing import shared_memory, Lock
 import threading
-import numpy as np
 import time
 import warnings
 
-from honeychrome.settings import devices_boot_order, traces_cache_size, traces_cache_dtype, max_events_in_traces_cache, trace_n_points, transfer_target_repeat_time
+from honeychrome.settings import devices_boot_order, trace_n_points, transfer_target_repeat_time
+from honeychrome.controller_components.wakeup import Wakeup
+from honeychrome.controller_components.shared_ring import create_traces_ring
 
 debug = False
 
 class Instrument(mp.Process):
     def __init__(self, use_dummy_instrument=False,
-                 traces_cache_name=None,
-                 traces_cache_lock=None,
-                 index_head_traces_cache=None, index_tail_traces_cache=None,
-                 pipe_connection=None):
+                 traces_ring=None,
+                 traces_ready=None,
+                 pipe_connection=None,
+                 boot_order=devices_boot_order):
         super().__init__()
 
         # device will be a connected instrument or dummy if no instrument found
         self.device = None
+        self.boot_order = boot_order # device names, tried in turn until one connects
 
         # dummy instrument
         self.dummy_memory_head = 0
@@ -55,15 +59,13 @@ class Instrument(mp.Process):
             self.use_dummy_instrument = False
 
         self.pipe_connection = pipe_connection
-        self.index_head_traces_cache = index_head_traces_cache
-        self.index_tail_traces_cache = index_tail_traces_cache
-        self.traces_cache_name = traces_cache_name
-        self.traces_cache = None
-        self.traces_cache_lock = traces_cache_lock
-        self.max_events_in_traces_cache = max_events_in_traces_cache
+        self.traces_ring = traces_ring
         self.trace_n_points = trace_n_points
+        self.traces_ready = traces_ready if traces_ready is not None else Wakeup()
         self.stop_transfer = None
         self.thread = None
+        self.recorder = None # records the traces read out, when recording
+        self.recorder_lock = None # held by the transfer thread while it appends, and while the recorder is swapped or closed
 
 
     def run(self):
@@ -71,17 +73,13 @@ class Instrument(mp.Process):
 
         # initialise the things that can't be pickled
         self.stop_transfer = threading.Event()
+        self.recorder_lock = threading.Lock()
         # initialise transfer thread
         self.thread = threading.Thread(
             target=self.transfer,
             daemon=True
         )
 
-        # Attach to existing shared memory
-        shm = shared_memory.SharedMemory(name=self.traces_cache_name)
-        with self.traces_cache_lock:
-            self.traces_cache = np.ndarray((self.max_events_in_traces_cache * self.trace_n_points), dtype=traces_cache_dtype, buffer=shm.buf)
-
         # main loop waiting for commands from experiment control
         while True:
             try:
@@ -99,6 +97,8 @@ class Instrument(mp.Process):
                 response_to_experiment_control = self.stop_acquisition()
             elif incoming_from_experiment_control['command'] == 'set':
                 response_to_experiment_control = self.change_instrument_settings(incoming_from_experiment_control['data'])
+            elif incoming_from_experiment_control['command'] == 'record':
+                response_to_experiment_control = self.record_traces(incoming_from_experiment_control['data'])
             elif incoming_from_experiment_control['command'] == 'quit':
                 response_to_experiment_control = {'source':'[Instrument driver]', 'status':'OK', 'message':' Quitting'}
                 self.pipe_connection.send(response_to_experiment_control)
@@ -106,17 +106,18 @@ class Instrument(mp.Process):
 
             self.pipe_connection.send(response_to_experiment_control)
 
-        while self.thread.is_alive():
-            print('[Instrument driver] Waiting until transfer thread ends')
-            time.sleep(0.25)
+        if self.thread.is_alive():
+            self.stop_transfer.set()
+            self.thread.join()
 
+        self.record_traces(None)
         self.disconnect_instrument()
-        shm.close()
+        self.traces_ring.close()
         print('[Instrument driver] Quit')
 
 
     def connect_to_instrument(self):
-        for device_name in devices_boot_order:
+        for device_name in self.boot_order:
             try:
                 if device_name == 'cytkit':
                     from honeychrome.instrument_driver_components.cytkit_driver import CytkitDevice
@@ -126,6 +127,14 @@ class Instrument(mp.Process):
                     from honeychrome.instrument_driver_components.pico5000_driver import Pico5000_Device
                     device = Pico5000_Device()
 
+                elif device_name == 'replay_device':
+                    from honeychrome.instrument_driver_components.replay_driver import ReplayDevice
+                    device = ReplayDevice()
+
+                elif device_name == 'synthetic_device':
+                    from honeychrome.instrument_driver_components.synthetic_driver import SyntheticDevice
+                    device = SyntheticDevice()
+
                 else: # device_name == 'dummy_device':
                     from honeychrome.instrument_driver_components.dummy_driver import DummyDevice
                     device = DummyDevice()
@@ -167,6 +176,19 @@ class Instrument(mp.Process):
         print(data)
         return {'source':'[Instrument driver]', 'status':'OK', 'message':'Instrument configuration changed'}
 
+    def record_traces(self, path):
+        # record the traces read out to a new recording at path, or stop recording if path is None
+        from honeychrome.instrument_driver_components.trace_recording import TraceRecorder
+
+        recorder = TraceRecorder(path) if path is not None else None
+        with self.recorder_lock:
+            previous, self.recorder = self.recorder, recorder
+            n_traces = previous.close() if previous is not None else None
+        message = f'Recorded {n_traces} traces' if n_traces is not None else 'Not recording'
+        if recorder is not None:
+            message = f'Recording traces to {path}'
+        return {'source':'[Instrument driver]', 'status':'OK', 'message':message}
+
     def transfer(self):
         while True:
             start_time = time.perf_counter()
@@ -178,42 +200,33 @@ class Instrument(mp.Process):
                 self.stop_transfer.clear()
                 break
 
-            # Calculate elapsed time and sleep precisely
+            # Calculate elapsed time and wait precisely (stopping wakes the wait)
             elapsed = time.perf_counter() - start_time
             sleep_time = max(0., transfer_target_repeat_time - elapsed)
-            time.sleep(sleep_time)
+            self.stop_transfer.wait(sleep_time)
 
     def push_to_traces_cache(self, blob_np):
         n_traces_from_memory = len(blob_np) // self.trace_n_points
-        with self.index_tail_traces_cache.get_lock():
-            tail = self.index_tail_traces_cache.value
-        with self.index_head_traces_cache.get_lock():
-            head = self.index_head_traces_cache.value
-
-        cache_new_tail = tail + n_traces_from_memory
-        if cache_new_tail <= head + self.max_events_in_traces_cache:
-
-            queue_begin_index = tail % self.max_events_in_traces_cache
-            queue_end_index = cache_new_tail % self.max_events_in_traces_cache
-            slice_begin = queue_begin_index * self.trace_n_points
-            slice_end = queue_end_index * self.trace_n_points
-            with self.traces_cache_lock:
-                if queue_end_index >= queue_begin_index:
-                    try:
-                        self.traces_cache[slice_begin:slice_end] = blob_np #todo fix: this crashes in long acquisition
-                    except ValueError as e:
-                        warnings.warn(str(e))
-                else:
-                    # note number of events that didn't fit is queue_end_index
-                    switch_index = (self.max_events_in_traces_cache - queue_begin_index) * self.trace_n_points
-                    self.traces_cache[slice_begin:] = blob_np[:switch_index]  # put first events into back of queue array
-                    self.traces_cache[:slice_end] = blob_np[switch_index:]  # put last events into front of queue array
-
-            with self.index_tail_traces_cache.get_lock():
-                self.index_tail_traces_cache.value = cache_new_tail
+        tail = self.traces_ring.cursor('tail')
+
+        with self.recorder_lock:
+            if self.recorder is not None:
+                self.recorder.append(blob_np)
+
+        # a lossless device (a replay) waits for the trace analyser to make space
+        if getattr(self.device, 'lossless', False):
+            while n_traces_from_memory > self.traces_ring.space(tail) and not self.stop_transfer.is_set():
+                self.stop_transfer.wait(transfer_target_repeat_time / 10)
+
+        if n_traces_from_memory <= self.traces_ring.space(tail):
+            cache_new_tail = tail + n_traces_from_memory
+            self.traces_ring.advance('reserved', cache_new_tail)
+            self.traces_ring.write(tail, blob_np.reshape(n_traces_from_memory, self.trace_n_points))
+            self.traces_ring.publish(cache_new_tail)
+            self.traces_ready.notify()
 
             if debug == True:
-                print(f'[Instrument driver] pushed data to traces cache (head:{head}, tail:{cache_new_tail})')
+                print(f'[Instrument driver] pushed data to traces cache (head:{self.traces_ring.cursor("head")}, tail:{cache_new_tail})')
         else:
             warnings.warn("[Instrument driver] Traces cache is full, data dropped")
             pass
@@ -223,21 +236,15 @@ class Instrument(mp.Process):
 if __name__ == '__main__':
     mp.set_start_method("spawn")
 
-    # Allocate shared memory block, plus head and tail indices
-    traces_cache_shm = shared_memory.SharedMemory(create=True, size=np.zeros(traces_cache_size, dtype=traces_cache_dtype).nbytes)
-    traces_cache_lock = Lock()
-    index_head_traces_cache = mp.Value('i', 0)
-    index_tail_traces_cache = mp.Value('i', 0)
+    # Allocate shared memory ring, with its head and tail
+    traces_ring = create_traces_ring()
 
     pipe_experiment_instrument_e, pipe_experiment_instrument_i = mp.Pipe()
 
     # start instrument dummy
     instrument = Instrument(
         use_dummy_instrument=True,
-        traces_cache_name=traces_cache_shm.name,
-        traces_cache_lock=traces_cache_lock,
-        index_head_traces_cache=index_head_traces_cache,
-        index_tail_traces_cache=index_tail_traces_cache,
+        traces_ring=traces_ring,
         pipe_connection=pipe_experiment_instrument_i
     )
     instrument.start()
@@ -268,4 +275,6 @@ if __name__ == '__main__':
     response = pipe_experiment_instrument_e.recv()
     print(response)
 
-    instrument.join()
\ No newline at end of file
+    instrument.join()
+    traces_ring.close()
+    traces_ring.unlink()
@@ -0,0 +1,102 @@
+'''
+Replay instrument: streams a trace recording (see trace_recording) back through the traces cache, for reanalysis with other
+peak detection settings and for benchmarking the trace analyser.
+
+The traces are replayed in the blobs they were recorded in, at the times they were read out (speed 1), speed times faster,
+or as fast as the traces cache takes them (speed None). The replay is lossless: the instrument waits for space in the traces
+cache rather than dropping traces when it is full.
+'''
+import time
+import numpy as np
+
+from honeychrome.settings import replay_recording, replay_speed, replay_max_events_per_read, traces_cache_dtype
+from honeychrome.instrument_driver_components.trace_recording import TraceRecording
+
+
+class ReplayDevice:
+    """
+    Device driver must provide the following methods:
+        connect_to_device
+        disconnect
+        start_acquisition
+        stop_acquisition
+        change_device_settings
+        read_out_traces
+    """
+    lossless = True # the instrument waits for space in the traces cache rather than dropping traces
+
+    def __init__(self, path=replay_recording, speed=replay_speed, loop=False, max_events_per_read=replay_max_events_per_read):
+        self.recording = None
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.max_events_per_read = max_events_per_read
+        self.start_time = None
+        self.position = 0 # traces replayed
+        self.n_loops = 0
+
+    def connect_to_device(self):
+        if self.path is None:
+            raise ValueError('no trace recording to replay')
+        self.recording = TraceRecording(self.path)
+
+    def disconnect(self):
+        self.recording = None
+
+    def start_acquisition(self):
+        self.start_time = time.perf_counter()
+        self.position = 0
+        self.n_loops = 0
+
+    def stop_acquisition(self):
+        self.start_time = None
+
+    def change_device_settings(self, settings):
+        # any of speed, loop
+        if not isinstance(settings, dict):
+            return
+        if 'speed' in settings:
+            # carry on from where the replay has got to, at the new speed
+            self.speed = settings['speed']
+            if self.speed and self.start_time is not None:
+                self.start_time = time.perf_counter() - (self.recording.time_at(self.position) - self.recording.start) / self.speed
+                self.n_loops = 0
+        self.loop = settings.get('loop', self.loop)
+
+    def recording_time(self):
+        # the time in the recording (of the current loop through it, from its first blob) that the replay has reached
+        if self.start_time is None or not self.speed:
+            return 0.
+        return (time.perf_counter() - self.start_time) * self.speed - self.n_loops * self.recording.duration
+
+    def read_out_traces(self):
+        # the traces read out since the last read, in their recorded blobs (at most max_events_per_read at maximum speed)
+        recording = self.recording
+        if self.speed:
+            end = recording.traces_until(recording.start + self.recording_time())
+        else:
+            end = min(self.position + self.max_events_per_read, recording.n_traces)
+        blob = recording.traces[self.position:end].reshape(-1).astype(traces_cache_dtype) # copied out of the memory map
+        self.position = end
+
+        if self.position >= recording.n_traces and self.loop and recording.n_traces:
+            self.position = 0
+            self.n_loops += 1
+        return blob
+
+    @property
+    def finished(self):
+        return self.recording is None or (not self.loop and self.position >= self.recording.n_traces)
+
+
+if __name__ == '__main__':
+    import sys
+    device = ReplayDevice(sys.argv[1], speed=None)
+    device.connect_to_device()
+    device.start_acquisition()
+    start = time.perf_counter()
+    n = 0
+    while not device.finished:
+        n += len(device.read_out_traces())
+    elapsed = time.perf_counter() - start
+    print(f'replayed {device.position} traces ({n * np.dtype(traces_cache_dtype).itemsize / 2**20:.0f} MB) in {elapsed:.3f} s')
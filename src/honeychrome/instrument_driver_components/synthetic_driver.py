@@ -0,0 +1,157 @@
+'''
+Synthetic instrument: generates traces for load testing the acquisition pipeline without hardware.
+
+Events arrive as a Poisson process at event_rate, each from one of a mixture of populations (pulse heights per channel with a
+lognormal spread, and a pulse width), with noise on every channel and, for a fraction of events, a second coincident
+particle in the trace window. Traces are generated in blocks with numpy, and the noise is taken from a bank generated
+once (in adc levels, so that it is added to the traces as integers), so rates of 100k+ events/s can be generated.
+'''
+import time
+import numpy as np
+
+from honeychrome.settings import adc_channels, adc_rate, adc_scale_mv, nearly_floor_uint16, traces_cache_dtype, n_channels_trace, n_time_points_in_event
+from honeychrome.settings import synthetic_event_rate, synthetic_noise_mv, synthetic_coincidence, synthetic_populations
+
+trace_indices = np.arange(n_time_points_in_event, dtype=np.float32)
+noise_bank_size = 2**23 # samples of baseline noise that traces are taken from
+block_size = 512 # events generated at once
+max_level = np.iinfo(traces_cache_dtype).max
+max_read_interval = 1. # s, the longest interval made up in one read (after a pause between reads)
+
+
+class SyntheticDevice:
+    """
+    Device driver must provide the following methods:
+        connect_to_device
+        disconnect
+        start_acquisition
+        stop_acquisition
+        change_device_settings
+        read_out_traces
+    """
+    def __init__(self, event_rate=synthetic_event_rate, populations=synthetic_populations, noise_mv=synthetic_noise_mv,
+                 coincidence=synthetic_coincidence, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.event_rate = event_rate
+        self.coincidence = coincidence
+        self.set_populations(populations)
+        self.set_noise(noise_mv)
+        self.last_read = None
+        self.n_events = 0
+        self.buffer = np.empty(0, dtype=traces_cache_dtype)
+
+    def set_populations(self, populations):
+        fractions = np.array([population['fraction'] for population in populations], dtype=float)
+        self.fractions = fractions / fractions.sum()
+        self.heights = np.zeros((len(populations), n_channels_trace), dtype=np.float32) # in adc levels
+        for n, population in enumerate(populations):
+            for channel, height in population['heights'].items():
+                self.heights[n, adc_channels.index(channel)] = height * adc_scale_mv
+        self.cvs = np.array([population['cv'] for population in populations], dtype=np.float32)
+        self.widths = np.array([population['width_us'] * adc_rate for population in populations], dtype=np.float32) # in time points
+
+    def set_noise(self, noise_mv):
+        # the baseline with noise, as adc levels; pulses are clipped to leave room for it below the top of the adc range
+        self.noise_mv = noise_mv
+        noise = self.rng.standard_normal(noise_bank_size, dtype=np.float32) * np.float32(noise_mv * adc_scale_mv) + np.float32(nearly_floor_uint16)
+        self.noise_bank = np.clip(np.rint(noise), 0, max_level).astype(traces_cache_dtype)
+        self.max_amplitude = max_level - int(self.noise_bank.max())
+
+    def connect_to_device(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def start_acquisition(self):
+        self.last_read = time.perf_counter()
+        self.n_events = 0
+
+    def stop_acquisition(self):
+        self.last_read = None
+
+    def change_device_settings(self, settings):
+        # any of event_rate, populations, noise_mv, coincidence
+        if not isinstance(settings, dict):
+            return
+        self.event_rate = settings.get('event_rate', self.event_rate)
+        self.coincidence = settings.get('coincidence', self.coincidence)
+        if 'populations' in settings:
+            self.set_populations(settings['populations'])
+        if 'noise_mv' in settings:
+            self.set_noise(settings['noise_mv'])
+
+    def pulses(self, n, centres=None):
+        # amplitudes (n, n_channels_trace) and unit pulse shapes (n, n_time_points_in_event) of n particles from the populations
+        # centred at centres (by default where the trigger would place them)
+        populations = self.rng.choice(len(self.fractions), size=n, p=self.fractions)
+        spread = np.exp(self.rng.standard_normal((n, n_channels_trace), dtype=np.float32) * self.cvs[populations, None])
+        amplitudes = self.heights[populations] * spread
+        widths = self.widths[populations] * np.exp(self.rng.standard_normal(n, dtype=np.float32) * np.float32(0.1))
+        if centres is None:
+            centres = n_time_points_in_event // 2 - self.rng.integers(n_time_points_in_event // 5, size=n).astype(np.float32)
+        shapes = np.exp(np.float32(-0.5) * ((trace_indices - centres[:, None]) / widths[:, None]) ** 2)
+        return amplitudes, shapes, centres
+
+    def generate_traces(self, n, out=None):
+        # returns a blob_np: 1d array of n * n_channels_trace * n_time_points_in_event uint16, as read out from an instrument
+        # (in out if given, an array at least that size)
+        size = n * n_channels_trace * n_time_points_in_event
+        if out is None:
+            out = np.empty(size, dtype=traces_cache_dtype)
+        blob = out[:size].reshape(n, n_channels_trace, n_time_points_in_event)
+        for begin in range(0, n, block_size):
+            m = min(block_size, n - begin)
+            traces = blob[begin:begin + m]
+            amplitudes, shapes, centres = self.pulses(m)
+            np.minimum(amplitudes, self.max_amplitude, out=amplitudes)
+            for channel, active in enumerate(amplitudes.any(axis=0)): # channels without a signal in any population are only noise
+                if active:
+                    np.multiply(amplitudes[:, channel, None], shapes, out=traces[:, channel], casting='unsafe')
+                else:
+                    traces[:, channel] = 0
+
+            # a second particle in the window of some events, arriving before or after the first
+            coincident = np.flatnonzero(self.rng.random(m) < self.coincidence)
+            if len(coincident):
+                shift = self.rng.integers(-n_time_points_in_event // 3, n_time_points_in_event // 3, size=len(coincident))
+                amplitudes_2, shapes_2, _ = self.pulses(len(coincident), centres[coincident] + shift)
+                both = amplitudes[coincident, :, None] * shapes[coincident, None, :] + amplitudes_2[:, :, None] * shapes_2[:, None, :]
+                traces[coincident] = np.minimum(both, self.max_amplitude)
+
+            # on the baseline with noise, from a random place in the bank
+            offset = self.rng.integers(noise_bank_size - traces.size)
+            traces += self.noise_bank[offset:offset + traces.size].reshape(traces.shape)
+        self.n_events += n
+        return out[:size]
+
+    def read_out_traces(self):
+        # the events that arrived since the last read, in a buffer that is reused (the blob is valid until the next read):
+        # writing to fresh memory each time would cost as much as generating the traces
+        now = time.perf_counter()
+        if self.last_read is None:
+            self.last_read = now
+        elapsed = min(now - self.last_read, max_read_interval)
+        self.last_read = now
+        n = self.rng.poisson(self.event_rate * elapsed)
+        size = n * n_channels_trace * n_time_points_in_event
+        if len(self.buffer) < size:
+            self.buffer = np.empty(size, dtype=traces_cache_dtype)
+        return self.generate_traces(n, out=self.buffer)
+
+
+if __name__ == '__main__':
+    device = SyntheticDevice(seed=0)
+    device.start_acquisition()
+    n = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < 2:
+        time.sleep(0.05)
+        n += len(device.read_out_traces()) // (n_channels_trace * n_time_points_in_event)
+    elapsed = time.perf_counter() - start
+    print(f'generated {n} events in {elapsed:.3f} s ({n / elapsed:.0f} events/s at {device.event_rate} events/s set)')
+    buffer = np.empty(10_000 * n_channels_trace * n_time_points_in_event, dtype=traces_cache_dtype)
+    start = time.perf_counter()
+    for _ in range(10):
+        device.generate_traces(10_000, out=buffer)
+    print(f'maximum rate {100_000 / (time.perf_counter() - start):.0f} events/s')
@@ -0,0 +1,101 @@
+'''
+Recordings of the raw traces read out from an instrument, for replay (see replay_driver) and offline reanalysis.
+
+A recording is three files side by side:
+    <name>.traces       the uint16 traces as they were read out, appended blob by blob: (n_traces, trace_n_points)
+    <name>.times        one (time, end) record per blob: seconds since recording started, and the number of traces so far
+    <name>.traces.json  the trace layout (channels, time points, adc rate and scale) the traces were recorded with
+Both data files are only ever appended to, and flushed after every blob, so a recording cut short by a crash of the app
+is readable up to its last complete blob (a crash of the OS may lose what it had not yet written to disk),
+and both are read through memory maps, so a recording of any length can be replayed or reanalysed in slices.
+'''
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from honeychrome.settings import trace_n_points, n_channels_trace, n_time_points_in_event, adc_rate, adc_scale_mv, traces_cache_dtype
+
+import logging
+logger = logging.getLogger(__name__)
+
+times_dtype = np.dtype([('time', '<f8'), ('end', '<i8')])
+
+
+def recording_paths(path):
+    '''the traces, times and metadata files of the recording at path (with or without its .traces suffix)'''
+    path = Path(path)
+    if path.suffix == '.traces':
+        path = path.with_suffix('')
+    return path.with_suffix('.traces'), path.with_suffix('.times'), path.with_suffix('.traces.json')
+
+
+class TraceRecorder:
+    '''appends blobs of traces as read out from an instrument, with the time each was read, to a new recording at path'''
+    def __init__(self, path):
+        self.traces_path, self.times_path, metadata_path = recording_paths(path)
+        self.traces_path.parent.mkdir(parents=True, exist_ok=True)
+        metadata = {'trace_n_points': trace_n_points, 'n_channels_trace': n_channels_trace, 'n_time_points_in_event': n_time_points_in_event,
+                    'adc_rate': adc_rate, 'adc_scale_mv': adc_scale_mv, 'dtype': traces_cache_dtype}
+        metadata_path.write_text(json.dumps(metadata, indent=2))
+        self.traces_file = open(self.traces_path, 'wb')
+        self.times_file = open(self.times_path, 'wb')
+        self.start_time = time.perf_counter()
+        self.n_traces = 0
+
+    def append(self, blob_np):
+        n = len(blob_np) // trace_n_points
+        if n == 0:
+            return
+        # flushed blob by blob, the traces before their time, so after a crash every blob in the times file is readable
+        self.traces_file.write(np.ascontiguousarray(blob_np, dtype=traces_cache_dtype).data)
+        self.traces_file.flush()
+        self.n_traces += n
+        self.times_file.write(np.array([(time.perf_counter() - self.start_time, self.n_traces)], dtype=times_dtype).tobytes())
+        self.times_file.flush()
+
+    def close(self):
+        self.traces_file.close()
+        self.times_file.close()
+        logger.info(f'TraceRecorder: recorded {self.n_traces} traces to {self.traces_path}')
+        return self.n_traces
+
+
+class TraceRecording:
+    '''
+    a recording opened for reading: traces (n_traces, trace_n_points) and times (time, end per blob) as read-only memory maps
+    '''
+    def __init__(self, path):
+        traces_path, times_path, metadata_path = recording_paths(path)
+        self.metadata = json.loads(metadata_path.read_text())
+        if self.metadata['trace_n_points'] != trace_n_points:
+            raise ValueError(f'TraceRecording: {traces_path} was recorded with {self.metadata["trace_n_points"]} points per trace, '
+                             f'not {trace_n_points} as set now')
+        dtype = np.dtype(self.metadata['dtype'])
+
+        # blobs that were not completely written (when recording was cut short) are left out
+        times = self._memmap(times_path, times_dtype, ())
+        n_traces = traces_path.stat().st_size // (trace_n_points * dtype.itemsize)
+        self.times = times[:np.searchsorted(times['end'], n_traces, side='right')]
+        self.n_traces = int(self.times['end'][-1]) if len(self.times) else 0
+        self.traces = self._memmap(traces_path, dtype, (trace_n_points,))[:self.n_traces]
+        self.start = float(self.times['time'][0]) if len(self.times) else 0. # when the first blob was read out
+        self.duration = float(self.times['time'][-1]) - self.start if len(self.times) else 0.
+
+    @staticmethod
+    def _memmap(path, dtype, record_shape):
+        n = path.stat().st_size // (dtype.itemsize * int(np.prod(record_shape, dtype=int)))
+        if n == 0:
+            return np.zeros((0,) + record_shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(n,) + record_shape)
+
+    def traces_until(self, recording_time):
+        '''the number of traces read out by recording_time seconds'''
+        n_blobs = np.searchsorted(self.times['time'], recording_time, side='right')
+        return int(self.times['end'][n_blobs - 1]) if n_blobs else 0
+
+    def time_at(self, n_traces):
+        '''the time by which the first n_traces traces had been read out'''
+        n_blobs = np.searchsorted(self.times['end'], n_traces, side='left')
+        return float(self.times['time'][min(n_blobs, len(self.times) - 1)]) if len(self.times) else 0.
@@ -12,68 +12,25 @@ import platform
 import shutil
 
 from PySide6.QtCore import Qt
-from PySide6.QtGui import QIcon
-from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QIcon, QPixmap
+from PySide6.QtWidgets import QApplication, QSplashScreen
 import multiprocessing as mp
-from multiprocessing import shared_memory, Lock
-import numpy as np
 
 from honeychrome import __version__
 from honeychrome.settings import experiments_folder, send_debug_data
 from honeychrome.settings import q_settings as q_settings_app_config
-
-current_file_path = Path(__file__).resolve()
-
-'''
-Instrument Communicator:
--Connects to instrument
--Configures instrument
--Listens for start event
--Listens for stop event
-'''
-from honeychrome.instrument_communicator import Instrument
-
-'''
-Trace Analyser:
--Listens for start event
--Consumes cached traces
--Calculates peak height, area, width (according to settings) and adds to events cache 
--Copies latest trace with peak measurements
--Signals when new events chunk is ready
-'''
-from honeychrome.trace_analyst import TraceAnalyser
-
-
-'''
-Controller:
--Initialises Experiment Model
--Creates new experiment
--Loads saved experiment
--Loads sample
--Creates live sample and carries out live analysis
--Sends and receives signals to GUI
-'''
-from honeychrome.controller import Controller
-
-'''
-View:
--Creates GUI widgets
--Serves and updates data from controller
---sample list
---settings
---plots
---histograms
---gates
---spectral model
---instrument control
---oscilloscope
-'''
-from honeychrome.view import View, logo_icon
+from honeychrome.controller_components.timing import PhaseTimer
 
 import logging
 import warnings
-import sentry_sdk
-from sentry_sdk.integrations.logging import LoggingIntegration
+
+# the phases of starting up, timed from here (logged as the startup report); the controller and view, with flowkit,
+# pandas, pyqtgraph and the rest, are only imported in main once the first window is showing, and sentry on its own thread
+startup = PhaseTimer()
+
+current_file_path = Path(__file__).resolve()
+assets_path = current_file_path.parent / 'view_components' / 'assets'
+logo_icon = str(assets_path / 'cytkit_web_logo.ico')
 
 def setup_logging(log_file):
     """Set up logging to both console and file, and capture all output."""
@@ -128,6 +85,8 @@ def configure_multiprocessing():
 
 def init_sentry():
     try:
+        import sentry_sdk
+        from sentry_sdk.integrations.logging import LoggingIntegration
 
         sentry_logging = LoggingIntegration(
             level=logging.INFO,  # Send INFO and above as breadcrumbs (context)
@@ -150,6 +109,32 @@ def init_sentry():
         pass  # Sentry must never crash or stall the app
 
 
+def show_first_window(argv):
+    '''create the application and show a splash screen while the rest loads; returns (app, splash)'''
+    QApplication.setAttribute(Qt.ApplicationAttribute.AA_ShareOpenGLContexts, True)
+    app = QApplication(argv)
+
+    if sys.platform == 'win32':
+        import ctypes
+        myappid = f'honeychrome.cytometry.v{__version__}'
+        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+
+    # Use Fusion style (works consistently across platforms)
+    app.setStyle("Fusion")
+    # Ensure consistent rounding of fractional scaling factors
+    os.environ["QT_SCALE_FACTOR_ROUNDING_POLICY"] = "PassThrough"
+
+    # app.setWindowIcon(QIcon(str(Path(__file__).resolve().parent / 'view_components' / 'assets' / 'cytkit_web_logo.ico')))
+    app.setWindowIcon(QIcon(logo_icon))
+    app.setDesktopFileName("honeychrome")
+
+    splash = QSplashScreen(QPixmap(str(assets_path / 'cytkit_web_logo.png')))
+    splash.show()
+    splash.showMessage(f'Honeychrome v{__version__}: loading...', Qt.AlignmentFlag.AlignBottom | Qt.AlignmentFlag.AlignHCenter)
+    app.processEvents()
+    return app, splash
+
+
 def main():
     configure_multiprocessing()
 
@@ -190,90 +175,70 @@ def main():
     '''
     define objects for communication between processes
     '''
-    from honeychrome.settings import traces_cache_size, traces_cache_dtype
-    from honeychrome.settings import max_events_in_cache, n_channels_per_event
+    from honeychrome.settings import channel_dict
+    from honeychrome.controller_components.shared_ring import create_traces_ring, create_events_ring
+    from honeychrome.controller_components.oscilloscope_slot import OscilloscopeSlot
+    from honeychrome.controller_components.wakeup import Wakeup
     import honeychrome.settings as settings
 
-    # Allocate shared memory block, plus head and tail indices
-    traces_cache_shm = shared_memory.SharedMemory(create=True, size=np.zeros(traces_cache_size, dtype=traces_cache_dtype).nbytes)
-    traces_cache_lock = Lock()
-    index_head_traces_cache = mp.Value('i', 0)
-    index_tail_traces_cache = mp.Value('i', 0)
-
-    events_cache_shm = shared_memory.SharedMemory(create=True,
-                                                  size=np.zeros((max_events_in_cache, n_channels_per_event),
-                                                                dtype=np.int_).nbytes)
-    events_cache_lock = Lock()
-    index_head_events_cache = mp.Value('i', 0)
-    index_tail_events_cache = mp.Value('i', 0)
-
-    # oscilloscope traces
-    oscilloscope_traces_queue = mp.Queue()
+    # traces cache (instrument -> analyser) and events cache (analyser -> controller), in shared memory
+    traces_ring = create_traces_ring()
+    events_ring = create_events_ring(channel_dict['event_channels_pnn'])
+
+    # oscilloscope trace
+    oscilloscope_slot = OscilloscopeSlot()
+    # wakeups: instrument -> analyser -> controller
+    traces_ready = Wakeup()
+    events_ready = Wakeup()
     # command pipes
     pipe_experiment_instrument_e, pipe_experiment_instrument_i = mp.Pipe()
     pipe_experiment_analyser_e, pipe_experiment_analyser_a = mp.Pipe()
 
     '''
-    start instrument driver
-    '''
-    instrument = Instrument(
-        use_dummy_instrument=settings.use_dummy_instrument_retrieved,
-        traces_cache_name=traces_cache_shm.name,
-        traces_cache_lock=traces_cache_lock,
-        index_head_traces_cache=index_head_traces_cache,
-        index_tail_traces_cache=index_tail_traces_cache,
-        pipe_connection=pipe_experiment_instrument_i
-    )
-    instrument.start()
-
-    '''
-    start trace analyser
-    '''
-    trace_analyser = TraceAnalyser(
-        traces_cache_name=traces_cache_shm.name,
-        traces_cache_lock=traces_cache_lock,
-        index_head_traces_cache=index_head_traces_cache,
-        index_tail_traces_cache=index_tail_traces_cache,
-        events_cache_name=events_cache_shm.name,
-        events_cache_lock=events_cache_lock,
-        index_head_events_cache=index_head_events_cache,
-        index_tail_events_cache=index_tail_events_cache,
-        oscilloscope_traces_queue=oscilloscope_traces_queue,
-        pipe_connection=pipe_experiment_analyser_a
-    )
-    trace_analyser.start()
-
+    Instrument Communicator:
+    -Connects to instrument
+    -Configures instrument
+    -Listens for start event
+    -Listens for stop event
+
+    Trace Analyser:
+    -Listens for start event
+    -Consumes cached traces
+    -Calculates peak height, area, width (according to settings) and adds to events cache
+    -Copies latest trace with peak measurements
+    -Signals when new events chunk is ready
+
+    both are started before the application is created, so that they are not forked from a process running Qt
     '''
-    start controller
-    '''
-    controller = Controller(
-            events_cache_name=events_cache_shm.name,
-            events_cache_lock=events_cache_lock,
-            index_head_events_cache=index_head_events_cache,
-            index_tail_events_cache=index_tail_events_cache,
-            oscilloscope_traces_queue=oscilloscope_traces_queue,
-            pipe_connection_instrument=pipe_experiment_instrument_e,
-            pipe_connection_analyser=pipe_experiment_analyser_e)
+    with startup.phase('import_processes'):
+        from honeychrome.instrument_communicator import Instrument
+        from honeychrome.trace_analyst import TraceAnalyser
+
+    with startup.phase('start_processes'):
+        instrument = Instrument(
+            use_dummy_instrument=settings.use_dummy_instrument_retrieved,
+            traces_ring=traces_ring,
+            traces_ready=traces_ready,
+            pipe_connection=pipe_experiment_instrument_i
+        )
+        instrument.start()
+
+        trace_analyser = TraceAnalyser(
+            traces_ring=traces_ring,
+            events_ring=events_ring,
+            oscilloscope_slot=oscilloscope_slot,
+            traces_ready=traces_ready,
+            events_ready=events_ready,
+            pipe_connection=pipe_experiment_analyser_a
+        )
+        trace_analyser.start()
 
     '''
-    start application and view
+    start application, with a splash screen while the controller and view load
     '''
-    QApplication.setAttribute(Qt.ApplicationAttribute.AA_ShareOpenGLContexts, True)
-    app = QApplication(sys.argv)
-
-    if sys.platform == 'win32':
-        import ctypes
-        myappid = f'honeychrome.cytometry.v{__version__}'
-        ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
-
-    # Use Fusion style (works consistently across platforms)
-    app.setStyle("Fusion")
-    # Ensure consistent rounding of fractional scaling factors
-    os.environ["QT_SCALE_FACTOR_ROUNDING_POLICY"] = "PassThrough"
-
-    # app.setWindowIcon(QIcon(str(Path(__file__).resolve().parent / 'view_components' / 'assets' / 'cytkit_web_logo.ico')))
-    app.setWindowIcon(QIcon(logo_icon))
-    app.setDesktopFileName("honeychrome")
+    with startup.phase('first_window'):
+        app, splash = show_first_window(sys.argv)
+    startup.mark('first_window')
 
     # # debug space usage by highlighting
     # app.setStyleSheet("""
@@ -296,10 +261,51 @@ def main():
     #     }
     # """)
 
-    view = View(
-        controller=controller
-    )
-    controller.bus = view.bus # connect signals coming from controller
+    '''
+    Controller:
+    -Initialises Experiment Model
+    -Creates new experiment
+    -Loads saved experiment
+    -Loads sample
+    -Creates live sample and carries out live analysis
+    -Sends and receives signals to GUI
+    '''
+    with startup.phase('import_controller'):
+        from honeychrome.controller import Controller
+    app.processEvents()
+    with startup.phase('controller'):
+        controller = Controller(
+                events_ring=events_ring,
+                oscilloscope_slot=oscilloscope_slot,
+                events_ready=events_ready,
+                pipe_connection_instrument=pipe_experiment_instrument_e,
+                pipe_connection_analyser=pipe_experiment_analyser_e)
+    app.processEvents()
+
+    '''
+    View:
+    -Creates GUI widgets
+    -Serves and updates data from controller
+    --sample list
+    --settings
+    --plots
+    --histograms
+    --gates
+    --spectral model
+    --instrument control
+    --oscilloscope
+    '''
+    with startup.phase('import_view'):
+        from honeychrome.view import View
+    app.processEvents()
+    with startup.phase('view'):
+        view = View(
+            controller=controller
+        )
+        controller.bus = view.bus # connect signals coming from controller
+    splash.finish(view.current_window)
+    startup.mark('main_window')
+    logger.info(f'Startup: {startup.summary()}')
 
     '''
     start QT application
@@ -312,10 +318,12 @@ def main():
     controller.quit_instrument_quit_analyser()
     trace_analyser.join()
     instrument.join()
-    traces_cache_shm.close()
-    events_cache_shm.close()
-    traces_cache_shm.unlink()
-    events_cache_shm.unlink()
+    traces_ring.close()
+    events_ring.close()
+    traces_ring.unlink()
+    events_ring.unlink()
+    oscilloscope_slot.close()
+    oscilloscope_slot.unlink()
 
     sys.exit(exit_code)
 
@@ -1,6 +1,7 @@
 '''
 These are the default settings for the honeychrome software
 '''
+import os
 from PySide6.QtCore import QSettings
 
 ### instrument settings
@@ -16,6 +17,21 @@ max_event_time = 120  # [us]
 deltaT = 1/adc_rate # [us]
 adc_scale_mv = 30 # the adc level for 1 mV
 
+### synthetic instrument (load testing): add 'synthetic_device' to devices_boot_order, or pass it to Instrument as boot_order
+synthetic_event_rate = 100_000 # events/s, Poisson arrivals
+synthetic_noise_mv = 3 # rms noise on every channel
+synthetic_coincidence = 0.01 # fraction of events with a second particle in the trace window
+synthetic_populations = [ # fraction of events, pulse height in mV per channel (others 0), cv of the heights, pulse width (sd) in us
+    {'fraction': 0.5, 'heights': {'FSC': 1200, 'SSC': 400, 'B3': 800, 'B4': 500, 'B5': 200}, 'cv': 0.15, 'width_us': 5},
+    {'fraction': 0.3, 'heights': {'FSC': 900, 'SSC': 250, 'B8': 1200, 'B9': 700, 'B10': 300}, 'cv': 0.2, 'width_us': 4},
+    {'fraction': 0.2, 'heights': {'FSC': 400, 'SSC': 900, 'B1': 60, 'B2': 60}, 'cv': 0.3, 'width_us': 3},
+]
+
+### replay instrument (reanalysis and benchmarking): add 'replay_device' to devices_boot_order, or pass it to Instrument as boot_order
+replay_recording = None # path of the trace recording to replay (recorded with the instrument's record command)
+replay_speed = 1. # times real time, or None for as fast as the traces cache takes the traces
+replay_max_events_per_read = 20_000 # traces read out at once when replaying as fast as possible
+
 ### peak detection settings
 trigger_channel = 'FSC'
 FSC_sense = -1
@@ -53,7 +69,9 @@ metadata_sample_name_sources = ['tubename', 'fil']
 library_file = 'spectral_controls_library.db'
 
 ### define default channels for trace analyser and experiment model - these should match the channels in the instrument
-max_events_in_cache = 10_000_000
+max_events_in_cache = 1_000_000 # ring of the most recent live events, older events are spilled to disk
+live_window_events = max_events_in_cache // 2 # the most live events copied for display in one update
+events_cache_layout = 'compact' # record layout of the events cache: 'compact' (uint32 Time in ms and event_id, float32 measurements) or 'int64'
 adc_channels = ['FSC', 'SSC', 'B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B9', 'B10', 'B11', 'B12', 'B13', 'B14']
 area_channels = ['FSC', 'SSC', 'B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B9', 'B10', 'B11', 'B12', 'B13', 'B14'] # make sure there is equal number to n_channels_trace in instrument config
 height_channels = ['FSC']
@@ -91,11 +109,25 @@ QLabel {
 }
 """
 live_data_process_repeat_time = 0.5 #s
+live_min_batch_events = 2_000 # the fewest new events the live display waits for before updating...
+live_max_batch_wait = 0.05 # ...or this many seconds after the first new event (the target update interval, see LiveUpdateScheduler)
+live_update_utilisation = 0.8 # fraction of the time live updates may spend processing events
+live_lag_warning = 1.0 # seconds the live display may lag behind acquisition before it is reported
 hist_bins = 200 # for displaying histograms
 label_offset_default = (0, -0.03) # for gate labels
 subsample = 10_000 # for exporting FCS files
 max_display_events = 500_000  # cap on events shown in cytometry display plots (None = no cap)
 density_cutoff = 1 # bin count to set to first level of colourmap in 2d histograms (below this level is transparent)
+statistics_max_workers = max(1, min(8, (os.cpu_count() or 1) - 1)) # worker processes for batch statistics (1 = calculate in-process)
+nxn_max_workers = max(1, min(8, os.cpu_count() or 1)) # threads counting and rendering NxN process plot tiles
+af_unmixing_max_workers = max(1, min(8, os.cpu_count() or 1)) # threads unmixing AF chunks with the NumPy scoring (the C kernel is parallel itself, so runs in one)
+nxn_tile_cache_bytes = 128 * 2**20 # rendered NxN tile images kept in memory
+timing_spans = False # time the processing stages (see controller_components.timing) and show them in the status bar...
+timing_trace = False # ...and keep every span to write as a Chrome trace to the experiment cache when it is saved
+timing_trace_max_events = 100_000 # spans kept for the trace (the oldest are dropped)
+memory_budget_mb = 0 # memory the loaded sample's data, plots and caches may use (see controller_components.memory_accountant), 0 = automatic...
+memory_budget_fraction = 0.5 # ...this fraction of physical memory
+memory_min_display_events = 50_000 # the display cap is not lowered below this to keep to the memory budget
 
 line_colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf',
           '#aec7e8', '#ffbb78', '#98df8a', '#ff9896', '#c5b0d5', '#c49c94', '#f7b6d2', '#c7c7c7', '#dbdb8d', '#9edae5',
@@ -132,6 +164,21 @@ channel_dict = {'adc_channels': adc_channels, 'trigger_channel': trigger_channel
 
 ### settings for trace analyser
 analyser_target_repeat_time = 0.25 # seconds
+analyser_n_workers = max(1, min(8, (os.cpu_count() or 1) - 2)) # worker processes analysing traces (1 = analyse in the trace analyser process)
+analyser_max_slice_events = 4096 # traces claimed at once by one analyser worker
+analyser_worker_stop_timeout = 10 # seconds to wait for analyser workers to finish their last slice when stopping
+analyser_min_batch_traces = 1_000 # the analyser wakes as soon as this many traces are waiting...
+analyser_max_batch_wait = 0.02 # ...or this many seconds after the first trace arrives, whichever is sooner
+injector_interval = 0.01 # seconds between batches of events written by the event injector (benchmarking the live path)
+injector_rates = [10_000, 20_000, 50_000, 100_000, 200_000, 500_000, 1_000_000] # events/s tried in turn by benchmark_live_path...
+injector_duration = 3 # ...for this many seconds each
+
+### settings for the offline benchmarks (python -m honeychrome.benchmarks)
+benchmark_sizes = [100_000, 1_000_000, 10_000_000] # events in the synthetic samples timed in turn...
+benchmark_n_detectors = 32 # ...on a synthetic spectral cytometer with this many fluorescence detectors,
+benchmark_n_fluorophores = 12 # this many fluorophores in the panel
+benchmark_n_af = 3 # and this many autofluorescence spectra
+benchmark_n_export_samples = 3 # samples unmixed and written out by the batch export stage
 
 ### define settings for experiment model
 time_channel_id = event_channels_pnn.index('Time')
@@ -246,6 +293,7 @@ subsample_retrieved = q_settings.value("subsample_number", subsample, type=int)
 max_display_events = q_settings.value("max_display_events", max_display_events, type=int)
 hist_bins_retrieved = q_settings.value("histogram_resolution", hist_bins, type=int)
 density_cutoff_retrieved = q_settings.value("density_cutoff", density_cutoff, type=int)
+statistics_max_workers_retrieved = q_settings.value("statistics_max_workers", statistics_max_workers, type=int)
 
 trigger_channel_retrieved = str(q_settings.value("trigger_channel", trigger_channel))  # there can only be one trigger channel
 width_channel_retrieved = str(q_settings.value("width_channel", width_channels[0]))  # there can be more than one width channel, but currently only allowing one
@@ -260,4 +308,8 @@ spectral_cleaning_n_spectral_retrieved = q_settings.value("spectral_cleaning_n_s
 
 report_include_raw_retrieved = q_settings.value("report_include_raw", report_include_raw, type=bool)
 report_include_unmixed_retrieved = q_settings.value("report_include_unmixed", report_include_unmixed, type=bool)
-report_include_process_retrieved = q_settings.value("report_include_process", report_include_process, type=bool)
\ No newline at end of file
+report_include_process_retrieved = q_settings.value("report_include_process", report_include_process, type=bool)
+
+timing_spans_retrieved = q_settings.value("timing_spans", timing_spans, type=bool)
+timing_trace_retrieved = q_settings.value("timing_trace", timing_trace, type=bool)
+memory_budget_mb_retrieved = q_settings.value("memory_budget_mb", memory_budget_mb, type=int)
\ No newline at end of file
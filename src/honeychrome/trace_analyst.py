@@ -2,20 +2,28 @@
 Trace Analyser:
 -Listens for start event
 -Consumes cached traces
--Calculates peak height, area, width (according to settings) and adds to events cache
+-Calculates peak height, area, width (according to settings) and adds to events cache (a SharedRing: events are only
+ overwritten once spilled to disk by the controller, or read by it if nothing spills)
 -Copies latest trace with peak measurements
 -Signals when new events chunk is ready
 '''
 
 import multiprocessing as mp
-from multiprocessing import shared_memory, Lock
 import threading
+from queue import Empty
 import numpy as np
 import time
-import warnings
 
-from honeychrome.settings import traces_cache_size, traces_cache_size, max_events_in_traces_cache, trace_n_points, n_channels_trace, adc_rate, threshold, n_time_points_in_event, window_extension_length_pre, baseline_decay_rate, window_extension_length_post, timeout_length, deltaT, adc_scale_mv, nearly_floor_uint16
-from honeychrome.settings import max_events_in_cache, n_channels_per_event, channel_dict, event_channels_pnn, analyser_target_repeat_time
+from honeychrome.settings import trace_n_points, n_channels_trace, adc_rate, threshold, n_time_points_in_event, window_extension_length_pre, baseline_decay_rate, window_extension_length_post, timeout_length, deltaT, adc_scale_mv, nearly_floor_uint16
+from honeychrome.settings import n_channels_per_event, channel_dict, event_channels_pnn, analyser_target_repeat_time
+from honeychrome.settings import analyser_n_workers, analyser_max_slice_events, analyser_worker_stop_timeout, analyser_min_batch_traces, analyser_max_batch_wait
+from honeychrome.controller_components.events_spill import events_cache_dtype
+from honeychrome.controller_components.oscilloscope_slot import OscilloscopeSlot
+from honeychrome.controller_components.wakeup import Wakeup
+from honeychrome.controller_components.shared_ring import create_traces_ring, create_events_ring
+
+import logging
+logger = logging.getLogger(__name__)
 
 baseline_length = int(1/baseline_decay_rate)
 gap = 10 # gap between start of end of baseline and start of peak
@@ -64,40 +72,118 @@ def peak_measurements(tr, n_start, n_end, deltaT, area_indices, height_indices):
 
     return peak, baselines
 
+def peak_start_stop_baseline_batch(trs):
+    '''
+    peak_start_stop_baseline for a whole block of trigger traces (n_traces, n_time_points) at once
+    the baseline before each sample is an exponential moving average (a linear filter over the samples window_extension_length_pre
+    behind), the peak starts at the first sample above baseline + threshold, and the end is resolved from the first sample
+    back below threshold after that: countdown expiry, timeout or end of trace, whichever comes first
+    returns n_start, n_end (int arrays, n_start=0 where no peak) and the baselines (frozen at the threshold crossing)
+    '''
+    from scipy.signal import lfilter # imported here so that starting the app does not wait for scipy
+
+    trs = np.asarray(trs)
+    n_traces, n_points = trs.shape
+    rows = np.arange(n_traces)
+    n_steps = n_points - window_extension_length_pre
+
+    # baselines[:, k] is the baseline after k updates, i.e. at sample n = window_extension_length_pre + k
+    baseline_0 = trs[:, gap:baseline_length].mean(axis=1).astype(np.float64)
+    ema, _ = lfilter([baseline_decay_rate], [1, -(1 - baseline_decay_rate)], trs[:, :n_steps], axis=1,
+                     zi=(1 - baseline_decay_rate) * baseline_0[:, None])
+    baselines = np.concatenate((baseline_0[:, None], ema), axis=1)
+
+    above = trs[:, window_extension_length_pre:] - baselines[:, :n_steps] > threshold * 1000
+    has_peak = above.any(axis=1)
+    k_cross = np.argmax(above, axis=1)
+    n_cross = window_extension_length_pre + k_cross
+    baseline = np.where(has_peak, baselines[rows, k_cross], baselines[:, n_steps])
+    n_start = np.where(has_peak, n_cross - window_extension_length_pre, 0)
+
+    # countdown starts at the first sample after the crossing that is back below threshold (against the frozen baseline)
+    below = trs - baseline[:, None] <= threshold * 1000
+    below[np.arange(n_points)[None, :] <= n_cross[:, None]] = False
+    has_fall = below.any(axis=1)
+    n_fall = np.argmax(below, axis=1)
+    countdown = window_extension_length_pre + window_extension_length_post
+    n_end_fall = np.minimum(np.minimum(n_fall + countdown - 1, np.maximum(n_fall, n_start + timeout_length + window_extension_length_pre)), n_points - 1)
+    n_end = np.where(has_peak & has_fall, n_end_fall, n_points - 1)
+
+    return n_start, n_end, baseline
+
+def peak_measurements_batch(trs, n_start, n_end, deltaT, area_indices, height_indices, chunk_size=2048):
+    '''
+    peak_measurements for a block of traces (n_traces, n_channels, n_time_points) with per-trace windows n_start:n_end
+    window and baseline sums come from one batched product with per-trace window masks, so the windows need not be the same length
+    returns (areas, heights, widths, centres), baselines
+    '''
+    trs = np.asarray(trs)
+    n_start, n_end = np.asarray(n_start), np.asarray(n_end)
+    chunks = [_peak_measurements_chunk(trs[i:i + chunk_size], n_start[i:i + chunk_size], n_end[i:i + chunk_size], area_indices, height_indices)
+              for i in range(0, len(trs), chunk_size)]
+    if not chunks:
+        n_channels = trs.shape[1]
+        chunks = [(np.zeros((0, int(np.sum(area_indices)))), np.zeros((0, int(np.sum(height_indices)))), np.zeros((0, n_channels)))]
+    areas, heights, baselines = (np.concatenate(parts) for parts in zip(*chunks))
+    widths = (n_end - n_start) * deltaT * 1000 # width in nanoseconds
+    centres = (n_start + n_end) * 0.5
+    return (areas, heights, widths, centres), baselines
+
+def _peak_measurements_chunk(trs, n_start, n_end, area_indices, height_indices):
+    n_traces, n_channels, n_points = trs.shape
+    samples = np.arange(n_points)[None, :]
+
+    # baseline windows as the slices [gap:n_start-gap] and [n_end-gap:] (negative stops count from the end, as in slicing)
+    stop_before = n_start - gap
+    stop_before = np.where(stop_before < 0, stop_before + n_points, stop_before)[:, None]
+    start_after = n_end - gap
+    start_after = np.where(start_after < 0, start_after + n_points, start_after)[:, None]
+    in_window = (samples >= n_start[:, None]) & (samples < n_end[:, None])
+
+    # window and baseline sums of every channel in one batched matrix product
+    weights = np.empty((n_traces, n_points, 2), dtype=trs.dtype)
+    weights[:, :, 0] = in_window
+    weights[:, :, 1] = (samples >= gap) & (samples < stop_before)
+    weights[:, :, 1] += samples >= start_after # the two windows overlap if the stop wrapped round
+    sums = np.matmul(trs, weights).astype(np.float64)
+    baselines = sums[:, :, 1] / weights[:, :, 1].sum(axis=1, dtype=np.float64)[:, None]
+
+    areas = sums[:, area_indices, 0] - baselines[:, area_indices] * (n_end - n_start)[:, None]
+    heights = np.where(in_window[:, None, :], trs[:, height_indices, :], -np.inf).max(axis=2) - baselines[:, height_indices]
+    return areas, heights, baselines
+
 class TraceAnalyser(mp.Process):
+    '''
+    analyses traces from the traces ring into events in the events ring (SharedRing: the analyser releases traces by advancing
+    the traces head, and is the producer of events)
+    with n_workers > 1, each acquisition is analysed by a pool of TraceAnalysisWorker processes instead of a thread in this
+    process: workers claim disjoint slices of the traces ring (beyond the committed head), reserve the matching range of the
+    events ring in traces order and write their events there, and the coordinator thread here commits traces head and events
+    tail as soon as the slices before them are complete - so events keep the order and event_ids of single-process analysis
+    '''
     def __init__(self,
-                 traces_cache_name=None,
-                 traces_cache_lock=None,
-                 index_head_traces_cache=None,
-                 index_tail_traces_cache=None,
-                 events_cache_name=None,
-                 events_cache_lock=None,
-                 index_head_events_cache=None,
-                 index_tail_events_cache=None,
-                 oscilloscope_traces_queue=None,
-                 pipe_connection=None):
+                 traces_ring=None,
+                 events_ring=None,
+                 oscilloscope_slot=None,
+                 traces_ready=None,
+                 events_ready=None,
+                 pipe_connection=None,
+                 n_workers=analyser_n_workers,
+                 max_slice_events=analyser_max_slice_events):
         super().__init__()
         # pipe connection
         self.pipe_connection = pipe_connection
 
-        # Traces cache
-        self.traces_cache = None
-        self.traces_cache_name = traces_cache_name
-        self.traces_cache_lock = traces_cache_lock
-        self.max_events_in_traces_cache = max_events_in_traces_cache
+        # Traces and events caches (shared memory rings, attached to in this process when it is started)
+        self.traces_ring = traces_ring
+        self.events_ring = events_ring
         self.trace_n_points = trace_n_points
         self.n_channels_trace = n_channels_trace
         self.n_time_points_in_event = int(trace_n_points//n_channels_trace)
 
-        # Events cache
-        self.events_cache = None
-        self.events_cache_name = events_cache_name
-        self.events_cache_lock = events_cache_lock
-        self.max_events_in_cache = max_events_in_cache
-        self.index_head_traces_cache = index_head_traces_cache
-        self.index_tail_traces_cache = index_tail_traces_cache
-        self.index_head_events_cache = index_head_events_cache
-        self.index_tail_events_cache = index_tail_events_cache
+        # wakeups: the instrument notifies traces_ready when it commits traces, the analyser notifies events_ready when it commits events
+        self.traces_ready = traces_ready if traces_ready is not None else Wakeup()
+        self.events_ready = events_ready if events_ready is not None else Wakeup()
 
         self.channel_dict = channel_dict
         self.adc_rate = adc_rate
@@ -110,23 +196,25 @@ class TraceAnalyser(mp.Process):
         self.indices_area_channels_in_events = None
         self.indices_height_channels_in_events = None
         self.n_channels_per_event = None
+        self.events_cache_dtype = None
         self.set_channels()
 
-        # Oscilloscope traces queue
-        self.oscilloscope_traces_queue = oscilloscope_traces_queue
+        # Oscilloscope slot (shared memory, attached to in this process when it is started)
+        self.oscilloscope_slot = oscilloscope_slot
+
+        # Worker pool (created in run, when the analyser process is up)
+        self.n_workers = max(1, n_workers)
+        self.max_slice_events = max_slice_events
+        self.workers = []
+        self.start_time = None
 
 
     def run(self):
         # initialise the things that can't be pickled
         self.stop_analyser = threading.Event()
 
-        # Attach to existing shared memory
-        shm_traces = shared_memory.SharedMemory(name=self.traces_cache_name)
-        with self.traces_cache_lock:
-            self.traces_cache = np.ndarray((self.max_events_in_traces_cache * self.trace_n_points), dtype=np.uint16, buffer=shm_traces.buf)
-        shm_events = shared_memory.SharedMemory(name=self.events_cache_name)
-        with self.events_cache_lock:
-            self.events_cache = np.ndarray((self.max_events_in_cache, self.n_channels_per_event), dtype=np.int64, buffer=shm_events.buf)
+        if self.n_workers > 1:
+            self.create_worker_pool()
 
         # create analysis thread
         thread = threading.Thread(
@@ -143,61 +231,63 @@ class TraceAnalyser(mp.Process):
                 break
 
             if incoming_from_experiment_control['command'] == 'start':
-                # reset events cache to zeros
-                with self.events_cache_lock:
-                    self.events_cache[:] = 0
-                with self.index_head_events_cache.get_lock():
-                    self.index_head_events_cache.value = 0
-                with self.index_tail_events_cache.get_lock():
-                    self.index_tail_events_cache.value = 0
+                # reset events cache to zeros (once the previous analysis has ended)
+                self.wait_for_analysis_thread(thread)
+                self.events_ring.records[:] = 0
+                self.events_ring.reset()
                 print('[Trace Analyser] Events cache flushed!')
                 self.set_channels()
-                while thread.is_alive():
-                    print('[Trace Analyser] Waiting until previous analysis thread ends')
-                    time.sleep(0.25)
-                # create analysis thread
+                # create analysis thread (or the coordinator of the worker pool)
                 thread = threading.Thread(
-                    target=self.analyse,
+                    target=self.analyse if self.n_workers == 1 else self.coordinate,
                     daemon=True
                 )
+                if self.n_workers > 1:
+                    self.start_workers()
                 thread.start()
                 print('[Trace Analyser] Started')
                 response_to_experiment_control = {'status': 'OK', 'message': '[Trace Analyser] started'}
 
             elif incoming_from_experiment_control['command'] == 'stop':
                 self.stop_analyser.set()
-                while thread.is_alive():
-                    print('[Trace Analyser] Waiting until analysis thread ends')
-                    time.sleep(0.25)
+                self.wait_for_analysis_thread(thread)
                 response_to_experiment_control = {'status':'OK', 'message':'[Trace Analyser] stopped'}
 
             elif incoming_from_experiment_control['command'] == 'set_channels':
                 self.channel_dict = incoming_from_experiment_control['data']
                 self.stop_analyser.set()
-                while thread.is_alive():
-                    print('[Trace Analyser] Waiting until analysis thread ends')
-                    time.sleep(0.25)
+                self.wait_for_analysis_thread(thread)
                 self.set_channels()
                 print('[Trace Analyser] Channel configuration set')
                 response_to_experiment_control = {'status':'OK', 'message':'[Trace Analyser] channel configuration set'}
 
             elif incoming_from_experiment_control['command'] == 'quit':
                 self.stop_analyser.set()
-                while thread.is_alive():
-                    print('[Trace Analyser] Waiting until analysis thread ends')
-                    time.sleep(0.25)
+                self.wait_for_analysis_thread(thread)
                 response_to_experiment_control = {'status':'OK', 'message':'[Trace Analyser] quitting'}
                 self.pipe_connection.send(response_to_experiment_control)
                 break
 
             self.pipe_connection.send(response_to_experiment_control)
 
-        shm_traces.close()
-        shm_events.close()
-        self.oscilloscope_traces_queue.cancel_join_thread()
+        self.traces_ring.close()
+        self.events_ring.close()
+        self.oscilloscope_slot.close()
         print('[Trace Analyser] Quit')
 
 
+    def wait_for_analysis_thread(self, thread):
+        # wake the analysis thread (or coordinator), which stops if stop_analyser is set, and wait until it ends
+        if thread.is_alive():
+            print('[Trace Analyser] Waiting until analysis thread ends')
+            self.traces_ready.notify()
+            thread.join()
+
+    def n_traces_waiting(self):
+        # traces published by the instrument and not yet analysed
+        traces_head = self.traces_ring.cursor('head')
+        return self.traces_ring.cursor('tail') - traces_head
+
     def set_channels(self):
         adc_channels, trigger_channel, area_channels, height_channels, width_channels, scatter_channels, fluorescence_channels, event_channels_pnn, n_channels_per_event = self.channel_dict.values()
 
@@ -210,97 +300,105 @@ class TraceAnalyser(mp.Process):
         self.indices_area_channels_in_events = [event_channels_pnn.index(c + '-A') for c in area_channels]
         self.indices_height_channels_in_events = [event_channels_pnn.index(c + '-H') for c in height_channels]
         self.n_channels_per_event = n_channels_per_event
+        self.events_cache_dtype = events_cache_dtype(event_channels_pnn)
+
+    def read_traces(self, traces_head, traces_tail):
+        # traces traces_head:traces_tail of the ring, zeroed and scaled in uV as float32 (n_traces, n_channels_trace, n_time_points_in_event)
+        # scaled straight from the ring: the traces are released (head advanced) only once they have been analysed
+        traces, _ = self.traces_ring.read(traces_head, traces_tail, convert=self.scale_traces)
+        return traces
+
+    def scale_traces(self, blob_np):
+        return (blob_np  - nearly_floor_uint16).reshape(-1, self.n_channels_trace, self.n_time_points_in_event).astype(np.float32)/adc_scale_mv*1000 # now scale in uV, zeroed, float32
+
+    def measure(self, traces_batch_scaled):
+        '''
+        detect and measure peaks in a block of scaled traces
+        returns kept (indices of traces with a peak), (areas, heights, widths, centres) of the kept traces, and the oscilloscope
+        view of the last kept trace (None if there is none)
+        '''
+        ### Simple calculation - if peaks already filtered and background-subtracted
+        # areas = traces_batch_scaled[:, self.indices_area_channels_in_traces, :].sum(axis=2)
+        # heights = traces_batch_scaled[:, self.indices_height_channels_in_traces, :].max(axis=2)
+        # widths = self.calculate_width(traces_batch_scaled[:, self.indices_trigger_channel_in_traces, :])
+
+        ### More sophisticated calculation - background subtraction per trace, detected and measured for the whole batch at once
+        n_start, n_end, tr_baselines = peak_start_stop_baseline_batch(traces_batch_scaled[:, self.indices_trigger_channel_in_traces, :])
+        kept = np.flatnonzero(n_start > 0)
+        peaks, all_baselines = peak_measurements_batch(
+            traces_batch_scaled[kept], n_start[kept], n_end[kept], deltaT, self.indices_area_channels_in_traces, self.indices_height_channels_in_traces)
+        oscilloscope = None
+        if len(kept):
+            # peak measurements of the last event, for the oscilloscope
+            last_event_index = kept[-1]
+            oscilloscope = {'traces':traces_batch_scaled[last_event_index], 'n_start':n_start[last_event_index], 'n_end':n_end[last_event_index],
+                            'peak':tuple(measurement[-1] for measurement in peaks), 'baselines':all_baselines[-1]}
+        return kept, peaks, oscilloscope
+
+    def write_events(self, events_tail, peaks, n_new_events, event_time):
+        # write the measured events at events_tail (wrapping round the events cache), with event_ids continuing from events_tail
+        areas, heights, widths, centres = peaks
+        times = np.ones(n_new_events, dtype=np.int64) * event_time
+        event_ids = np.array(range(events_tail, events_tail + n_new_events))
+        rows = self.events_ring.rows(events_tail, events_tail + n_new_events)
+        events_cache = self.events_ring.records
+        fields = events_cache.dtype.names
+        for n, index in enumerate(self.indices_area_channels_in_events):
+            events_cache[fields[index]][rows] = areas[:, n]
+        for n, index in enumerate(self.indices_height_channels_in_events):
+            events_cache[fields[index]][rows] = heights[:, n]
+        events_cache[fields[self.index_width_channel_in_events]][rows] = widths
+        events_cache[fields[self.index_time_channel_in_events]][rows] = times
+        events_cache[fields[self.index_event_id_in_events]][rows] = event_ids
+
+        ### debug print latest events
+        #print(events_cache[rows])
+        return event_ids, times
 
     def analyse(self):
         start_time  = time.perf_counter()
         while True:
-            cycle_start_time = time.perf_counter()
-
             '''
             input cached traces
             for all new events, calculate area, height, width as specified in channel_dict, add all channels to events array as specified
             '''
-            with self.index_head_traces_cache.get_lock():
-                traces_head = self.index_head_traces_cache.value
-            with self.index_tail_traces_cache.get_lock():
-                traces_tail = self.index_tail_traces_cache.value
+            traces_head = self.traces_ring.cursor('head')
+            traces_tail = self.traces_ring.cursor('tail')
 
-            with self.index_head_events_cache.get_lock():
-                events_head = self.index_head_events_cache.value # not used - events cache is not cycled
-            with self.index_tail_events_cache.get_lock():
-                events_tail = self.index_tail_events_cache.value
+            events_head = self.events_ring.cursor('head') # for information - the controller may skip to the most recent events
+            events_tail = self.events_ring.cursor('tail')
 
             n_new_events = traces_tail - traces_head
             if traces_head < traces_tail:
-                queue_begin_index = traces_head % self.max_events_in_traces_cache
-                queue_end_index = traces_tail % self.max_events_in_traces_cache
-                slice_begin = queue_begin_index * self.trace_n_points
-                slice_end = queue_end_index * self.trace_n_points
-                with self.traces_cache_lock:
-                    if queue_end_index > queue_begin_index:
-                        blob_np = self.traces_cache[slice_begin:slice_end]
-                    else:
-                        blob_np_back = self.traces_cache[slice_begin:]  # put get back of queue array
-                        blob_np_front = self.traces_cache[:slice_end]  # get front of queue array
-                        blob_np = np.concatenate((blob_np_back, blob_np_front))
-
-                traces_batch_scaled = (blob_np  - nearly_floor_uint16).reshape(-1, self.n_channels_trace, self.n_time_points_in_event).astype(np.float32)/adc_scale_mv*1000 # now scale in uV, zeroed, float32
+                traces_batch_scaled = self.read_traces(traces_head, traces_tail)
 
                 # calculate area, height, width as defined in channel_dict and write to events_cache
+                kept, peaks, oscilloscope = self.measure(traces_batch_scaled)
+                n_new_events = len(kept)
 
-                ### Simple calculation - if peaks already filtered and background-subtracted
-                # areas = traces_batch_scaled[:, self.indices_area_channels_in_traces, :].sum(axis=2)
-                # heights = traces_batch_scaled[:, self.indices_height_channels_in_traces, :].max(axis=2)
-                # widths = self.calculate_width(traces_batch_scaled[:, self.indices_trigger_channel_in_traces, :])
-
-                ### More sophisticated calculation - loop over traces and perform background substraction
-                keep_mask = np.zeros(n_new_events, dtype=np.bool)
-                areas = np.zeros((n_new_events, len(self.indices_area_channels_in_events)))
-                heights = np.zeros((n_new_events, len(self.indices_height_channels_in_events)))
-                widths = np.zeros(n_new_events)
-                last_event_index = 0
-                for n, traces in enumerate(traces_batch_scaled):
-                    n_start, n_end, tr_baseline = peak_start_stop_baseline(traces[self.indices_trigger_channel_in_traces])
-                    if n_start > 0:
-                        peak, baselines = peak_measurements(traces, n_start, n_end, deltaT, self.indices_area_channels_in_traces, self.indices_height_channels_in_traces)
-                        areas[n], heights[n], widths[n], centre = peak
-                        keep_mask[n] = True
-                        last_event_index = n
-
-                # keep only the ones above threshold
-                areas = areas[keep_mask]
-                heights = heights[keep_mask]
-                widths = widths[keep_mask]
-                n_new_events = np.sum(keep_mask)
-
-                # if any above threshold, then push to events cache
-                if last_event_index > 0:
-                    times = np.ones(n_new_events, dtype=np.int64) * int((time.perf_counter() - start_time) * 1000)
-                    event_ids = np.array(range(events_tail, events_tail + n_new_events))
-                    with self.events_cache_lock:
-                        self.events_cache[events_tail:events_tail + n_new_events, self.indices_area_channels_in_events] = areas
-                        self.events_cache[events_tail:events_tail + n_new_events, self.indices_height_channels_in_events] = heights
-                        self.events_cache[events_tail:events_tail + n_new_events, self.index_width_channel_in_events] = widths
-                        self.events_cache[events_tail:events_tail + n_new_events, self.index_time_channel_in_events] = times
-                        self.events_cache[events_tail:events_tail + n_new_events, self.index_event_id_in_events] = event_ids
-
-                        ### debug print latest events
-                        #print(self.events_cache[events_tail:events_tail + n_new_events])
+                # if any above threshold, then push to events cache (once there is room in the ring), as the worker pool does
+                if n_new_events and n_new_events > self.events_ring.space(events_tail):
+                    print(f'[Trace Analyser] events cache full, waiting for events to be spilled (events cache tail:{events_tail})')
+                elif n_new_events:
+                    self.events_ring.advance('reserved', events_tail + n_new_events)
+                    event_ids, times = self.write_events(events_tail, peaks, n_new_events, int((time.perf_counter() - start_time) * 1000))
 
                     # update head of traces cache and tail of events cache
                     events_tail += n_new_events
                     print(f'[Trace Analyser] analysed {n_new_events} events (traces cache old head:{traces_head}, new head and tail:{traces_tail}), (events cache head:{events_head}, tail:{events_tail})')
                     traces_head = traces_tail
 
-                    with self.index_head_traces_cache.get_lock():
-                        self.index_head_traces_cache.value = traces_head
-                    with self.index_tail_events_cache.get_lock():
-                        self.index_tail_events_cache.value = events_tail
+                    self.traces_ring.advance('head', traces_head)
+                    self.events_ring.publish(events_tail)
+                    self.events_ready.notify()
 
-                    self.oscilloscope_traces_queue.put({'event_id':event_ids[-1], 'time':times[-1], 'traces':traces_batch_scaled[last_event_index], 'n_start':n_start, 'n_end':n_end, 'peak':peak, 'baselines':baselines})
+                    self.oscilloscope_slot.write({'event_id':event_ids[-1], 'time':times[-1]} | oscilloscope)
 
                 else:
-                    print(f'[Trace Analyser] {len(keep_mask)} traces returned but none above threshold')
+                    # release the traces anyway, or they would be analysed again on every loop until the traces cache fills
+                    print(f'[Trace Analyser] {len(traces_batch_scaled)} traces returned but none above threshold')
+                    traces_head = traces_tail
+                    self.traces_ring.advance('head', traces_head)
 
             else:
                 print(f'[Trace Analyser] awaiting traces (traces cache head:{traces_head}, tail:{traces_tail})')
@@ -308,17 +406,103 @@ class TraceAnalyser(mp.Process):
             # stop if stop analyser event is set
             if self.stop_analyser.is_set():
                 break
-            # stop if events cache full
-            if events_tail + n_new_events > self.max_events_in_cache:
-                warnings.warn("[Trace Analyser] Events cache is full, stopping trace analyser")
-                break
 
-            # Calculate elapsed time and sleep precisely
-            elapsed = time.perf_counter() - cycle_start_time
-            #print(f'[Trace Analyser] analysis elapsed time {elapsed}') # for debugging
-            sleep_time = max(0, analyser_target_repeat_time - elapsed)
-            time.sleep(sleep_time)
+            # once every trace is analysed, wait until the instrument commits a batch more; if these traces could not be committed
+            # (the events cache is full), try again later
+            if traces_head == traces_tail:
+                self.traces_ready.wait(self.n_traces_waiting, analyser_min_batch_traces, analyser_max_batch_wait,
+                                       timeout=analyser_target_repeat_time, stop=self.stop_analyser)
+            else:
+                self.stop_analyser.wait(analyser_target_repeat_time)
+
+        self.stop_analyser.clear()
+        print('[Trace Analyser] Stopped')
+
+    def create_worker_pool(self):
+        # shared state of the worker pool: claimed and reserved positions in the traces ring (events are reserved in their ring)
+        self.index_claim_traces_cache = mp.Value('q', 0)
+        self.reserve_condition = mp.Condition()
+        self.index_reserved_traces_cache = mp.RawValue('q', 0)
+        self.stop_workers = mp.Event()
+        self.results_queue = mp.Queue()
+
+    def start_workers(self):
+        # the pool starts from the committed head of the traces ring and the (flushed) start of the events ring
+        traces_head = self.traces_ring.cursor('head')
+        with self.index_claim_traces_cache.get_lock():
+            self.index_claim_traces_cache.value = traces_head
+        with self.reserve_condition:
+            self.index_reserved_traces_cache.value = traces_head
+            self.events_ring.advance('reserved', 0)
+        self.stop_workers.clear()
+        self.start_time = time.perf_counter()
+
+        self.workers = [TraceAnalysisWorker(self, worker_index) for worker_index in range(self.n_workers)]
+        for worker in self.workers:
+            worker.start()
+        print(f'[Trace Analyser] Started {self.n_workers} analysis workers')
+
+    def coordinate(self):
+        '''
+        commit the slices completed by the workers in traces order: the traces head and events tail only advance over slices
+        that are complete, however the workers finish, and the oscilloscope shows the last event committed
+        '''
+        traces_head = self.traces_ring.cursor('head')
+        events_tail = 0
+        completed = {} # traces_begin -> result of the slice from the worker
+        draining = False
+        stop_time = None
 
+        while True:
+            results = []
+            try:
+                results.append(self.results_queue.get(timeout=analyser_target_repeat_time))
+                while True:
+                    results.append(self.results_queue.get_nowait())
+            except Empty:
+                pass
+            for result in results:
+                completed[result['traces_begin']] = result
+
+            oscilloscope = None
+            n_committed = 0
+            while traces_head in completed:
+                result = completed.pop(traces_head)
+                traces_head = result['traces_end']
+                n_committed += result['events_end'] - events_tail
+                events_tail = result['events_end']
+                oscilloscope = result['oscilloscope'] or oscilloscope
+
+            if n_committed or results:
+                self.traces_ring.advance('head', traces_head)
+                self.events_ring.publish(events_tail)
+                self.events_ready.notify()
+                print(f'[Trace Analyser] committed {n_committed} events (traces cache head:{traces_head}), (events cache tail:{events_tail})')
+            if oscilloscope is not None:
+                self.oscilloscope_slot.write(oscilloscope)
+
+            if draining:
+                break
+            if self.stop_analyser.is_set():
+                self.stop_workers.set()
+                self.traces_ready.notify()
+            if self.stop_workers.is_set():
+                stop_time = stop_time or time.perf_counter()
+                # a worker that died holding a slice blocks the others at reservation: give up on them eventually
+                if time.perf_counter() - stop_time > analyser_worker_stop_timeout:
+                    for worker in self.workers:
+                        if worker.is_alive():
+                            logger.warning(f'TraceAnalyser: analysis worker {worker.worker_index} did not stop, terminating it')
+                            worker.terminate()
+                # once every worker has finished its last slice, commit what is left and stop
+                if not any(worker.is_alive() for worker in self.workers):
+                    draining = True
+
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        if completed:
+            logger.warning(f'TraceAnalyser: {len(completed)} analysed slices could not be committed')
         self.stop_analyser.clear()
         print('[Trace Analyser] Stopped')
 
@@ -334,22 +518,96 @@ class TraceAnalyser(mp.Process):
         widths *= int(self.adc_rate * 1000) # nanoseconds
         return widths
 
+class TraceAnalysisWorker(mp.Process):
+    '''
+    one process of the TraceAnalyser worker pool: claims a slice of the traces ring beyond those already claimed, measures it,
+    waits for the slices before it to reserve their events, reserves the next range of the events cache (once it has been
+    spilled), writes its events there and reports the slice to the coordinator
+    '''
+    def __init__(self, analyser, worker_index):
+        super().__init__(daemon=True)
+        self.worker_index = worker_index
+        self.n_workers = analyser.n_workers
+        self.max_slice_events = analyser.max_slice_events
+        self.start_time = analyser.start_time
+
+        # caches and channel configuration as set up in the analyser
+        for name in ['traces_ring', 'events_ring', 'trace_n_points', 'n_channels_trace', 'n_time_points_in_event',
+                     'indices_area_channels_in_traces', 'indices_height_channels_in_traces', 'indices_trigger_channel_in_traces',
+                     'index_time_channel_in_events', 'index_event_id_in_events', 'index_width_channel_in_events',
+                     'indices_area_channels_in_events', 'indices_height_channels_in_events', 'n_channels_per_event',
+                     'index_claim_traces_cache', 'reserve_condition', 'index_reserved_traces_cache', 'stop_workers', 'results_queue',
+                     'traces_ready']:
+            setattr(self, name, getattr(analyser, name))
+
+    read_traces = TraceAnalyser.read_traces
+    scale_traces = TraceAnalyser.scale_traces
+    measure = TraceAnalyser.measure
+    write_events = TraceAnalyser.write_events
+
+    def run(self):
+        # a claimed slice is always reserved and reported, even when stopping, or the slices after it could never be committed
+        while not self.stop_workers.is_set():
+            claimed = self.claim_slice()
+            if claimed is None:
+                self.traces_ready.wait(self.n_traces_unclaimed, analyser_min_batch_traces, analyser_max_batch_wait,
+                                       timeout=analyser_target_repeat_time, stop=self.stop_workers)
+                continue
+            traces_begin, traces_end = claimed
+            kept, peaks, oscilloscope = self.measure(self.read_traces(traces_begin, traces_end))
+            n_new_events = len(kept)
+            events_begin, event_time = self.reserve_events(traces_begin, traces_end, n_new_events)
+            if n_new_events:
+                event_ids, times = self.write_events(events_begin, peaks, n_new_events, event_time)
+                oscilloscope = {'event_id':event_ids[-1], 'time':times[-1]} | oscilloscope
+            self.results_queue.put({'traces_begin':traces_begin, 'traces_end':traces_end, 'events_end':events_begin + n_new_events,
+                                    'oscilloscope':oscilloscope})
+
+        self.traces_ring.close()
+        self.events_ring.close()
+
+    def n_traces_unclaimed(self):
+        # traces committed by the instrument and not yet claimed by a worker
+        with self.index_claim_traces_cache.get_lock():
+            traces_claimed = self.index_claim_traces_cache.value
+        return self.traces_ring.cursor('tail') - traces_claimed
+
+    def claim_slice(self):
+        # the next unclaimed traces, up to max_slice_events and shared out so that every worker gets some; None if there are none
+        with self.index_claim_traces_cache.get_lock():
+            traces_begin = self.index_claim_traces_cache.value
+            n_available = self.traces_ring.cursor('tail') - traces_begin
+            if n_available <= 0:
+                return None
+            traces_end = traces_begin + min(self.max_slice_events, -(-n_available // self.n_workers))
+            self.index_claim_traces_cache.value = traces_end
+        return traces_begin, traces_end
+
+    def reserve_events(self, traces_begin, traces_end, n_events):
+        # in traces order: the start of the range of the events cache for this slice, once there is room for it, and the event time
+        with self.reserve_condition:
+            while self.index_reserved_traces_cache.value != traces_begin:
+                self.reserve_condition.wait()
+            events_begin = self.events_ring.cursor('reserved')
+            while n_events > self.events_ring.space(events_begin):
+                self.reserve_condition.wait(analyser_target_repeat_time) # the controller spills (or reads) events in its own time
+            self.events_ring.advance('reserved', events_begin + n_events)
+            self.index_reserved_traces_cache.value = traces_end
+            event_time = int((time.perf_counter() - self.start_time) * 1000)
+            self.reserve_condition.notify_all()
+        return events_begin, event_time
+
 if __name__ == '__main__':
     mp.set_start_method("spawn")
 
-    # Allocate shared memory block, plus head and tail indices
-    traces_cache_shm = shared_memory.SharedMemory(create=True, size=np.zeros(traces_cache_size, dtype=np.uint16).nbytes)
-    traces_cache_lock = Lock()
-    index_head_traces_cache = mp.Value('i', 0)
-    index_tail_traces_cache = mp.Value('i', 0)
-
-    events_cache_shm = shared_memory.SharedMemory(create=True, size=np.zeros((max_events_in_cache, n_channels_per_event), dtype=np.int64).nbytes)
-    events_cache_lock = Lock()
-    index_head_events_cache = mp.Value('i', 0)
-    index_tail_events_cache = mp.Value('i', 0)
+    # traces and events caches (no controller here to spill the events)
+    traces_ring = create_traces_ring()
+    events_ring = create_events_ring(event_channels_pnn, spill=False)
 
-    # oscilloscope traces
-    oscilloscope_traces_queue = mp.Queue()
+    # oscilloscope trace
+    oscilloscope_slot = OscilloscopeSlot()
+    # wakeups: instrument -> analyser
+    traces_ready = Wakeup()
     # command pipes
     pipe_experiment_instrument_e, pipe_experiment_instrument_i = mp.Pipe()
     pipe_experiment_analyser_e, pipe_experiment_analyser_a = mp.Pipe()
@@ -361,10 +619,8 @@ if __name__ == '__main__':
     from honeychrome.instrument_communicator import Instrument
     instrument = Instrument(
         use_dummy_instrument=True,
-        traces_cache_name=traces_cache_shm.name,
-        traces_cache_lock=traces_cache_lock,
-        index_head_traces_cache=index_head_traces_cache,
-        index_tail_traces_cache=index_tail_traces_cache,
+        traces_ring=traces_ring,
+        traces_ready=traces_ready,
         pipe_connection=pipe_experiment_instrument_i
     )
     instrument.start()
@@ -373,15 +629,10 @@ if __name__ == '__main__':
     Secondly, set up analyst
     '''
     trace_analyser = TraceAnalyser(
-        traces_cache_name=traces_cache_shm.name,
-        traces_cache_lock=traces_cache_lock,
-        index_head_traces_cache=index_head_traces_cache,
-        index_tail_traces_cache=index_tail_traces_cache,
-        events_cache_name=events_cache_shm.name,
-        events_cache_lock=events_cache_lock,
-        index_head_events_cache=index_head_events_cache,
-        index_tail_events_cache=index_tail_events_cache,
-        oscilloscope_traces_queue=oscilloscope_traces_queue,
+        traces_ring=traces_ring,
+        events_ring=events_ring,
+        oscilloscope_slot=oscilloscope_slot,
+        traces_ready=traces_ready,
         pipe_connection=pipe_experiment_analyser_a
     )
     trace_analyser.start()
@@ -420,12 +671,8 @@ if __name__ == '__main__':
     #wait for a bit
     time.sleep(1)
 
-    from queue import Empty
-    try:
-        trace = oscilloscope_traces_queue.get_nowait()
-        print(trace)
-    except Empty:
-        pass
+    _, trace = oscilloscope_slot.read()
+    print(trace)
 
     # #stop analyser
     # pipe_experiment_analyser_e.send({'command':'stop'})
@@ -473,20 +720,17 @@ if __name__ == '__main__':
 
     # inspect event data output
     from pandas import DataFrame
-    shm_events = shared_memory.SharedMemory(name=events_cache_shm.name)
-    with events_cache_lock:
-        events_cache = np.ndarray((max_events_in_cache, n_channels_per_event), dtype=np.int64, buffer=shm_events.buf)
-    with index_head_events_cache.get_lock():
-        events_head = index_head_events_cache.value  # not used - events cache is not cycled
-    with index_tail_events_cache.get_lock():
-        events_tail = index_tail_events_cache.value
+    events_head = events_ring.cursor('head')
+    events_tail = events_ring.cursor('tail')
     print([events_head, events_tail])
-    with events_cache_lock:
-        events_df = DataFrame(data=events_cache[events_head:events_tail], columns=event_channels_pnn)
-        print(events_df.head(5))
-        #events_df.to_csv('/home/ssr/Downloads/events.csv', index=False)
-
-    traces_cache_shm.close()
-    events_cache_shm.close()
-    traces_cache_shm.unlink()
-    events_cache_shm.unlink()
\ No newline at end of file
+    events, _ = events_ring.read(events_head, events_tail)
+    events_df = DataFrame(data=events)
+    print(events_df.head(5))
+    #events_df.to_csv('/home/ssr/Downloads/events.csv', index=False)
+
+    traces_ring.close()
+    events_ring.close()
+    traces_ring.unlink()
+    events_ring.unlink()
+    oscilloscope_slot.close()
+    oscilloscope_slot.unlink()
\ No newline at end of file
@@ -124,6 +124,7 @@ class View(QObject):
 
         # view
         # update oscilloscope
+        self.bus.visiblePlotsChanged.connect(self.controller.set_visible_plots)
 
         # instrument control
         self.bus.startAcquisition.connect(self.controller.start_acquisition)
@@ -12,8 +12,9 @@ from honeychrome.settings import (colourmap_choice, graphics_export_formats, his
                       tile_size_nxn_grid, subsample, max_display_events, hist_bins, density_cutoff, trigger_channel, adc_channels, width_channels, height_channels,
                       use_dummy_instrument, magnitude_ceilings, magnitude_ceiling, raw_settings, unmixed_settings, experiments_folder,
                       magnitude_ceilings_int, spectral_positive_gate_percent, spectral_negative_gate_percent, report_include_raw, report_include_unmixed, report_include_process, send_debug_data,
-                      heatmap_colourmap_name, heatmap_colourmap_choice, spectral_cleaning_n_candidates, spectral_cleaning_n_spectral)
+                      heatmap_colourmap_name, heatmap_colourmap_choice, spectral_cleaning_n_candidates, spectral_cleaning_n_spectral, timing_spans, timing_trace, memory_budget_mb)
 import honeychrome.settings as settings
+from honeychrome.controller_components import timing
 
 
 import numpy as np
@@ -191,6 +192,15 @@ class AppConfigDialog(QDialog):
         self.max_display_events_spin.setToolTip('Maximum events shown in cytometry display plots. Does not affect spectral process or unmixing.')
         form.addRow("Max display events:", self.max_display_events_spin)
 
+        self.memory_budget_spin = QSpinBox()
+        self.memory_budget_spin.setRange(0, 1_048_576)
+        self.memory_budget_spin.setSingleStep(512)
+        self.memory_budget_spin.setSpecialValueText('Automatic')
+        self.memory_budget_spin.setSuffix(' MB')
+        self.memory_budget_spin.setToolTip('Memory the loaded sample, its plots and caches may use. Over budget, caches are evicted, '
+                                           'event data is stored as float32, then the display cap is lowered. Automatic is half of physical memory.')
+        form.addRow("Memory budget:", self.memory_budget_spin)
+
         self.histogram_resolution_spin = QSpinBox()
         self.histogram_resolution_spin.setRange(50, 400)
         self.histogram_resolution_spin.setSingleStep(50)
@@ -231,6 +241,12 @@ class AppConfigDialog(QDialog):
         form.addRow("Include unmixed data in sample report", self.report_include_unmixed_cb)
         form.addRow("Include spectral process in sample report", self.report_include_process_cb)
 
+        self.timing_spans_cb = QCheckBox("Show processing times in the status bar")
+        self.timing_trace_cb = QCheckBox("Write a timing trace to the experiment cache")
+        form.addRow("Diagnostics", self.timing_spans_cb)
+        form.addRow("", self.timing_trace_cb)
+        self.timing_trace_cb.setToolTip('Chrome trace (chrome://tracing or ui.perfetto.dev) of the processing stages, in cache/timing of the experiment folder, written when the experiment is saved.')
+
         # Bundled/approved plugins — always shown, dev and frozen
         self.enable_bundled_plugin = {}
         for file_path in bundled_plugins_path.glob("*_tab.py"):
@@ -322,6 +338,7 @@ class AppConfigDialog(QDialog):
         self.nxn_tile_size_spin.setValue(self.settings.value("nxn_tile_size", tile_size_nxn_grid, type=int))
         self.subsample_number_spin.setValue(self.settings.value("subsample_number", subsample, type=int))
         self.max_display_events_spin.setValue(self.settings.value("max_display_events", max_display_events, type=int))
+        self.memory_budget_spin.setValue(self.settings.value("memory_budget_mb", memory_budget_mb, type=int))
         self.histogram_resolution_spin.setValue(self.settings.value("histogram_resolution", hist_bins, type=int))
         self.density_cutoff_spin.setValue(self.settings.value("density_cutoff", density_cutoff, type=int))
         self.spectral_positive_gate_percent_spin.setValue(self.settings.value("spectral_positive_gate_percent", spectral_positive_gate_percent, type=int))
@@ -332,6 +349,8 @@ class AppConfigDialog(QDialog):
         self.report_include_raw_cb.setChecked(self.settings.value("report_include_raw", report_include_raw, type=bool))
         self.report_include_unmixed_cb.setChecked(self.settings.value("report_include_unmixed", report_include_unmixed, type=bool))
         self.report_include_process_cb.setChecked(self.settings.value("report_include_process", report_include_process, type=bool))
+        self.timing_spans_cb.setChecked(self.settings.value("timing_spans", timing_spans, type=bool))
+        self.timing_trace_cb.setChecked(self.settings.value("timing_trace", timing_trace, type=bool))
 
         self.send_debug_data.setChecked(self.settings.value("send_debug_data", send_debug_data, type=bool))
 
@@ -351,6 +370,7 @@ class AppConfigDialog(QDialog):
         self.settings.setValue("nxn_tile_size", self.nxn_tile_size_spin.value())
         self.settings.setValue("subsample_number", self.subsample_number_spin.value())
         self.settings.setValue("max_display_events", self.max_display_events_spin.value())
+        self.settings.setValue("memory_budget_mb", self.memory_budget_spin.value())
         self.settings.setValue("histogram_resolution", self.histogram_resolution_spin.value())
         self.settings.setValue("density_cutoff", self.density_cutoff_spin.value())
         self.settings.setValue("spectral_positive_gate_percent", self.spectral_positive_gate_percent_spin.value())
@@ -360,6 +380,8 @@ class AppConfigDialog(QDialog):
         self.settings.setValue("report_include_raw", self.report_include_raw_cb.isChecked())
         self.settings.setValue("report_include_unmixed", self.report_include_unmixed_cb.isChecked())
         self.settings.setValue("report_include_process", self.report_include_process_cb.isChecked())
+        self.settings.setValue("timing_spans", self.timing_spans_cb.isChecked())
+        self.settings.setValue("timing_trace", self.timing_trace_cb.isChecked())
         self.settings.setValue("send_debug_data", self.send_debug_data.isChecked())
 
         for file_path in bundled_plugins_path.glob("*_tab.py"):
@@ -373,6 +395,7 @@ class AppConfigDialog(QDialog):
         self.save_settings()
         self.accept()
         importlib.reload(settings)
+        timing.configure(self.timing_spans_cb.isChecked(), self.timing_trace_cb.isChecked())
         self.bus.reloadExpRequested.emit()
 
     def reset_to_defaults(self):
@@ -392,6 +415,7 @@ class AppConfigDialog(QDialog):
         self.nxn_tile_size_spin.setValue(tile_size_nxn_grid)
         self.subsample_number_spin.setValue(subsample)
         self.max_display_events_spin.setValue(max_display_events)
+        self.memory_budget_spin.setValue(memory_budget_mb)
         self.histogram_resolution_spin.setValue(hist_bins)
         self.density_cutoff_spin.setValue(density_cutoff)
         self.spectral_positive_gate_percent_spin.setValue(spectral_positive_gate_percent)
@@ -401,6 +425,8 @@ class AppConfigDialog(QDialog):
         self.report_include_raw_cb.setChecked(report_include_raw)
         self.report_include_unmixed_cb.setChecked(report_include_unmixed)
         self.report_include_process_cb.setChecked(report_include_process)
+        self.timing_spans_cb.setChecked(timing_spans)
+        self.timing_trace_cb.setChecked(timing_trace)
         self.send_debug_data.setChecked(send_debug_data)
 
         for file_path in bundled_plugins_path.glob("*_tab.py"):
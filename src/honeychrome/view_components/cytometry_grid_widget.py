@@ -28,6 +28,12 @@ class CytometryGridWidget(QScrollArea):
         self.debounce_timer.setSingleShot(True)
         self.debounce_timer.timeout.connect(self.init_grid)
 
+        # report the plots in view (after scrolling stops), so that live updates can update them first
+        self.visible_plots_timer = QTimer(parent=self)
+        self.visible_plots_timer.setSingleShot(True)
+        self.visible_plots_timer.timeout.connect(self.report_visible_plots)
+        self.verticalScrollBar().valueChanged.connect(lambda: self.visible_plots_timer.start(100))
+
         # Track which grid cells are occupied
         self.n_columns = None
         self.cytometry_plot_real_width = None
@@ -240,6 +246,7 @@ class CytometryGridWidget(QScrollArea):
         # Check if width actually changed
         if event.oldSize().width() != event.size().width():
             self.debounce_timer.start(300)
+        self.visible_plots_timer.start(100)
 
     def init_grid(self):
         if self.data_for_cytometry_plots is None:
@@ -286,11 +293,20 @@ class CytometryGridWidget(QScrollArea):
                     self.place_tile(plot_widget, w, h)
                     plot_widget.n_in_plot_sequence = n
 
+                self.visible_plots_timer.start(100)
+
                     # print(self.n_columns)
                     # print(n, w, h, self.data_for_cytometry_plots['plots'])
                     # print(self.occupied)
 
 
+    def report_visible_plots(self):
+        if self.bus is None:
+            return
+        view = self.viewport().rect().translated(0, self.verticalScrollBar().value())
+        visible = [n for n, plot_widget in enumerate(self.plot_widgets) if plot_widget.geometry().intersects(view)]
+        self.bus.visiblePlotsChanged.emit(self.mode, visible)
+
     def fits(self, row, col, w, h):
         """Check if tile of size (w,h) fits at (row,col)."""
         for r in range(row, row + h):
@@ -13,6 +13,7 @@ from networkx import NetworkXError
 
 from honeychrome.controller_components.functions import define_quad_gates, define_range_gate, define_ellipse_gate, define_rectangle_gate, define_polygon_gate, get_set_or_initialise_label_offset, rename_label_offset
 from honeychrome.controller_components.transform import transforms_menu_items
+from honeychrome.controller_components.timing import traced
 import honeychrome.settings as settings
 from honeychrome.controller_components.cytometer_whitelist import get_detector_laser_map, LASER_LABEL_COLORS
 
@@ -1009,6 +1010,7 @@ class CytometryPlotWidget(QFrame):
         else:
             warnings.warn('Signals bus not connected')
 
+    @traced('render')
     def plot_histogram(self):
         histograms = self.data_for_cytometry_plots.get('histograms', [])
         if self.n_in_plot_sequence >= len(histograms):
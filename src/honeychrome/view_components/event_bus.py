@@ -65,6 +65,7 @@ class EventBus(QObject):
     axisTransformed = Signal(str)
     axesReset = Signal(list)
     histsStatsRecalculated = Signal(str, list)
+    visiblePlotsChanged = Signal(str, list) # plots scrolled into view in the grid of a mode (updated first during acquisition)
     updateRois = Signal(str, int)
 
     ### spectral process
@@ -75,5 +76,6 @@ class EventBus(QObject):
     cleaningResultsReady = Signal()    # emitted after Clean Controls recalc finishes
     spectralProcessRefreshed = Signal()
     requestUpdateProcessHists = Signal()
+    spilloverFineTuned = Signal(list)   # unmixed channels updated in place after a spillover edit
     spilloverSelectedCellChanged = Signal(str, str)
     rawGateRenamed = Signal(str, str)   # (old_name, new_name) — propagate raw gate rename to spectral model
@@ -319,6 +319,7 @@ class HeatmapViewEditor(QFrame):
             self.view.selectionModel().currentChanged.connect(self.selected_cell_changed)
             if self.bus:
                 self.bus.requestUpdateProcessHists.connect(self.refresh_heatmap)
+                self.bus.spilloverFineTuned.connect(self.refresh_heatmap)
                 self.bus.spilloverSelectedCellChanged.connect(self.set_selected_cell)
 
 
@@ -340,8 +341,11 @@ class HeatmapViewEditor(QFrame):
             self.view.updateGeometry()
 
     def _emit_now(self):
-        self.controller.reapply_fine_tuning()
-        self.bus.requestUpdateProcessHists.emit()
+        channels = self.controller.reapply_fine_tuning_incremental()
+        if channels is None:
+            self.bus.requestUpdateProcessHists.emit()
+        else:
+            self.bus.spilloverFineTuned.emit(channels)
 
     def _on_edit(self, index1, index2, role):
         if index1 == index2:
@@ -504,6 +504,7 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         self.save_state()
+        self.nxn_viewer.stop_tile_workers()
 
         # Clean up child widgets
         for child in self.findChildren(QWidget):
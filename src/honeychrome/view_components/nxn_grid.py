@@ -1,6 +1,8 @@
+import functools
+
 import numpy as np
 
-from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QObject, QEvent, Slot, QSize, QTimer, QSettings, QItemSelectionModel, QSignalBlocker
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QObject, QEvent, Signal, Slot, QSize, QTimer, QSettings, QItemSelectionModel, QSignalBlocker
 from PySide6.QtWidgets import QTableView, QStyledItemDelegate, QFrame, QVBoxLayout, QLabel, QApplication, QComboBox, QHBoxLayout, QStyle, QAbstractItemView
 from PySide6.QtGui import QColor, QPalette, QImage, QPixmap, QPen
 
@@ -8,6 +10,8 @@ import colorcet as cc
 
 import honeychrome.settings as settings
 from honeychrome.controller_components.functions import define_process_plots
+from honeychrome.controller_components.nxn_engine import TileScheduler
+from honeychrome.view_components.tile_renderer import TileRenderer, render_tile_argb
 from honeychrome.view_components.help_texts import nxn_help_text
 from honeychrome.view_components.help_toggle_widget import HelpToggleWidget
 
@@ -18,18 +22,24 @@ logger = logging.getLogger(__name__)
 # Model
 # ---------------------------
 class HeatmapGridModel(QAbstractTableModel):
+    # tiles are read directly from an NxNHistogramEngine (controller.nxn_engine): row = channel_y, column = channel_x
+    # if request_tile and renderer are set, tiles not yet counted or rendered are left blank and requested
+    # rather than counted and colour-mapped in the paint path
     def __init__(self, controller, is_dark):
         super().__init__()
-        self._data = []
+        self.engine = None
+        self.request_tile = None
+        self.renderer = None
         self.horizontal_headers = []
         self.vertical_headers = []
         self.controller = controller
 
-        self._pixmap_cache = {}
         self.pnn_labels = {}
         self._pixmap_size = QSize(settings.tile_size_nxn_grid_retrieved, settings.tile_size_nxn_grid_retrieved)
 
-        self.colormap = self.get_colorcet_colormap(settings.colourmap_name_retrieved)
+        self.colormap_name = settings.colourmap_name_retrieved
+        self.is_dark = is_dark
+        self.colormap = self.get_colorcet_colormap(self.colormap_name)
 
         if is_dark:
             background_colour = QColor(0,0,0,255)
@@ -54,20 +64,22 @@ class HeatmapGridModel(QAbstractTableModel):
         return qt_colors
 
 
-    def update_data(self, data, horizontal_headers, vertical_headers, pnn_labels=None):
+    def update_data(self, engine, horizontal_headers, vertical_headers, pnn_labels=None):
         self.beginResetModel()  # Notify view that model is about to be reset
-        self._data = data
-        self._pixmap_cache = {}
+        self.engine = engine
         self.horizontal_headers = horizontal_headers
         self.vertical_headers = vertical_headers
         self.pnn_labels = pnn_labels if pnn_labels is not None else {}
         self.endResetModel()  # Notify view that model has been reset
 
     def rowCount(self, parent=QModelIndex()):
-        return len(self._data)
+        return len(self.vertical_headers) if self.engine is not None else 0
 
     def columnCount(self, parent=QModelIndex()):
-        return len(self._data[0]) if self._data else 0
+        return len(self.horizontal_headers) if self.engine is not None else 0
+
+    def tile(self, r, c):
+        return self.engine.tile(self.horizontal_headers[c], self.vertical_headers[r])
 
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid():
@@ -79,8 +91,17 @@ class HeatmapGridModel(QAbstractTableModel):
 
             if self.vertical_headers[r] != self.horizontal_headers[c]:
                 # return self.get_cached_pixmap(index)
-                pixmap = self.create_heatmap_pixmap(self._data[r][c])
-                return pixmap
+                if self.request_tile is None or self.renderer is None:
+                    return self.create_heatmap_pixmap(self.tile(r, c))
+                key = (self.horizontal_headers[c], self.vertical_headers[r])
+                image = self.renderer.image(key)
+                if image is not None:
+                    return self.argb_to_pixmap(image)
+                if self.engine.is_counted(*key):
+                    self.renderer.render([key])
+                else:
+                    self.request_tile(r, c)
+                return None
             else:
                 return None
 
@@ -98,50 +119,13 @@ class HeatmapGridModel(QAbstractTableModel):
 
         return None
 
-    def get_cached_pixmap(self, index):
-        cache_key = (index.row(), index.column())
-        if cache_key not in self._pixmap_cache:
-            heatmap_data = self._data[index.row()][index.column()]
-            pixmap = self.create_heatmap_pixmap(heatmap_data)
-            self._pixmap_cache[cache_key] = pixmap
-        return self._pixmap_cache[cache_key]
-
     def create_heatmap_pixmap(self, data):
-        """Fastest approach using pure NumPy operations"""
-        height, width = data.shape
-
-        # Normalize
-        data_max = np.max(data)
-
-        if data_max > 0:
-            normalized = np.flipud((data / data_max).T)
-        else:
-            normalized = np.full_like(data, 0.5)
-
-        indices = (normalized * (len(self.colormap) - 1)).astype(np.int32)
-        indices = np.clip(indices, 0, len(self.colormap) - 1) # not necessary to clip as already scaled # ssr putting this back in... otherwise we get crashes
-
-        # Vectorized lookup
-        rgb_array = self.color_table[indices]
-
-        # Convert to ARGB32 format expected by QImage
-        argb_array = (rgb_array[:, :, 3] << 24) | (rgb_array[:, :, 0] << 16) | (rgb_array[:, :, 1] << 8) | (rgb_array[:, :, 2])
+        # synchronous path (report exporter): render and wrap in one go
+        return self.argb_to_pixmap(render_tile_argb(data, self.color_table, self._pixmap_size.width()))
 
-        scaled_image = QImage(argb_array.data, width, height, QImage.Format_ARGB32).scaled(self._pixmap_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        # Create QImage from memory
-        return QPixmap.fromImage(scaled_image)
-
-    def setData(self, index, value, role):
-        if role == Qt.EditRole:
-            try:
-                v = float(value)
-            except ValueError:
-                return False
-
-            self._data[index.row(), index.column()] = v
-            self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.BackgroundRole])
-            return True
-        return False
+    def argb_to_pixmap(self, argb_array):
+        height, width = argb_array.shape
+        return QPixmap.fromImage(QImage(argb_array.data, width, height, QImage.Format_ARGB32))
 
     def flags(self, index):
         r, c = index.row(), index.column()
@@ -267,14 +251,22 @@ class ResizingTable(QTableView):
 # Main Application
 # -----------------------------------------------------
 
+def _stop_tile_workers(tile_scheduler, tile_renderer, memory, tile_images_bytes, *args):
+    # stop counting and rendering tiles for an NxN grid, and stop accounting for its tile images (holds no reference to the grid)
+    tile_scheduler.stop()
+    tile_renderer.shutdown()
+    memory.unregister('nxn_tile_images', tile_images_bytes)
+
+
 class NxNGrid(QFrame):
+    tilesReady = Signal(list) # emitted from the tile render threads, delivered on the GUI thread
+
     def __init__(self, bus, controller, is_dark=False, parent=None):
         super().__init__(parent)
 
         # connect
         self.bus = bus
         self.controller = controller
-        self.heatmaps = None
         self.horizontal_headers = []
         self.vertical_headers = []
 
@@ -311,6 +303,22 @@ class NxNGrid(QFrame):
         self.view.selectionModel().currentChanged.connect(self.selected_cell_changed)
 
         if self.bus is not None: # nxn grid is in the gui - connect signals and initialise in the normal way
+            # tiles are counted in the background, visible tiles nearest the selected cell first, then rendered to ARGB
+            # buffers in a worker pool; the model only wraps finished buffers on the GUI thread
+            self.tile_renderer = TileRenderer(self.controller.nxn_engine, self.tilesReady.emit,
+                                              max_bytes=settings.nxn_tile_cache_bytes, max_workers=settings.nxn_max_workers)
+            self.tile_renderer.set_colormap(self.model.colormap_name, self.model.is_dark, self.model.color_table, settings.tile_size_nxn_grid_retrieved)
+            self.tile_scheduler = TileScheduler(self.controller.nxn_engine, self.tile_renderer.render)
+            self.model.renderer = self.tile_renderer
+            tile_images = self.tile_renderer.cache
+            tile_images_bytes = lambda: tile_images.n_bytes
+            self.controller.memory.register('nxn_tile_images', tile_images_bytes, evict=tile_images.clear)
+            # the workers must not outlive the grid (nor signal it once deleted): stopped on close, or when it is destroyed
+            self.stop_tile_workers = functools.partial(_stop_tile_workers, self.tile_scheduler, self.tile_renderer,
+                                                       self.controller.memory, tile_images_bytes)
+            self.destroyed.connect(self.stop_tile_workers)
+            self.model.request_tile = self.request_tile
+            self.tilesReady.connect(self.update_tiles)
             self.source_gate_combo.currentTextChanged.connect(self.request_update_process_plots)
             self.bus.showSelectedProfiles.connect(self.show_selected_rows)
             self.bus.histsStatsRecalculated.connect(self.refresh_heatmaps)
@@ -319,6 +327,9 @@ class NxNGrid(QFrame):
             self.bus.spilloverSelectedCellChanged.connect(self.set_selected_cell)
 
         else: # nxn grid is in the exporter - just update the plots, histograms and generate the model and view
+            self.tile_scheduler = None
+            self.tile_renderer = None
+            self.stop_tile_workers = lambda: None
             # refresh list of plots with preferred source gate
             source_gate = 'root'
             unmixed_gate_names = [g[0].lower() for g in self.controller.unmixed_gating.get_gate_ids()]
@@ -333,7 +344,7 @@ class NxNGrid(QFrame):
             # calculate histograms
             self.controller.initialise_data_for_cytometry_plots(force_recalc_histograms=True) # make sure all histograms are present before constructing grid
             self.set_headers_to_all_labels()
-            self.refresh_heatmaps() #produces dummy hists
+            self.refresh_heatmaps() # tiles are zeros until counted
 
 
 
@@ -342,7 +353,7 @@ class NxNGrid(QFrame):
             self.setVisible(True)
             self.set_headers_to_all_labels()
             self.refresh_source_combo(mode='unmixed') # populate the source combo with all unmixed gates
-            self.refresh_heatmaps() #produces dummy hists
+            self.refresh_heatmaps() # tiles are zeros until counted
         else:
             self.setVisible(False)
 
@@ -378,9 +389,14 @@ class NxNGrid(QFrame):
 
     def _process_spillover_change(self):
         # recalculate histograms only for source gate and plots in selected rows
+        # if the edit was applied in place, only the affected plots have been recalculated already
         source_gate = self.source_gate_combo.currentText()
-        self.controller.reapply_fine_tuning()
-        self.request_update_process_plots(source_gate)
+        self.cancel_tiles()
+        channels = self.controller.reapply_fine_tuning_incremental()
+        if channels is None:
+            self.request_update_process_plots(source_gate)
+        elif self.bus is not None:
+            self.bus.spilloverFineTuned.emit(channels)
 
     @Slot(list)
     def show_selected_rows(self, selected_label_list):
@@ -403,6 +419,7 @@ class NxNGrid(QFrame):
         # unless spectral model has changed (in that case wait for reinitialisation)
         # redefines process plots and forces reinitialisation of data,
         # ultimately signalling histstatsrecalculated
+        self.cancel_tiles()
         if self.controller.experiment.settings['unmixed']['fluorescence_channels']:
             if set(self.controller.experiment.process['profiles'].keys()) == set(self.horizontal_headers):
                 process_plots = define_process_plots(self.horizontal_headers, self.vertical_headers, source_gate=source_gate)
@@ -423,24 +440,6 @@ class NxNGrid(QFrame):
                     plots = self.controller.data_for_cytometry_plots_process['plots']
                     if plots:
                         self.setVisible(True)
-                        histograms = self.controller.data_for_cytometry_plots_process['histograms']
-                        if not histograms:
-                            dummy_hist = np.zeros((settings.tile_size_nxn_grid_retrieved, settings.tile_size_nxn_grid_retrieved))
-                            histograms += [dummy_hist for plot in plots]
-
-                        # build data arrays
-                        # vertical headers are the unmixed filtered set
-                        # horizontal headers are the raw fluorescence set
-                        self.heatmaps = []
-                        for r in self.vertical_headers:
-                            row = []
-                            for c in self.horizontal_headers:
-                                if c != r:
-                                    index = [plots.index(plot) for plot in plots if plot['type'] == 'hist2d' and plot['channel_x'] == c and plot['channel_y'] == r][0]
-                                    row.append(histograms[index])
-                                else:
-                                    row.append(None)
-                            self.heatmaps.append(row)
 
                         # self.view.setModel(self.model)
 
@@ -451,7 +450,8 @@ class NxNGrid(QFrame):
                             selected_col_chan = self.horizontal_headers[index.column()]
 
                         pnn_labels = self.controller.data_for_cytometry_plots_process.get('pnn_labels') or {}
-                        self.model.update_data(self.heatmaps, self.horizontal_headers, self.vertical_headers, pnn_labels=pnn_labels)
+                        self.model.update_data(self.controller.nxn_engine, self.horizontal_headers, self.vertical_headers, pnn_labels=pnn_labels)
+                        self.schedule_tiles()
 
                         if index.isValid():
                             QTimer.singleShot(0, lambda : self.set_selected_cell(selected_row_chan, selected_col_chan))
@@ -463,6 +463,56 @@ class NxNGrid(QFrame):
         except Exception as e:
             logger.warning(f'NxN Grid: refresh_heatmaps failed ({e}), skipping update.')
 
+    def visible_cells(self):
+        # rows and columns of the grid actually on screen (the table is usually clipped by the tab's scroll area)
+        rect = self.view.viewport().visibleRegion().boundingRect()
+        if rect.isEmpty() or not self.model.rowCount() or not self.model.columnCount():
+            return range(0), range(0)
+        top, bottom = self.view.rowAt(rect.top()), self.view.rowAt(rect.bottom())
+        left, right = self.view.columnAt(rect.left()), self.view.columnAt(rect.right())
+        bottom = self.model.rowCount() - 1 if bottom < 0 else bottom
+        right = self.model.columnCount() - 1 if right < 0 else right
+        return range(max(top, 0), bottom + 1), range(max(left, 0), right + 1)
+
+    def tile_priority(self, r, c, visible):
+        # on screen first, then by distance from the selected cell (or the top left corner)
+        current = self.view.selectionModel().currentIndex()
+        sr, sc = (current.row(), current.column()) if current.isValid() else (0, 0)
+        return (0 if visible else 1, max(abs(r - sr), abs(c - sc)), r, c)
+
+    def request_tile(self, r, c):
+        # the model is painting a tile that has not been counted: it is on screen
+        if self.tile_scheduler is not None:
+            key = (self.horizontal_headers[c], self.vertical_headers[r])
+            self.tile_scheduler.request(key, self.tile_priority(r, c, visible=True))
+
+    def schedule_tiles(self):
+        # queue every tile not yet counted; off-screen tiles are counted once the visible ones are done
+        if self.tile_scheduler is None:
+            return
+        engine = self.controller.nxn_engine
+        visible_rows, visible_columns = self.visible_cells()
+        priorities = {}
+        for r, channel_y in enumerate(self.model.vertical_headers):
+            for c, channel_x in enumerate(self.model.horizontal_headers):
+                if channel_x != channel_y and not engine.is_counted(channel_x, channel_y):
+                    priorities[(channel_x, channel_y)] = self.tile_priority(r, c, r in visible_rows and c in visible_columns)
+        self.tile_scheduler.schedule(priorities)
+
+    def cancel_tiles(self):
+        if self.tile_scheduler is not None:
+            self.tile_scheduler.cancel()
+
+    @Slot(list)
+    def update_tiles(self, keys):
+        # repaint the cells of tiles just rendered
+        headers_x, headers_y = self.model.horizontal_headers, self.model.vertical_headers
+        cells = [(headers_y.index(y), headers_x.index(x)) for x, y in keys if x in headers_x and y in headers_y]
+        if cells:
+            rows = [r for r, c in cells]
+            columns = [c for r, c in cells]
+            self.model.dataChanged.emit(self.model.index(min(rows), min(columns)), self.model.index(max(rows), max(columns)), [Qt.DecorationRole])
+
     def eventFilter(self, obj, event):
         if event.type() == QEvent.Wheel:
             pos = event.position().toPoint()
@@ -510,6 +560,7 @@ class NxNGrid(QFrame):
             row_chan = self.vertical_headers[current.row()]
             col_chan = self.horizontal_headers[current.column()]
             self.bus.spilloverSelectedCellChanged.emit(row_chan, col_chan)
+            self.schedule_tiles()
 
     @Slot(str, str)
     def set_selected_cell(self, row_chan, col_chan):#
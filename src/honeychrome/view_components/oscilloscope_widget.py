@@ -1,7 +1,6 @@
 import numpy as np
 from PySide6.QtCore import Slot, QTimer, Qt
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel
-from queue import Empty
 import pyqtgraph as pg
 
 from honeychrome.settings import n_time_points_in_event, adc_rate
@@ -71,20 +70,22 @@ class OscilloscopeWidget(QWidget):
                 entry = LegendEntry(color, fluorescence_channels[i])
                 self.legendLayout2.addWidget(entry)
 
-            # Use a timer to check the queue periodically
+            # Use a timer to poll the oscilloscope slot for the latest trace
             self.trace = None
+            self.trace_sequence = 0
             self.timer = QTimer()
-            self.timer.timeout.connect(self.check_queue)
+            self.timer.timeout.connect(self.check_slot)
             self.timer.setInterval(int(analyser_target_repeat_time * 1000))
             self.timer.start()
 
     @Slot()
-    def check_queue(self):
-        try:
-            self.trace = self.controller.oscilloscope_traces_queue.get_nowait()
+    def check_slot(self):
+        if self.controller.oscilloscope_slot is None:
+            return
+        self.trace_sequence, trace = self.controller.oscilloscope_slot.read(self.trace_sequence)
+        if trace is not None:
+            self.trace = trace
             self._update_plot()
-        except Empty:
-            pass
 
     @Slot(dict)
     def _update_plot(self):
@@ -0,0 +1,151 @@
+'''
+Rendering of NxN grid tiles off the GUI thread.
+
+Tiles counted by the NxN engine are normalised and colour-mapped into uint32
+ARGB buffers on a small thread pool and kept in a byte-bounded LRU cache keyed
+by (tile, histogram version, colormap, dark mode). The GUI thread only wraps a
+finished buffer in a QImage when a cell is painted, so scrolling never waits
+for colour mapping.
+'''
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from honeychrome.controller_components.timing import traced
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@traced('render_tile')
+def render_tile_argb(data, color_table, size):
+    '''
+    histogram [x bin, y bin] -> (size, size) uint32 ARGB32 image, y upwards, scaled to the histogram maximum
+    color_table: (n_colours, 4) uint32 RGBA
+    '''
+    data_max = np.max(data) if data.size else 0
+    if data_max > 0:
+        normalized = np.flipud((data / data_max).T)
+    else:
+        normalized = np.full_like(data.T, 0.5, dtype=np.float64)
+
+    # resample to the tile size (nearest bin) if the histogram resolution differs
+    height, width = normalized.shape
+    if (height, width) != (size, size) and height and width:
+        normalized = normalized[np.arange(size) * height // size][:, np.arange(size) * width // size]
+
+    indices = (normalized * (len(color_table) - 1)).astype(np.int32)
+    np.clip(indices, 0, len(color_table) - 1, out=indices)
+    rgb_array = color_table[indices]
+    argb = (rgb_array[:, :, 3] << 24) | (rgb_array[:, :, 0] << 16) | (rgb_array[:, :, 1] << 8) | rgb_array[:, :, 2]
+    return np.ascontiguousarray(argb, dtype=np.uint32)
+
+
+class TileImageCache:
+    '''thread-safe LRU of ARGB buffers, evicting least recently used entries beyond max_bytes'''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            buffer = self._entries.get(key)
+            if buffer is not None:
+                self._entries.move_to_end(key)
+            return buffer
+
+    def put(self, key, buffer):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.n_bytes -= old.nbytes
+            self._entries[key] = buffer
+            self.n_bytes += buffer.nbytes
+            while self.n_bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+    def clear(self):
+        '''empty the cache, returning the bytes freed'''
+        with self._lock:
+            n_bytes = self.n_bytes
+            self._entries.clear()
+            self.n_bytes = 0
+            return n_bytes
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class TileRenderer:
+    '''
+    renders engine tiles into the cache on a thread pool
+    cache keys are (tile key, tile version, colormap name, is_dark); tiles_rendered(tile keys) is called from the pool,
+    never once shutdown() has returned
+    '''
+    def __init__(self, engine, tiles_rendered, max_bytes, max_workers=1):
+        self.engine = engine
+        self.tiles_rendered = tiles_rendered
+        self.cache = TileImageCache(max_bytes)
+        self.colormap_key = None
+        self.color_table = None
+        self.size = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._shut_down = False
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='nxn-render')
+
+    def set_colormap(self, colormap_name, is_dark, color_table, size):
+        with self._lock:
+            self.colormap_key = (colormap_name, is_dark)
+            self.color_table = color_table
+            self.size = size
+
+    def cache_key(self, key):
+        return (key, self.engine.tile_version(*key)) + self.colormap_key
+
+    def image(self, key):
+        '''rendered ARGB buffer for the current version of the tile, or None'''
+        return self.cache.get(self.cache_key(key))
+
+    def render(self, keys):
+        '''queue tiles for rendering (already counted tiles only; others are skipped when their turn comes)'''
+        with self._lock:
+            keys = [key for key in keys if key not in self._pending]
+            if not keys or self._shut_down:
+                return
+            self._pending.update(keys)
+            self._executor.submit(self._render, keys)
+
+    def _render(self, keys):
+        rendered = []
+        try:
+            for key in keys:
+                tile, version = self.engine.versioned_tile(*key)
+                with self._lock:
+                    self._pending.discard(key)
+                    color_table, size, colormap_key = self.color_table, self.size, self.colormap_key
+                if tile is None:
+                    continue
+                self.cache.put((key, version) + colormap_key, render_tile_argb(tile, color_table, size))
+                rendered.append(key)
+        except Exception as e:
+            logger.warning(f'TileRenderer: rendering tiles failed ({e})')
+            with self._lock:
+                self._pending.difference_update(keys)
+        if rendered:
+            with self._lock: # so that shutdown() can't return between the check and the call
+                if not self._shut_down:
+                    self.tiles_rendered(rendered)
+
+    def shutdown(self):
+        '''cancel the tiles queued and stop reporting rendered tiles; a tile being rendered finishes in the background'''
+        with self._lock:
+            self._shut_down = True
+            self._pending.clear()
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -211,6 +211,140 @@ def test_af_idx_is_1_based():
         f"af_idx maximum should be <= n_af={af_spectra.shape[0]}, got {result['af_idx'].max()}"
 
 
+@pytest.mark.numpy_only
+def test_apply_af_unmixing_chunked_threads_match_reference():
+    """
+    The threaded, blocked NumPy path must reproduce the single-pass reference
+    (3D L1 error temporary) regardless of chunk size and worker count.
+    """
+    from honeychrome.controller_components.autospectral_functions import (
+        precompute_af_matrices, apply_af_unmixing,
+    )
+
+    fluor_spectra = _make_fluor_spectra()
+    af_spectra    = _make_af_spectra(n_af=4)
+    raw_fl        = _make_raw_events(fluor_spectra, af_spectra, n_cells=1_003)
+    precomputed   = precompute_af_matrices(fluor_spectra, af_spectra)
+
+    P = precomputed['P']
+    init_fluor = raw_fl @ P.T
+    K = (raw_fl @ precomputed['r_library']) / precomputed['r_dots'][np.newaxis, :]
+    error = np.abs(init_fluor[:, :, np.newaxis]
+                   - K[:, np.newaxis, :] * precomputed['v_library'][np.newaxis, :, :]).sum(axis=1)
+    best_j = np.argmin(error, axis=1)
+    best_k = K[np.arange(len(raw_fl)), best_j]
+    expected = (raw_fl - best_k[:, np.newaxis] * af_spectra[best_j]) @ P.T
+
+    for chunk_size, n_workers in [(50_000, 1), (100, 1), (100, 4), (37, 3)]:
+        result = apply_af_unmixing(raw_fl, precomputed, af_spectra, chunk_size=chunk_size, n_workers=n_workers)
+        np.testing.assert_array_equal(result['af_idx'], best_j + 1)
+        np.testing.assert_allclose(result['af_scale'], best_k, rtol=1e-12)
+        np.testing.assert_allclose(result['unmixed'], expected, rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.numpy_only
+def test_apply_af_unmixing_limits_blas_threads_only_when_asked(monkeypatch):
+    """
+    The BLAS thread limit is process-wide, so it is taken only if the caller
+    owns the process (limit_blas_threads) and more than one worker runs.
+    """
+    import contextlib
+    import honeychrome.controller_components.autospectral_functions as af
+
+    taken = []
+    monkeypatch.setattr(af, 'threadpool_limits', lambda limits=None: limits_taken(limits))
+
+    @contextlib.contextmanager
+    def limits_taken(n):
+        taken.append(n)
+        yield
+
+    fluor_spectra = _make_fluor_spectra()
+    af_spectra    = _make_af_spectra(n_af=4)
+    raw_fl        = _make_raw_events(fluor_spectra, af_spectra, n_cells=500)
+    precomputed   = af.precompute_af_matrices(fluor_spectra, af_spectra)
+
+    reference = af.apply_af_unmixing(raw_fl, precomputed, af_spectra, chunk_size=100, n_workers=3)
+    assert taken == []
+    af.apply_af_unmixing(raw_fl, precomputed, af_spectra, chunk_size=100, n_workers=1, limit_blas_threads=True)
+    assert taken == []
+    limited = af.apply_af_unmixing(raw_fl, precomputed, af_spectra, chunk_size=100, n_workers=3, limit_blas_threads=True)
+    assert taken == [1]
+    np.testing.assert_array_equal(limited['unmixed'], reference['unmixed'])
+
+
+@pytest.mark.numpy_only
+def test_apply_af_transfer_matches_dense_product_with_overwrite():
+    """
+    apply_af_transfer builds only the pass-through columns from the transfer
+    matrix; the result must equal the dense product with the fluorescence
+    columns overwritten by the AF-corrected (and compensated) values.
+    """
+    from honeychrome.controller_components.autospectral_functions import (
+        precompute_af_matrices, apply_af_unmixing, apply_af_transfer,
+    )
+    from honeychrome.controller_components.functions import apply_transfer_matrix
+
+    fluor_spectra = _make_fluor_spectra()
+    af_spectra    = _make_af_spectra(n_af=3)
+    raw_fl        = _make_raw_events(fluor_spectra, af_spectra)
+    precomputed   = precompute_af_matrices(fluor_spectra, af_spectra)
+
+    # raw: Time, FSC-A, SSC-A, 14 fluorescence; unmixed: Time, FSC-A, SSC-A, 8 fluorophores, empty column
+    n_cells = raw_fl.shape[0]
+    raw = np.hstack([np.arange(n_cells)[:, None], RNG.uniform(1e3, 1e5, size=(n_cells, 2)), raw_fl])
+    fl_ids_raw, fl_ids_unmixed = list(range(3, 3 + N_CHANNELS)), list(range(3, 3 + N_FLUORS))
+    transfer_matrix = np.zeros((raw.shape[1], 3 + N_FLUORS + 1))
+    transfer_matrix[0, 0] = transfer_matrix[1, 1] = transfer_matrix[2, 2] = 1
+    transfer_matrix[np.ix_(fl_ids_raw, fl_ids_unmixed)] = np.linalg.pinv(fluor_spectra)
+    settings = {'raw': {'fluorescence_channel_ids': fl_ids_raw}, 'unmixed': {'fluorescence_channel_ids': fl_ids_unmixed}}
+    spillover = np.eye(N_FLUORS) + 0.01 * RNG.random((N_FLUORS, N_FLUORS))
+
+    result = apply_af_transfer(raw, transfer_matrix, precomputed, af_spectra, settings, spillover=spillover)
+
+    expected = raw @ transfer_matrix
+    af_fl = apply_af_unmixing(raw_fl, precomputed, af_spectra)['unmixed']
+    expected[:, fl_ids_unmixed] = (np.linalg.inv(spillover).T @ af_fl.T).T
+    np.testing.assert_allclose(result['unmixed'], expected, rtol=1e-10, atol=1e-8)
+
+    # the structured path on its own reproduces the dense product outside the skipped columns
+    partial = apply_transfer_matrix(transfer_matrix, raw, skip_columns=fl_ids_unmixed)
+    keep = [c for c in range(transfer_matrix.shape[1]) if c not in fl_ids_unmixed]
+    np.testing.assert_array_equal(partial[:, keep], (raw @ transfer_matrix)[:, keep])
+
+
+@pytest.mark.numpy_only
+def test_update_compensation_in_place_matches_full_recompute():
+    """
+    A spillover edit applied in place to the compensated (AF-corrected) columns
+    must match recompensating from scratch, and leave other columns untouched.
+    """
+    from honeychrome.controller_components.autospectral_functions import precompute_af_matrices, apply_af_unmixing
+    from honeychrome.controller_components.functions import update_compensation_in_place
+
+    fluor_spectra = _make_fluor_spectra()
+    af_spectra    = _make_af_spectra(n_af=3)
+    raw_fl        = _make_raw_events(fluor_spectra, af_spectra)
+    af_fl = apply_af_unmixing(raw_fl, precompute_af_matrices(fluor_spectra, af_spectra), af_spectra)['unmixed']
+
+    # unmixed: two scatter columns, then the fluorophores
+    fl_ids = list(range(2, 2 + N_FLUORS))
+    old_spillover = np.eye(N_FLUORS)
+    old_spillover[0, 1] = 0.05
+    new_spillover = old_spillover.copy()
+    new_spillover[2, 5] = 0.08
+    new_spillover[5, 2] = -0.03
+
+    event_data = np.hstack([RNG.uniform(1e3, 1e5, size=(af_fl.shape[0], 2)), af_fl @ np.linalg.inv(old_spillover)])
+    scatter = event_data[:, :2].copy()
+    affected = update_compensation_in_place(event_data, fl_ids, old_spillover, new_spillover)
+
+    np.testing.assert_allclose(event_data[:, fl_ids], af_fl @ np.linalg.inv(new_spillover), rtol=1e-10, atol=1e-8)
+    np.testing.assert_array_equal(event_data[:, :2], scatter)
+    assert affected == [2, 5]
+    assert update_compensation_in_place(event_data, fl_ids, new_spillover, new_spillover) == []
+
+
 @pytest.mark.numpy_only
 def test_combine_af_precomputed_matches_single():
     """
@@ -259,6 +393,44 @@ def test_combine_af_precomputed_concatenates_columns():
     np.testing.assert_array_equal(combined['S_t'], pc1['S_t'], err_msg="S_t must come from first profile")
 
 
+@pytest.mark.numpy_only
+def test_load_or_precompute_af_matrices_persists_by_spectra():
+    """
+    load_or_precompute_af_matrices writes one .npz per (fluor, AF) spectra pair,
+    reads it back unchanged on the next call, and keys new spectra separately.
+    """
+    from unittest import mock
+    from honeychrome.controller_components import autospectral_functions
+    from honeychrome.controller_components.autospectral_functions import (
+        precompute_af_matrices, precompute_joint_cov_extras, load_or_precompute_af_matrices,
+    )
+
+    fluor_spectra = _make_fluor_spectra()
+    af1 = _make_af_spectra(n_af=2)
+    af2 = _make_af_spectra(n_af=3, rng=np.random.default_rng(7))
+
+    expected = precompute_af_matrices(fluor_spectra, af1)
+    expected.update(precompute_joint_cov_extras(expected, af1))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = Path(tmp) / 'af_precomputed'
+        first = load_or_precompute_af_matrices(fluor_spectra, af1, cache_dir)
+        assert len(list(cache_dir.glob('*.npz'))) == 1
+
+        with mock.patch.object(autospectral_functions, 'precompute_af_matrices',
+                               side_effect=AssertionError('should load from cache')):
+            second = load_or_precompute_af_matrices(fluor_spectra, af1, cache_dir)
+
+        assert set(second) == set(expected)
+        for key in expected:
+            np.testing.assert_array_equal(first[key], expected[key])
+            np.testing.assert_array_equal(second[key], expected[key])
+
+        load_or_precompute_af_matrices(fluor_spectra, af2, cache_dir)
+        load_or_precompute_af_matrices(fluor_spectra * 0.5, af1, cache_dir)
+        assert len(list(cache_dir.glob('*.npz'))) == 3
+
+
 @pytest.mark.numpy_only
 def test_save_and_load_af_profile_csv_roundtrip():
     """
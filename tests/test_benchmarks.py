@@ -0,0 +1,40 @@
+"""
+test_benchmarks.py
+------------------
+The offline benchmarks on a small synthetic spectral sample: the synthetic FCS
+file reads back as written, and every stage is timed and reported as json.
+"""
+import json
+
+import numpy as np
+
+
+def test_synthetic_spectral_fcs_reads_back_as_written(tmp_path):
+    from honeychrome.benchmarks import synthetic_spectra, synthetic_spectral_events, write_synthetic_spectral_fcs
+    from honeychrome.controller_components.functions import sample_from_fcs
+
+    spectra, af_spectra = synthetic_spectra(n_detectors=8, n_fluorophores=4, n_af=2)
+    assert spectra.shape == (4, 8) and af_spectra.shape == (2, 8)
+    np.testing.assert_allclose(spectra.max(axis=1), 1)
+
+    pnn = write_synthetic_spectral_fcs(tmp_path / 'synthetic.fcs', 2_500, spectra, af_spectra, seed=3, chunk_size=1_000)
+    sample = sample_from_fcs(tmp_path / 'synthetic.fcs')
+    assert list(sample.pnn_labels) == pnn and sample.event_count == 2_500
+    # written in chunks, each its own seed, with time running on across them
+    events = np.vstack([synthetic_spectral_events(n, spectra, af_spectra, first_event=start, seed=3 + k)
+                        for k, (start, n) in enumerate([(0, 1_000), (1_000, 1_000), (2_000, 500)])])
+    np.testing.assert_allclose(sample.get_events(source='raw'), events, rtol=1e-6)
+
+
+def test_run_benchmarks_times_every_stage(tmp_path):
+    from honeychrome.benchmarks import run_benchmarks, stages
+
+    results = run_benchmarks([5_000, 10_000], directory=tmp_path, n_detectors=8, n_fluorophores=4, n_af=2, n_export_samples=2)
+    assert [run['n_events'] for run in results['runs']] == [5_000, 10_000]
+    for run in results['runs']:
+        assert list(run['stages']) == stages
+        assert all(seconds > 0 for seconds in run['stages'].values())
+        assert run['total'] == sum(run['stages'].values())
+    assert results['config']['n_detectors'] == 8
+    assert not list(tmp_path.iterdir()) # the samples are cleaned up
+    json.loads(json.dumps(results))
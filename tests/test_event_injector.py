@@ -0,0 +1,19 @@
+"""
+test_event_injector.py
+----------------------
+The controller's live path driven by the event injector: events written into
+the events cache are displayed, none skipped, without Qt or an instrument. The
+rates it sustains are machine-dependent, so are reported by the benchmark and
+not asserted here.
+"""
+
+
+def test_live_path_displays_injected_events(tmp_path):
+    from honeychrome.event_injector import benchmark_live_path
+
+    results = benchmark_live_path(tmp_path / 'live benchmark', rates=[2_000], duration=1)
+    [result] = results['rates']
+    assert result['rate'] == 2_000 and result['n_plots'] > 1
+    assert result['n_injected'] > 0 and result['n_skipped'] == 0
+    assert 0 < result['n_displayed'] <= result['n_injected'] # the last batch may still be in flight
+    assert (tmp_path / 'live benchmark').exists() # the live samples were written into the experiment
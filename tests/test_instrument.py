@@ -0,0 +1,79 @@
+"""
+test_instrument.py
+------------------
+Tests for the instrument side of acquisition: traces read out are recorded
+as they are pushed into the traces ring, and a recording replays the same
+traces, in the same blobs, paced as recorded or as fast as the ring takes them.
+"""
+
+import numpy as np
+import pytest
+
+RNG = np.random.default_rng(11)
+
+
+def _blobs(sizes):
+    from honeychrome.settings import trace_n_points
+
+    return [RNG.integers(0, 65535, size=n * trace_n_points, dtype=np.uint16) for n in sizes]
+
+
+@pytest.mark.numpy_only
+def test_recorded_traces_replay_in_order_and_on_time(tmp_path):
+    import threading
+    import time
+    from honeychrome.controller_components.shared_ring import SharedRing
+    from honeychrome.instrument_communicator import Instrument
+    from honeychrome.instrument_driver_components.replay_driver import ReplayDevice
+    from honeychrome.instrument_driver_components.trace_recording import TraceRecording
+    from honeychrome.settings import trace_n_points
+
+    blobs = _blobs([3, 0, 5, 4])
+    traces_ring = SharedRing(8, np.uint16, record_shape=(trace_n_points,))
+    try:
+        # record what the instrument reads out, including what does not fit in the ring
+        instrument = Instrument(traces_ring=traces_ring)
+        instrument.stop_transfer = threading.Event()
+        instrument.recorder_lock = threading.Lock() # as in run()
+        instrument.record_traces(tmp_path / 'run')
+        with pytest.warns(UserWarning, match='Traces cache is full'):
+            for blob in blobs:
+                instrument.push_to_traces_cache(blob)
+                time.sleep(0.02)
+        assert instrument.record_traces(None)['message'] == 'Recorded 12 traces'
+        assert traces_ring.cursor('tail') == 8
+
+        recording = TraceRecording(tmp_path / 'run.traces')
+        assert recording.n_traces == 12 and list(recording.times['end']) == [3, 8, 12]
+        np.testing.assert_array_equal(recording.traces.reshape(-1), np.concatenate(blobs))
+        assert recording.duration >= 0.04 and recording.traces_until(recording.times['time'][1]) == 8
+
+        # as fast as possible, in reads of at most max_events_per_read, until it is finished
+        device = ReplayDevice(tmp_path / 'run', speed=None, max_events_per_read=5)
+        device.connect_to_device()
+        device.start_acquisition()
+        replayed = []
+        while not device.finished:
+            replayed.append(device.read_out_traces())
+        assert [len(blob) // trace_n_points for blob in replayed] == [5, 5, 2]
+        np.testing.assert_array_equal(np.concatenate(replayed), np.concatenate(blobs))
+
+        # at (20x) the recorded pace: the first blob at once, the rest as their times come round
+        device = ReplayDevice(tmp_path / 'run', speed=20)
+        device.connect_to_device()
+        device.start_acquisition()
+        assert len(device.read_out_traces()) == 3 * trace_n_points
+        time.sleep(recording.duration / 20 + 0.05)
+        assert len(device.read_out_traces()) == 9 * trace_n_points and device.finished
+
+        # replaying into the ring through the instrument waits for space rather than dropping traces
+        instrument.device = device
+        traces_ring.reset()
+        threading.Timer(0.1, traces_ring.advance, ('head', 4)).start()
+        instrument.push_to_traces_cache(blobs[0])
+        instrument.push_to_traces_cache(blobs[2])
+        instrument.push_to_traces_cache(blobs[3])
+        assert traces_ring.cursor('tail') == 12
+    finally:
+        traces_ring.close()
+        traces_ring.unlink()
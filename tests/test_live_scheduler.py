@@ -0,0 +1,64 @@
+"""
+test_live_scheduler.py
+----------------------
+Tests for the live update scheduler: batches are sized from the measured
+event rate and processing cost, and overload and sustained lag are detected
+from the same measurements.
+"""
+
+import pytest
+
+
+def _scheduler():
+    from honeychrome.controller_components.live_scheduler import LiveUpdateScheduler
+
+    return LiveUpdateScheduler(min_batch=100, target_interval=0.05, max_batch=100_000, utilisation=0.8, lag_warning=1.0, smoothing=1.0)
+
+
+@pytest.mark.numpy_only
+def test_batches_follow_rate_and_cost():
+    scheduler = _scheduler()
+    scheduler.reset(0.)
+    assert scheduler.min_batch_events() == 100 and scheduler.max_batch_wait() == 0.05 # nothing measured yet
+
+    # 50k events/s, cheap updates: one target interval of events per update
+    scheduler.record_update(2_500, 4, 4, 0.005, now=0.05)
+    assert scheduler.rate == pytest.approx(50_000)
+    assert scheduler.min_batch_events() == 2_500 and scheduler.max_batch_wait() == pytest.approx(0.05)
+    assert not scheduler.overloaded and not scheduler.lagging
+
+    # a trickle of events: never less than min_batch
+    scheduler.record_update(5, 4, 4, 0.001, now=1.05)
+    assert scheduler.min_batch_events() == 100
+
+    # updates taking 0.45 s: the interval stretches to keep within the processing budget, and batches grow with it
+    scheduler.reset(0.)
+    scheduler.record_update(25_000, 4, 4, 0.45, now=0.5)
+    assert scheduler.max_batch_wait() == pytest.approx(0.5625)
+    assert scheduler.min_batch_events() == 28_125
+    assert scheduler.overloaded # 0.45 s of processing every 0.5 s is more than 0.8 of the time
+
+
+@pytest.mark.numpy_only
+def test_overload_with_hysteresis_lag_and_skipped_events():
+    scheduler = _scheduler()
+    scheduler.reset(0.)
+
+    # too slow to process every event into all 9 plots (with gating as the tenth) at this rate
+    scheduler.record_update(10_000, 9, 9, 0.9, now=1.)
+    assert scheduler.load(9) == pytest.approx(0.9) and scheduler.overloaded
+
+    # updating 2 visible plots costs less per update, but the predicted load of all plots stays over budget
+    scheduler.record_update(10_000, 2, 9, 0.27, now=2.)
+    assert scheduler.overloaded
+    # just under the budget is not enough to leave overload...
+    scheduler.record_update(7_500, 2, 9, 0.2025, now=3.)
+    assert scheduler.load(9) == pytest.approx(0.675) and scheduler.overloaded
+    # ...well under it is
+    scheduler.record_update(5_000, 2, 9, 0.135, now=4.)
+    assert not scheduler.overloaded
+
+    # updates 2 s apart with events skipped: lagging, and reported as such
+    scheduler.record_update(100_000, 9, 9, 0.1, now=6., n_skipped=40_000)
+    assert scheduler.lagging and scheduler.n_skipped == 40_000
+    assert 'lagging 2.0 s' in scheduler.status() and '40000 events not displayed' in scheduler.status()
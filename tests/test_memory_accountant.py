@@ -0,0 +1,93 @@
+"""
+test_memory_accountant.py
+-------------------------
+The memory accountant counts shared arrays once and reports the loaded sample's
+structures, and keeps a controller to budget by evicting caches, downcasting the
+event data and lowering the display cap, in that order.
+"""
+import warnings
+
+import numpy as np
+
+import honeychrome.settings as settings
+from honeychrome.controller_components.memory_accountant import nbytes
+
+
+def test_nbytes_counts_shared_arrays_and_views_once():
+    a = np.zeros((1000, 4))
+    b = np.zeros(100, dtype=np.bool_)
+    assert nbytes({'a': a, 'view': a[:10, 1], 'list': [a, b], 'b': b}) == a.nbytes + b.nbytes
+    seen = set()
+    assert nbytes(a, seen) == a.nbytes and nbytes({'again': a.T}, seen) == 0
+
+
+def _loaded_controller(n_events):
+    from honeychrome.benchmarks import (synthetic_spectra, synthetic_raw_settings, spectral_pnn, synthetic_spectral_events,
+                                        transfer_matrix_from_process, gated_controller)
+    from honeychrome.controller_components.functions import apply_transfer_matrix
+    from honeychrome.controller_components.spectral_functions import calculate_spectral_process
+
+    spectra, af_spectra = synthetic_spectra(n_detectors=8, n_fluorophores=4, n_af=2)
+    raw_settings = synthetic_raw_settings(spectral_pnn(8))
+    spectral_model = [{'label': f'Fluor {n:02d}'} for n in range(1, 5)]
+    profiles = {control['label']: spectrum.tolist() for control, spectrum in zip(spectral_model, spectra)}
+    unmixed_settings, spectral_process = calculate_spectral_process(raw_settings, spectral_model, profiles)
+
+    controller = gated_controller(unmixed_settings)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # no events bus connected
+        controller.calculate_lookup_tables(mode='unmixed')
+    controller.current_sample_path = 'Samples/synthetic.fcs'
+    controller.raw_event_data = synthetic_spectral_events(n_events, spectra, af_spectra, first_event=0, seed=1)
+    controller.unmixed_event_data = apply_transfer_matrix(
+        transfer_matrix_from_process(raw_settings, unmixed_settings, spectral_process), controller.raw_event_data)
+    controller.initialise_data_for_cytometry_plots()
+    return controller
+
+
+def test_report_and_enforce_budget(monkeypatch):
+    monkeypatch.setattr(settings, 'memory_min_display_events', 5_000)
+    controller = _loaded_controller(40_000)
+    memory = controller.memory
+    controller.af_combined_cache = {('AF',): ({'matrix': np.zeros((1000, 1000))}, np.zeros((2, 8)))}
+    evicted = []
+    memory.register('plugin copy', lambda: np.zeros(10), evict=lambda: evicted.append(True) or 0)
+
+    report = memory.report()
+    structures = report['structures']
+    assert structures['raw_event_data'] == controller.raw_event_data.nbytes
+    assert structures['unmixed_event_data'] == controller.unmixed_event_data.nbytes
+    masks = controller.data_for_cytometry_plots_unmixed['gate_membership']
+    assert len(masks) > 1 and structures['data_for_cytometry_plots_unmixed'] >= sum(mask.nbytes for mask in masks.values())
+    assert structures['af_combined_cache'] == 8_000_000 + 2 * 8 * 8
+    assert structures['plugin copy'] == 80
+    assert report['total'] == sum(structures.values())
+    assert report['samples']['Samples/synthetic.fcs'] > structures['raw_event_data'] + structures['unmixed_event_data']
+
+    # within budget: nothing done
+    memory.budget = report['total'] + 1
+    assert memory.enforce() == []
+
+    # just over budget: the caches go, which is enough
+    memory.budget = report['total'] - 1_000_000
+    steps = memory.enforce()
+    assert len(steps) == 1 and steps[0].startswith('evicted caches') and evicted
+    assert controller.af_combined_cache == {}
+
+    # over budget by more than the event data is worth at float32: downcast, then subsample
+    total = memory.report()['total']
+    memory.budget = total - (controller.raw_event_data.nbytes + controller.unmixed_event_data.nbytes) // 2 - 1_000_000
+    steps = memory.enforce()
+    assert steps[0].startswith('downcast') and steps[1].startswith('lowered display cap')
+    assert controller.raw_event_data.dtype == np.float32 and controller.unmixed_event_data.dtype == np.float32
+    n_events = len(controller.raw_event_data)
+    assert settings.memory_min_display_events <= n_events < 40_000
+    # the lowered cap is the loaded sample's only, and only under this budget
+    max_display_events = settings.max_display_events
+    assert memory.display_cap('Samples/synthetic.fcs') == n_events and memory.display_cap('Samples/other.fcs') == max_display_events
+    assert len(controller.unmixed_event_data) == n_events
+    assert controller.data_for_cytometry_plots_unmixed['event_data'] is controller.unmixed_event_data
+    assert all(len(mask) == n_events for mask in controller.data_for_cytometry_plots_unmixed['gate_membership'].values())
+    assert memory.report()['total'] <= memory.budget
+    memory.budget = 0
+    assert memory.display_cap('Samples/synthetic.fcs') == max_display_events
@@ -0,0 +1,210 @@
+"""
+test_nxn_engine.py
+------------------
+Tests for the NxN process plot engine: tiles are the full-resolution 2D
+histograms rebinned to tile resolution, however and in whatever order the
+events and tiles are counted.
+"""
+
+import numpy as np
+import pytest
+
+CHANNELS = ['F1', 'F2', 'F3', 'F4']
+TILE_BINS = 30
+RNG = np.random.default_rng(3)
+
+
+def _make_data(n_events=5_000):
+    event_data = np.column_stack([RNG.uniform(-50, 1_050, size=n_events) for _ in CHANNELS])
+    event_data[:10, 0] = 1_000.0 # on the closed right edge
+    mask = RNG.random(n_events) < 0.8
+    scales = [np.linspace(0, 1_000, 201), np.geomspace(1, 1_000, 151), np.linspace(0, 1_000, 101), np.linspace(-100, 1_100, 257)]
+    return event_data, mask, scales
+
+
+def _expected_tile(event_data, mask, scales, x, y):
+    from honeychrome.controller_components.functions import scale_hist2d_for_display
+
+    full, _, _ = np.histogram2d(event_data[mask, x], event_data[mask, y], bins=[scales[x], scales[y]])
+    map_x = np.arange(len(scales[x]) - 1) * TILE_BINS // (len(scales[x]) - 1)
+    map_y = np.arange(len(scales[y]) - 1) * TILE_BINS // (len(scales[y]) - 1)
+    tile = np.zeros((TILE_BINS, TILE_BINS))
+    np.add.at(tile, (map_x[:, None], map_y[None, :]), full)
+    return scale_hist2d_for_display(tile, 0)
+
+
+def _engine(scales, max_workers=1):
+    from honeychrome.controller_components.nxn_engine import NxNHistogramEngine
+
+    engine = NxNHistogramEngine(TILE_BINS, max_workers=max_workers)
+    engine.reset(CHANNELS, scales, density_cutoff=0)
+    return engine
+
+
+@pytest.mark.numpy_only
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_tiles_match_rebinned_histogram2d(max_workers):
+    event_data, mask, scales = _make_data()
+    engine = _engine(scales, max_workers)
+    engine.add_events(event_data, mask, list(range(len(CHANNELS))))
+    assert engine.compute_tiles() == len(CHANNELS) * (len(CHANNELS) - 1)
+
+    for x, channel_x in enumerate(CHANNELS):
+        for y, channel_y in enumerate(CHANNELS):
+            if x != y:
+                np.testing.assert_array_equal(engine.tile(channel_x, channel_y), _expected_tile(event_data, mask, scales, x, y))
+
+
+@pytest.mark.numpy_only
+def test_events_added_in_chunks_and_updated_channels():
+    event_data, mask, scales = _make_data()
+    channel_ids = list(range(len(CHANNELS)))
+    engine = _engine(scales)
+
+    # one tile counted before the second chunk arrives, the rest counted afterwards from all events
+    engine.add_events(event_data[:2_000], mask[:2_000], channel_ids)
+    engine.tile('F1', 'F2')
+    version = engine.tile_version('F1', 'F2')
+    engine.add_events(event_data[2_000:], mask[2_000:], channel_ids)
+    assert engine.tile_version('F1', 'F2') != version
+    assert engine.n_events == mask.sum()
+    np.testing.assert_array_equal(engine.tile('F1', 'F2'), _expected_tile(event_data, mask, scales, 0, 1))
+    np.testing.assert_array_equal(engine.tile('F3', 'F4'), _expected_tile(event_data, mask, scales, 2, 3))
+
+    # a channel changed in place: only tiles involving it change
+    engine.compute_tiles()
+    unchanged = engine.tile_version('F1', 'F2')
+    event_data[:, 2] *= 0.9
+    engine.update_channels(['F3'], event_data, mask, channel_ids)
+    assert engine.tile_version('F1', 'F2') == unchanged
+    np.testing.assert_array_equal(engine.tile('F3', 'F1'), _expected_tile(event_data, mask, scales, 2, 0))
+    np.testing.assert_array_equal(engine.tile('F4', 'F3'), _expected_tile(event_data, mask, scales, 3, 2))
+
+    # unknown channels and the diagonal are blank
+    assert not engine.tile('F1', 'F1').any()
+    assert not engine.tile('F1', 'missing').any()
+
+
+@pytest.mark.numpy_only
+def test_scheduler_counts_in_priority_order_and_cancels():
+    import threading
+    from honeychrome.controller_components.nxn_engine import TileScheduler
+
+    event_data, mask, scales = _make_data()
+    engine = _engine(scales)
+    engine.add_events(event_data, mask, list(range(len(CHANNELS))))
+
+    batches = []
+    done = threading.Event()
+    n_tiles = len(CHANNELS) * (len(CHANNELS) - 1)
+
+    def tiles_ready(keys):
+        batches.append(keys)
+        if sum(len(b) for b in batches) == n_tiles:
+            done.set()
+
+    scheduler = TileScheduler(engine, tiles_ready)
+    priorities = {(x, y): (0 if y == 'F4' else 1, n) for n, (x, y) in enumerate(
+        (x, y) for y in CHANNELS for x in CHANNELS if x != y)}
+    scheduler.schedule(priorities)
+    assert done.wait(10)
+    scheduler.stop()
+
+    # the high-priority row first, each row counted as one batch, everything counted exactly once
+    assert [{y for x, y in batch} for batch in batches] == [{'F4'}, {'F1'}, {'F2'}, {'F3'}]
+    assert sorted(k for b in batches for k in b) == sorted(priorities)
+    assert all(engine.is_counted(*key) for key in priorities)
+
+    # cancelled requests are never counted
+    engine.reset(CHANNELS, scales)
+    scheduler = TileScheduler(engine, lambda keys: None)
+    with scheduler._condition: # hold the worker off until the queue has been cancelled
+        scheduler.request(('F1', 'F2'), (0, 0))
+        scheduler.cancel()
+    scheduler.stop()
+    assert scheduler.pending == 0 and not engine.is_counted('F1', 'F2')
+
+
+@pytest.mark.numpy_only
+def test_stopped_scheduler_and_renderer_report_nothing_more():
+    import threading
+    from honeychrome.controller_components.memory_accountant import MemoryAccountant
+    from honeychrome.controller_components.nxn_engine import TileScheduler
+    from honeychrome.view_components.tile_renderer import TileRenderer
+
+    event_data, mask, scales = _make_data()
+    engine = _engine(scales)
+    engine.add_events(event_data, mask, list(range(len(CHANNELS))))
+    reported = []
+
+    # a batch being counted when the scheduler is stopped is not reported
+    counting, release = threading.Event(), threading.Event()
+
+    class SlowEngine:
+        def compute_tiles(self, batch):
+            counting.set()
+            release.wait(10)
+
+    scheduler = TileScheduler(SlowEngine(), reported.append)
+    scheduler.request(('F1', 'F2'), (0, 0))
+    assert counting.wait(10)
+    scheduler.stop()
+    release.set()
+    scheduler._thread.join(10)
+    assert not scheduler._thread.is_alive() and reported == []
+
+    # tiles queued after shutdown are not rendered, and shutting down twice is harmless
+    renderer = TileRenderer(engine, reported.append, max_bytes=2**20)
+    renderer.set_colormap('test', False, np.array([[0, 0, 0, 255]], dtype=np.uint32), TILE_BINS)
+    renderer.shutdown()
+    renderer.render([('F1', 'F2')])
+    renderer.shutdown()
+    assert reported == [] and renderer.image(('F1', 'F2')) is None
+
+    # only the grid that registered its tile images unregisters them
+    memory = MemoryAccountant(None, budget=0)
+    size = lambda: 0
+    memory.register('nxn_tile_images', size)
+    memory.unregister('nxn_tile_images', lambda: 0)
+    assert 'nxn_tile_images' in memory._registered
+    memory.unregister('nxn_tile_images', size)
+    assert 'nxn_tile_images' not in memory._registered
+
+
+@pytest.mark.numpy_only
+def test_rendered_tiles_cached_by_version_within_byte_budget():
+    import threading
+    from honeychrome.view_components.tile_renderer import TileImageCache, TileRenderer, render_tile_argb
+
+    color_table = np.array([[0, 0, 0, 255], [255, 0, 0, 255], [0, 0, 255, 255]], dtype=np.uint32)
+    tile = np.zeros((TILE_BINS, TILE_BINS))
+    tile[2, 5] = 4 # x bin 2, y bin 5
+    argb = render_tile_argb(tile, color_table, TILE_BINS)
+    assert argb.dtype == np.uint32 and argb.shape == (TILE_BINS, TILE_BINS)
+    assert argb[TILE_BINS - 1 - 5, 2] == 0xFF0000FF # maximum -> last colour, y drawn upwards
+    assert argb[0, 0] == 0xFF000000
+    assert render_tile_argb(tile, color_table, 2 * TILE_BINS).shape == (2 * TILE_BINS, 2 * TILE_BINS)
+
+    cache = TileImageCache(max_bytes=3 * argb.nbytes)
+    for n in range(4):
+        cache.put(n, argb.copy())
+    assert len(cache) == 3 and cache.get(0) is None and cache.n_bytes == 3 * argb.nbytes
+
+    event_data, mask, scales = _make_data()
+    engine = _engine(scales)
+    engine.add_events(event_data, mask, list(range(len(CHANNELS))))
+    rendered = threading.Event()
+    renderer = TileRenderer(engine, lambda keys: rendered.set(), max_bytes=2**20)
+    renderer.set_colormap('test', False, color_table, TILE_BINS)
+
+    engine.tile('F1', 'F2')
+    assert renderer.image(('F1', 'F2')) is None
+    renderer.render([('F1', 'F2'), ('F2', 'F3')]) # F2 vs F3 is not counted yet and is skipped
+    assert rendered.wait(5)
+    renderer.shutdown()
+    np.testing.assert_array_equal(renderer.image(('F1', 'F2')), render_tile_argb(engine.tile('F1', 'F2'), color_table, TILE_BINS))
+    assert renderer.image(('F2', 'F3')) is None
+
+    # a new version of the tile is a cache miss until it is rendered again
+    engine.add_events(event_data[:100], None, list(range(len(CHANNELS))))
+    assert renderer.image(('F1', 'F2')) is None
@@ -0,0 +1,39 @@
+"""
+test_startup.py
+---------------
+Cold start: in a fresh interpreter, the first window (the splash screen) shows
+before the controller, view and their heavy dependencies are imported. The time
+it takes is only bounded loosely (it depends on the machine and its load), by
+HONEYCHROME_MAX_SECONDS_TO_FIRST_WINDOW if set.
+"""
+import json
+import os
+import subprocess
+import sys
+
+# from importing honeychrome.main, with the offscreen Qt platform: a sanity bound, not a benchmark
+max_seconds_to_first_window = float(os.environ.get('HONEYCHROME_MAX_SECONDS_TO_FIRST_WINDOW', 30))
+
+heavy_modules = ['honeychrome.controller', 'honeychrome.view', 'flowkit', 'pandas', 'pyqtgraph', 'colorcet', 'sklearn',
+                 'scipy', 'matplotlib', 'sentry_sdk']
+
+first_window = f'''
+import json, sys, time
+started = time.perf_counter()
+import honeychrome.main as main
+from honeychrome.instrument_communicator import Instrument
+from honeychrome.trace_analyst import TraceAnalyser
+app, splash = main.show_first_window([])
+print(json.dumps({{'seconds': time.perf_counter() - started, 'visible': splash.isVisible(),
+                  'imported': [module for module in {heavy_modules!r} if module in sys.modules]}}))
+'''
+
+
+def test_first_window_shows_before_heavy_imports():
+    env = os.environ | {'QT_QPA_PLATFORM': 'offscreen'}
+    result = subprocess.run([sys.executable, '-c', first_window], capture_output=True, text=True, env=env, timeout=max(60, 2 * max_seconds_to_first_window))
+    assert result.returncode == 0, result.stderr
+    first = json.loads(result.stdout.strip().splitlines()[-1])
+    assert first['visible']
+    assert first['imported'] == []
+    assert first['seconds'] < max_seconds_to_first_window
@@ -0,0 +1,161 @@
+"""
+test_statistics_engine.py
+-------------------------
+Tests for the batch statistics engine: serial and process-pool calculation
+agree, and per-sample cache entries are reused only while their key matches.
+"""
+
+import multiprocessing as mp
+
+import numpy as np
+import pytest
+
+mp.set_start_method("spawn", force=True)
+
+PNN = ['FSC-A', 'SSC-A', 'B1-A', 'B2-A']
+REQUESTS = [
+    ('root', 'Number of Events', None),
+    ('root', '% Total Events', None),
+    ('root', 'Mean B1-A', 'B1-A'),
+    ('root', 'Intensity B2-A', 'B2-A'),
+]
+
+
+def _write_samples(folder, n_samples=3, n_events=200):
+    from honeychrome.controller_components.functions import write_fcs
+
+    keywords = {}
+    for i, label in enumerate(PNN, 1):
+        keywords.update({f'$P{i}N': label, f'$P{i}B': '32', f'$P{i}E': '0,0', f'$P{i}R': '262144'})
+    rng = np.random.default_rng(0)
+    paths = {}
+    for n in range(n_samples):
+        path = folder / f'sample_{n}.fcs'
+        write_fcs((rng.random((n_events + n, len(PNN))) * 10_000).astype(np.float32), keywords, path)
+        paths[f'Raw/sample_{n}.fcs'] = str(path)
+    return paths
+
+
+def _plain_jobs(paths):
+    return {sample_key: (path, None) for sample_key, path in paths.items()}
+
+
+def _make_context():
+    from flowkit import GatingStrategy
+    from honeychrome.controller_components.functions import assign_default_transforms, generate_transformations
+
+    settings = {'event_channels_pnn': PNN, 'scatter_channel_ids': [0, 1], 'fluorescence_channel_ids': [2, 3],
+                'magnitude_ceiling': 2**18, 'width_ceiling': 50_000, 'default_ceiling': 60, 'width_channels': []}
+    return {
+        'transfer_matrix': np.eye(len(PNN)),
+        'whitelisted_pnn': PNN,
+        'pnn': PNN,
+        'transformations': generate_transformations(assign_default_transforms(settings)),
+        'lookup_tables': {},
+        'gating': GatingStrategy(),
+    }
+
+
+@pytest.mark.numpy_only
+def test_process_pool_matches_serial(tmp_path):
+    from honeychrome.controller_components.statistics_engine import run_statistics_jobs
+
+    jobs = _plain_jobs(_write_samples(tmp_path))
+    context = _make_context()
+    serial = dict(run_statistics_jobs(jobs, context, REQUESTS, max_workers=1))
+    pooled = dict(run_statistics_jobs(jobs, context, REQUESTS, max_workers=2))
+
+    assert serial.keys() == pooled.keys() == jobs.keys()
+    for n, sample_key in enumerate(jobs):
+        assert serial[sample_key]['status'] == 'ok'
+        assert serial[sample_key]['values'] == pooled[sample_key]['values']
+        assert serial[sample_key]['values'][('root', 'Number of Events')] == 200 + n
+
+
+@pytest.mark.numpy_only
+def test_cache_reused_only_for_matching_key(tmp_path):
+    from honeychrome.controller_components.statistics_engine import (
+        calculate_sample_statistics, gating_hash, load_cached_statistics, sample_cache_key,
+        save_cached_statistics, array_hash,
+    )
+
+    sample_key, path = next(iter(_write_samples(tmp_path, n_samples=1).items()))
+    context = _make_context()
+    cache_dir = tmp_path / 'cache'
+    key = sample_cache_key(path, array_hash(context['transfer_matrix']), gating_hash(context), None)
+
+    assert load_cached_statistics(cache_dir, sample_key, key, REQUESTS) is None
+    result = calculate_sample_statistics(path, REQUESTS, context=context)
+    save_cached_statistics(cache_dir, sample_key, key, result['values'])
+    assert load_cached_statistics(cache_dir, sample_key, key, REQUESTS) == result['values']
+
+    # a request not yet in the entry is a miss
+    assert load_cached_statistics(cache_dir, sample_key, key, REQUESTS + [('root', '% Parent', None)]) is None
+
+    # changing the transfer matrix or the AF assignment changes the key
+    other_tm = sample_cache_key(path, array_hash(2 * context['transfer_matrix']), gating_hash(context), None)
+    other_af = sample_cache_key(path, array_hash(context['transfer_matrix']), gating_hash(context), 'AF1')
+    assert load_cached_statistics(cache_dir, sample_key, other_tm, REQUESTS) is None
+    assert load_cached_statistics(cache_dir, sample_key, other_af, REQUESTS) is None
+
+
+@pytest.mark.numpy_only
+def test_af_profile_set_matches_apply_af_transfer(tmp_path):
+    """Batch statistics for an AF-assigned sample use the same AF-corrected unmixing as the controller."""
+    from flowkit import GatingStrategy
+    from honeychrome.controller_components.autospectral_functions import (
+        apply_af_transfer, precompute_af_matrices, precompute_joint_cov_extras,
+    )
+    from honeychrome.controller_components.functions import (
+        assign_default_transforms, generate_transformations, sample_from_fcs, write_fcs,
+    )
+    from honeychrome.controller_components.statistics_engine import calculate_sample_statistics
+
+    raw_pnn = ['FSC-A', 'SSC-A'] + [f'B{n}-A' for n in range(1, 7)]
+    unmixed_pnn = ['FSC-A', 'SSC-A', 'F1', 'F2', 'F3']
+    fl_ids_raw = list(range(2, 8))
+    fluor_spectra = np.array([np.roll([1.0, 0.5, 0.25, 0.1, 0.05, 0.02], n) for n in range(3)])
+    af_spectra = np.array([[0.3, 0.5, 0.8, 1.0, 0.7, 0.4], [1.0, 0.8, 0.4, 0.2, 0.1, 0.1]])
+
+    rng = np.random.default_rng(1)
+    raw = np.zeros((300, len(raw_pnn)))
+    raw[:, :2] = rng.uniform(1_000, 50_000, size=(300, 2))
+    raw[:, 2:] = rng.exponential(500, size=(300, 3)) @ fluor_spectra + rng.exponential(200, size=(300, 1)) * af_spectra[0]
+    keywords = {}
+    for i, label in enumerate(raw_pnn, 1):
+        keywords.update({f'$P{i}N': label, f'$P{i}B': '32', f'$P{i}E': '0,0', f'$P{i}R': '262144'})
+    path = tmp_path / 'af_sample.fcs'
+    write_fcs(raw.astype(np.float32), keywords, path)
+
+    transfer_matrix = np.zeros((len(raw_pnn), len(unmixed_pnn)))
+    transfer_matrix[0, 0] = transfer_matrix[1, 1] = 1
+    transfer_matrix[2:, 2:] = np.linalg.pinv(fluor_spectra)
+    precomputed = precompute_af_matrices(fluor_spectra, af_spectra)
+    precomputed.update(precompute_joint_cov_extras(precomputed, af_spectra))
+    experiment_settings = {'raw': {'fluorescence_channel_ids': fl_ids_raw}, 'unmixed': {'fluorescence_channel_ids': [2, 3, 4]}}
+    transform_settings = {'event_channels_pnn': unmixed_pnn, 'scatter_channel_ids': [0, 1], 'fluorescence_channel_ids': [2, 3, 4],
+                          'magnitude_ceiling': 2**18, 'width_ceiling': 50_000, 'default_ceiling': 60, 'width_channels': []}
+    context = {
+        'transfer_matrix': transfer_matrix,
+        'whitelisted_pnn': raw_pnn,
+        'pnn': unmixed_pnn,
+        'transformations': generate_transformations(assign_default_transforms(transform_settings)),
+        'lookup_tables': {},
+        'gating': GatingStrategy(),
+        'settings': experiment_settings,
+        'spillover': None,
+        'af_fl_ids': fl_ids_raw,
+        'af_sets': {('AF',): (precomputed, af_spectra)},
+    }
+    requests = [('root', 'Mean F1', 'F1')]
+
+    raw_event_data = sample_from_fcs(str(path)).get_events(source='raw', col_order=raw_pnn)
+    expected = apply_af_transfer(raw_event_data, transfer_matrix, precomputed, af_spectra, experiment_settings,
+                                 filtered_fl_ids_raw=fl_ids_raw)['unmixed'][:, 2].mean()
+    plain = (raw_event_data @ transfer_matrix)[:, 2].mean()
+
+    with_af = calculate_sample_statistics(str(path), requests, af_key=('AF',), context=context)['values'][('root', 'Mean F1')]
+    without_af = calculate_sample_statistics(str(path), requests, context=context)['values'][('root', 'Mean F1')]
+    assert with_af == pytest.approx(expected)
+    assert without_af == pytest.approx(plain)
+    assert with_af != pytest.approx(without_af)
@@ -0,0 +1,101 @@
+"""
+test_timing.py
+--------------
+Timing spans: off they cost nothing and record nothing; on they add up per stage,
+nest, and are written as a Chrome trace.
+"""
+import json
+import time
+
+import pytest
+
+from honeychrome.controller_components import timing
+
+
+@pytest.fixture
+def spans():
+    timing.reset()
+    yield timing
+    timing.disable()
+    timing.reset()
+
+
+def test_spans_off_record_nothing(spans):
+    spans.disable()
+
+    @spans.traced('stage')
+    def f(x):
+        return x + 1
+
+    assert spans.span('stage') is spans.span('other') # the shared do-nothing context manager
+    with spans.span('stage'):
+        pass
+    assert f(1) == 2
+    assert spans.stage_timings() == {}
+
+
+def test_spans_add_up_per_stage_and_nest(spans):
+    spans.enable()
+
+    @spans.traced('inner')
+    def inner():
+        time.sleep(0.01)
+
+    for _ in range(3):
+        with spans.span('outer', n_events=10):
+            inner()
+
+    timings = spans.stage_timings()
+    assert list(timings) == ['inner', 'outer']
+    assert timings['inner']['count'] == 3 and timings['outer']['count'] == 3
+    assert timings['outer']['total'] >= timings['inner']['total'] >= 0.03
+    assert timings['inner']['longest'] >= timings['inner']['mean'] > 0
+    assert 'inner' in spans.summary() and spans.summary(stages=['outer']).startswith('outer ')
+    assert not spans.is_tracing() and spans.chrome_trace()['traceEvents'][:-1] == []
+
+    since = time.perf_counter()
+    with spans.span('later'):
+        pass
+    assert list(spans.stage_timings(since=since)) == ['later']
+
+
+def test_chrome_trace(spans, tmp_path):
+    spans.enable(trace=True)
+    with spans.span('outer', n_events=10):
+        with spans.span('inner'):
+            pass
+
+    path = tmp_path / 'cache' / 'timing' / 'session.trace.json'
+    assert spans.write_chrome_trace(path) == 2
+    trace = json.loads(path.read_text())
+    events = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert [event['name'] for event in events] == ['inner', 'outer'] # in the order they finished
+    inner, outer = events
+    assert outer['args'] == {'n_events': 10}
+    assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert trace['otherData']['stage_timings']['outer']['count'] == 1
+
+
+def test_phase_timer(spans):
+    startup = spans.PhaseTimer()
+    with startup.phase('imports'):
+        time.sleep(0.01)
+    startup.mark('first_window')
+    with startup.phase('view'):
+        pass
+    startup.mark('main_window')
+
+    report = startup.report()
+    assert list(report['phases']) == ['imports', 'view'] and report['phases']['imports'] >= 0.01
+    assert report['marks']['main_window'] >= report['marks']['first_window'] >= report['phases']['imports']
+    assert startup.summary().startswith('first_window at ') and 'imports 0.0' in startup.summary()
+    assert spans.stage_timings() == {} # spans are off, the phases are timed anyway
+
+
+def test_trace_setting_turns_spans_on(spans):
+    spans.configure(spans=False, trace=True)
+    assert spans.is_enabled() and spans.is_tracing()
+    spans.configure(spans=True, trace=False)
+    assert spans.is_enabled() and not spans.is_tracing()
+    spans.configure(spans=False, trace=False)
+    assert not spans.is_enabled() and not spans.is_tracing()
@@ -0,0 +1,390 @@
+"""
+test_trace_analyst.py
+---------------------
+Tests for the trace analyser's batch peak detector: it must find the same
+peak windows and baselines as the per-trace state machine, and measure the
+same areas, heights and widths.
+"""
+
+import numpy as np
+import pytest
+
+RNG = np.random.default_rng(7)
+
+
+def _make_traces(n_traces=400, n_channels=4):
+    from honeychrome.settings import n_time_points_in_event, threshold
+
+    t = np.arange(n_time_points_in_event)
+    traces = RNG.normal(0, 2_000, size=(n_traces, n_channels, n_time_points_in_event)) + RNG.uniform(-5e4, 5e4, size=(n_traces, 1, 1))
+    kind = np.arange(n_traces) % 5
+    centres = RNG.uniform(60, 240, size=n_traces)
+    widths = RNG.uniform(3, 25, size=n_traces)
+    heights = RNG.uniform(1.5, 20, size=(n_traces, n_channels)) * threshold * 1000
+    pulses = np.exp(-0.5 * ((t[None, :] - centres[:, None]) / widths[:, None]) ** 2)
+    pulses[kind == 1] = 0 # no peak
+    pulses[kind == 2] = t[None, :] > centres[kind == 2, None] # step that never falls back
+    pulses[kind == 3] += np.exp(-0.5 * ((t[None, :] - centres[kind == 3, None] - 40) / 5) ** 2) # second peak during the countdown
+    pulses[kind == 4] = np.exp(-0.5 * ((t[None, :] - 285) / 4) ** 2) # peak at the end of the trace
+    traces += heights[:, :, None] * pulses[:, None, :]
+    return traces.astype(np.float32)
+
+
+@pytest.mark.numpy_only
+def test_batch_peak_detection_matches_per_trace():
+    from honeychrome.settings import deltaT
+    from honeychrome.trace_analyst import (
+        peak_measurements, peak_measurements_batch, peak_start_stop_baseline, peak_start_stop_baseline_batch,
+    )
+
+    traces = _make_traces()
+    area_indices = [True, True, False, True]
+    height_indices = [True, False, True, True]
+
+    n_start, n_end, baseline = peak_start_stop_baseline_batch(traces[:, 0, :])
+    expected = [peak_start_stop_baseline(tr[0]) for tr in traces]
+    np.testing.assert_array_equal(n_start, [e[0] for e in expected])
+    np.testing.assert_array_equal(n_end, [e[1] for e in expected])
+    np.testing.assert_allclose(baseline, [e[2] for e in expected], rtol=1e-4, atol=1)
+    assert 0.5 < np.mean(n_start > 0) < 1 # a mix of traces with and without peaks
+
+    kept = np.flatnonzero(n_start > 0)
+    (areas, heights, widths, centres), baselines = peak_measurements_batch(
+        traces[kept], n_start[kept], n_end[kept], deltaT, area_indices, height_indices, chunk_size=64)
+    for m, n in enumerate(kept):
+        (e_areas, e_heights, e_width, e_centre), e_baselines = peak_measurements(traces[n], n_start[n], n_end[n], deltaT, area_indices, height_indices)
+        np.testing.assert_allclose(baselines[m], e_baselines, rtol=1e-4, atol=1)
+        np.testing.assert_allclose(areas[m], e_areas, rtol=1e-4, atol=100)
+        np.testing.assert_allclose(heights[m], e_heights, rtol=1e-4, atol=1)
+        assert widths[m] == e_width and centres[m] == e_centre
+
+
+@pytest.mark.numpy_only
+def test_worker_pool_preserves_event_order_across_the_rings(tmp_path):
+    import threading
+    import time
+    from honeychrome.settings import adc_scale_mv, nearly_floor_uint16
+    import flowio
+    from honeychrome.controller_components.events_spill import EventsSpillWriter, events_cache_dtype, events_to_float
+    from honeychrome.controller_components.functions import StreamingFCSWriter, define_raw_fcs_keywords
+    from honeychrome.controller_components.oscilloscope_slot import OscilloscopeSlot
+    from honeychrome.controller_components.shared_ring import SharedRing
+    from honeychrome.settings import event_channels_pnn
+    from honeychrome.trace_analyst import TraceAnalyser
+
+    n_ring, n_events_ring, n_traces, n_push = 600, 300, 1_500, 250
+    traces = _make_traces(n_traces, 16)
+    raw = np.clip(np.rint(traces * adc_scale_mv / 1000 + nearly_floor_uint16), 0, 65535).astype(np.uint16)
+
+    traces_ring = SharedRing(n_ring, np.uint16, record_shape=(raw[0].size,))
+    events_ring = SharedRing(n_events_ring, events_cache_dtype(event_channels_pnn), cursors=('head', 'spilled'), release='spilled')
+    analyser = TraceAnalyser(traces_ring=traces_ring, events_ring=events_ring, n_workers=3, max_slice_events=40)
+    analyser.oscilloscope_slot = OscilloscopeSlot()
+    try:
+        analyser.stop_analyser = threading.Event()
+        analyser.create_worker_pool()
+        analyser.start_workers()
+        fcs_writer = StreamingFCSWriter(tmp_path / 'live.fcs', define_raw_fcs_keywords(event_channels_pnn, 'live', 2**18), len(event_channels_pnn))
+        spill = EventsSpillWriter(lambda events: fcs_writer.append(events_to_float(events)), events_ring, 0.02)
+        spill.start()
+        coordinator = threading.Thread(target=analyser.coordinate)
+        coordinator.start()
+
+        # the instrument side: push into the ring (wrapping round it) as the committed head frees space
+        tail = 0
+        deadline = time.monotonic() + 60
+        while tail < n_traces and time.monotonic() < deadline:
+            if n_push <= traces_ring.space(tail):
+                traces_ring.advance('reserved', tail + n_push)
+                traces_ring.write(tail, raw[tail:tail + n_push].reshape(n_push, -1))
+                tail += n_push
+                traces_ring.publish(tail)
+                analyser.traces_ready.notify()
+            time.sleep(0.01)
+        while traces_ring.cursor('head') < n_traces and time.monotonic() < deadline:
+            time.sleep(0.05)
+        analyser.stop_analyser.set()
+        coordinator.join(30)
+        assert not coordinator.is_alive()
+        assert traces_ring.cursor('head') == n_traces
+        assert spill.stop() == events_ring.cursor('tail') == fcs_writer.close()
+
+        # the same events, in the same order with consecutive event_ids, as analysing the whole block at once, all spilled through the events ring
+        scaled = (raw - nearly_floor_uint16).astype(np.float32) / adc_scale_mv * 1000 # as read_traces
+        kept, (areas, heights, widths, centres), _ = analyser.measure(scaled)
+        events = np.reshape(flowio.FlowData(tmp_path / 'live.fcs').events, (-1, len(event_channels_pnn)))
+        assert len(events) == len(kept) > n_events_ring
+        np.testing.assert_array_equal(events[:, analyser.index_event_id_in_events], np.arange(len(kept)))
+        np.testing.assert_array_equal(events[:, analyser.indices_height_channels_in_events], heights.astype(np.float32))
+        np.testing.assert_array_equal(events[:, analyser.index_width_channel_in_events], widths.astype(np.float32))
+        assert np.all(np.diff(events[:, analyser.index_time_channel_in_events]) >= 0)
+        _, oscilloscope = analyser.oscilloscope_slot.read()
+        assert oscilloscope['event_id'] < len(kept) and oscilloscope['traces'].shape == scaled[0].shape
+    finally:
+        analyser.oscilloscope_slot.close()
+        analyser.oscilloscope_slot.unlink()
+        for shared_ring in (traces_ring, events_ring):
+            shared_ring.close()
+            shared_ring.unlink()
+
+
+@pytest.mark.numpy_only
+def test_single_process_path_commits_as_the_worker_pool_does():
+    import threading
+    import time
+    from honeychrome.settings import adc_scale_mv, nearly_floor_uint16, event_channels_pnn
+    from honeychrome.controller_components.events_spill import events_cache_dtype
+    from honeychrome.controller_components.oscilloscope_slot import OscilloscopeSlot
+    from honeychrome.controller_components.shared_ring import SharedRing
+    from honeychrome.trace_analyst import TraceAnalyser
+
+    traces = _make_traces(200, 16)
+    raw = np.clip(np.rint(traces * adc_scale_mv / 1000 + nearly_floor_uint16), 0, 65535).astype(np.uint16)
+    quiet = np.full_like(raw[:50], nearly_floor_uint16) # no events in these
+
+    traces_ring = SharedRing(400, np.uint16, record_shape=(raw[0].size,))
+    events_ring = SharedRing(400, events_cache_dtype(event_channels_pnn))
+    analyser = TraceAnalyser(traces_ring=traces_ring, events_ring=events_ring, n_workers=1)
+    analyser.oscilloscope_slot = OscilloscopeSlot()
+    kept, _, _ = analyser.measure((raw - nearly_floor_uint16).astype(np.float32) / adc_scale_mv * 1000) # as read_traces
+    assert kept[0] == 0 # an event in the first trace of the batch counts as any other
+
+    def push(begin, batch):
+        traces_ring.advance('reserved', begin + len(batch))
+        traces_ring.write(begin, batch.reshape(len(batch), -1))
+        traces_ring.publish(begin + len(batch))
+        analyser.traces_ready.notify()
+
+    def wait_for_head(n):
+        deadline = time.monotonic() + 30
+        while traces_ring.cursor('head') < n and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return traces_ring.cursor('head')
+
+    analyser.stop_analyser = threading.Event()
+    thread = threading.Thread(target=analyser.analyse)
+    thread.start()
+    try:
+        # traces without events are released, not analysed again and again
+        push(0, quiet)
+        assert wait_for_head(len(quiet)) == len(quiet) and events_ring.cursor('tail') == 0
+        push(len(quiet), raw)
+        assert wait_for_head(len(quiet) + len(raw)) == len(quiet) + len(raw)
+        assert events_ring.cursor('tail') == len(kept)
+    finally:
+        analyser.stop_analyser.set()
+        analyser.traces_ready.notify()
+        thread.join(30)
+        analyser.oscilloscope_slot.close()
+        analyser.oscilloscope_slot.unlink()
+        for shared_ring in (traces_ring, events_ring):
+            shared_ring.close()
+            shared_ring.unlink()
+
+
+@pytest.mark.numpy_only
+def test_shared_ring_wraps_and_drops_overwritten_records():
+    import threading
+    from honeychrome.controller_components.shared_ring import SharedRing
+
+    ring = SharedRing(8, np.float32, record_shape=(2,), cursors=('head', 'spilled'), release='spilled')
+    reader = SharedRing(**ring.__getstate__()) # attached by name, as when it is passed to another process
+    try:
+        records = np.arange(24, dtype=np.float32).reshape(12, 2)
+        assert ring.space(0) == 8
+
+        # producer: reserve, write, publish; the consumer sees the records only once published
+        ring.advance('reserved', 6)
+        ring.write(0, records[:6])
+        assert reader.cursor('tail') == 0
+        ring.publish(6)
+        assert reader.cursor('tail') == 6
+
+        # the releasing consumer frees space; a range wrapping round the ring is written and read as two views
+        reader.advance('spilled', 6)
+        assert ring.space(6) == 8
+        ring.advance('reserved', 12)
+        ring.write(6, records[6:12])
+        ring.publish(12)
+        views = reader.views(6, 12)
+        assert [len(view) for view in views] == [2, 4]
+        np.testing.assert_array_equal(np.concatenate(views), records[6:12])
+
+        # a reader that does not release records gets only those not overwritten by the time it finished
+        data, first = reader.read(2, 12)
+        assert first == 4
+        np.testing.assert_array_equal(data, records[4:12])
+        ring.advance('reserved', 14) # records 6 and 7 are about to be overwritten
+        data, first = reader.read(4, 12)
+        assert first == 6
+        np.testing.assert_array_equal(data, records[6:12])
+
+        # a cursor that does not release records is read and written without the lock (releasing ones wait for it)
+        with ring._fence:
+            moved = threading.Thread(target=reader.advance, args=('head', 9), daemon=True)
+            moved.start()
+            moved.join(5)
+            assert not moved.is_alive() and reader.cursor('head') == 9
+            released = threading.Thread(target=reader.advance, args=('spilled', 9), daemon=True)
+            released.start()
+            released.join(0.1)
+            assert released.is_alive()
+        released.join(5)
+        assert reader.cursor('spilled') == 9
+
+        ring.reset()
+        assert [reader.cursor(name) for name in reader.cursors] == [0, 0, 0, 0]
+    finally:
+        reader.close()
+        ring.close()
+        ring.unlink()
+
+
+@pytest.mark.numpy_only
+def test_spill_failure_is_reported_and_releases_the_ring():
+    from honeychrome.controller_components.events_spill import EventsSpillWriter
+    from honeychrome.controller_components.shared_ring import SharedRing
+
+    ring = SharedRing(8, np.float32, cursors=('head', 'spilled'), release='spilled')
+    written, failures = [], []
+
+    def write(events):
+        if len(written) == 1:
+            raise OSError('No space left on device')
+        written.append(events.copy())
+
+    def produce(begin, end):
+        ring.advance('reserved', end)
+        ring.write(begin, np.arange(begin, end, dtype=np.float32))
+        ring.publish(end)
+
+    try:
+        spill = EventsSpillWriter(write, ring, 60, on_failure=failures.append)
+        spill.start()
+        produce(0, 5)
+        assert spill.spill_or_drop() == 5 and ring.cursor('spilled') == 5
+
+        # the disk fills: reported once, and the events are released unwritten so the producer is not held up
+        produce(5, 8)
+        assert spill.spill_or_drop() == 0
+        assert [str(e) for e in failures] == ['No space left on device'] and isinstance(spill.error, OSError)
+        assert ring.cursor('spilled') == 8 and spill.n_dropped == 3 and ring.space(8) == 8
+        produce(8, 12)
+
+        # stopping drops what is left, without raising
+        assert spill.stop() == 5 and spill.n_dropped == 7 and ring.cursor('spilled') == 12
+        assert len(failures) == 1
+        np.testing.assert_array_equal(written[0], np.arange(5))
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+@pytest.mark.numpy_only
+def test_streamed_fcs_file_is_readable_before_it_is_closed(tmp_path):
+    from honeychrome.controller_components.functions import StreamingFCSWriter, define_raw_fcs_keywords, sample_from_fcs
+
+    pnn = ['Time', 'FSC-A', 'B1-A']
+    events = RNG.uniform(0, 1e5, size=(5_000, len(pnn))).astype(np.float32)
+    writer = StreamingFCSWriter(tmp_path / 'live.fcs', define_raw_fcs_keywords(pnn, 'live', 2**18), len(pnn))
+    writer.append(events[:1_000])
+    writer.append(events[1_000:3_000])
+
+    # as left by a crash mid-acquisition: every event appended so far
+    sample = sample_from_fcs(tmp_path / 'live.fcs', None)
+    assert sample.pnn_labels == pnn and sample.metadata['tubename'] == 'live'
+    np.testing.assert_array_equal(sample.get_events(source='raw'), events[:3_000])
+
+    writer.append(events[3_000:])
+    assert writer.close() == len(events)
+    np.testing.assert_array_equal(sample_from_fcs(tmp_path / 'live.fcs', None).get_events(source='raw'), events)
+
+
+@pytest.mark.numpy_only
+def test_oscilloscope_slot_reads_the_latest_trace():
+    from honeychrome.controller_components.oscilloscope_slot import OscilloscopeSlot
+
+    writer = OscilloscopeSlot(n_channels=3, n_time_points=10)
+    reader = OscilloscopeSlot(**writer.__getstate__()) # attached by name, with the same lock, as in another process
+    try:
+        assert reader.read() == (0, None) # nothing written yet
+
+        traces = RNG.normal(size=(3, 10)).astype(np.float32)
+        writer.write({'event_id':5, 'time':1234, 'n_start':2, 'n_end':7, 'traces':traces, 'baselines':np.arange(3.0), 'peak':None})
+        sequence, trace = reader.read()
+        assert trace['event_id'] == 5 and trace['time'] == 1234 and (trace['n_start'], trace['n_end']) == (2, 7)
+        np.testing.assert_array_equal(trace['traces'], traces)
+        np.testing.assert_array_equal(trace['baselines'], np.arange(3.0))
+        assert reader.read(sequence) == (sequence, None) # nothing newer
+
+        # each write is one step of the sequence, and only the latest is read
+        for event_id in (6, 7):
+            writer.write({'event_id':event_id, 'time':1235, 'n_start':2, 'n_end':7, 'traces':traces * 0, 'baselines':np.zeros(3), 'peak':None})
+        newest, trace = reader.read(sequence)
+        assert newest == sequence + 2 and trace['event_id'] == 7 and not trace['traces'].any()
+    finally:
+        reader.close()
+        writer.close()
+        writer.unlink()
+
+
+@pytest.mark.numpy_only
+def test_wakeup_wakes_on_commit_and_batches():
+    import threading
+    import time
+    from honeychrome.controller_components.wakeup import Wakeup
+
+    wakeup = Wakeup()
+    n = [0]
+    stop = threading.Event()
+
+    def commit(n_items, delay):
+        time.sleep(delay)
+        n[0] += n_items
+        wakeup.notify()
+
+    # wakes as soon as a batch is committed, well before the timeout
+    threading.Thread(target=commit, args=(10, 0.05)).start()
+    t0 = time.monotonic()
+    assert wakeup.wait(lambda: n[0], min_batch=10, max_batch_wait=5, timeout=5) == 10
+    assert time.monotonic() - t0 < 2
+
+    # a part batch waits for max_batch_wait after it is first seen, then returns what there is
+    n[0] = 3
+    t0 = time.monotonic()
+    assert wakeup.wait(lambda: n[0], min_batch=100, max_batch_wait=0.1, timeout=5) == 3
+    assert 0.1 <= time.monotonic() - t0 < 2
+
+    # nothing committed: returns after the timeout, or as soon as stopped
+    n[0] = 0
+    assert wakeup.wait(lambda: n[0], timeout=0.05) == 0
+    threading.Thread(target=lambda: (time.sleep(0.05), stop.set(), wakeup.notify())).start()
+    t0 = time.monotonic()
+    assert wakeup.wait(lambda: n[0], timeout=5, stop=stop) == 0
+    assert time.monotonic() - t0 < 2
+
+
+@pytest.mark.numpy_only
+def test_synthetic_device_traces_are_measured_at_their_population_heights():
+    from honeychrome.instrument_driver_components.synthetic_driver import SyntheticDevice
+    from honeychrome.settings import n_channels_trace, n_time_points_in_event
+    from honeychrome.trace_analyst import TraceAnalyser
+
+    populations = [{'fraction': 0.75, 'heights': {'FSC': 1000, 'B3': 500}, 'cv': 0.05, 'width_us': 4},
+                   {'fraction': 0.25, 'heights': {'FSC': 600, 'B9': 800}, 'cv': 0.05, 'width_us': 4}]
+    device = SyntheticDevice(event_rate=2_000, populations=populations, noise_mv=3, coincidence=0, seed=1)
+    analyser = TraceAnalyser()
+
+    # events arrive at the set rate
+    device.start_acquisition()
+    device.last_read -= 0.5
+    blob = device.read_out_traces()
+    n = len(blob) // (n_channels_trace * n_time_points_in_event)
+    assert 850 < n < 1_150 and device.n_events == n
+
+    kept, (areas, heights, widths, centres), _ = analyser.measure(analyser.scale_traces(blob))
+    assert len(kept) == n # every event triggers
+    fsc = heights[:, 0] / 1000 # mV
+    bright = fsc > 800
+    assert 0.65 < bright.mean() < 0.85
+    assert np.median(fsc[bright]) == pytest.approx(1000, rel=0.05) and np.median(fsc[~bright]) == pytest.approx(600, rel=0.05)